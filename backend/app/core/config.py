@@ -10,5 +10,55 @@ class Settings:
     INDEX_DIR: str = "./search_index"
     CORS_ORIGINS: list[str] = field(default_factory=lambda: ["*"])
 
+    # Indexing
+    INDEX_WRITE_BEHIND: bool = True  # batch index commits in a background writer
+    INDEX_BATCH_SIZE: int = 200  # pending documents that trigger a commit
+    INDEX_COMMIT_INTERVAL: float = 1.0  # max seconds an update waits for commit
+    INDEX_MAX_ATTEMPTS: int = 5  # failed commits before a document's update is dropped
+    INDEX_WRITER: str = "local"  # "remote" = send updates to the index_server process
+    INDEX_SOCKET: str = "./search_index.sock"  # Unix socket of the index_server process
+    INDEX_CLIENT_TIMEOUT: float = 30.0  # seconds a worker waits on index_server, flushes included
+    SEARCH_STORE_CONTENT: bool = False  # keep full text in the index (new indexes only)
+    INDEX_MAINTENANCE_ENABLED: bool = True  # background segment merges
+    INDEX_MAINTENANCE_INTERVAL: float = 300.0  # seconds between segment checks
+    INDEX_MAINTENANCE_WINDOW: str = ""  # quiet window "HH:MM-HH:MM"; empty = any time
+    INDEX_MERGE_MAX_SEGMENTS: int = 10  # merge when the index has more segments
+    INDEX_MERGE_MAX_DELETED_RATIO: float = 0.2  # optimize above this deleted-doc ratio
+    INDEX_FILE_GRACE: float = 300.0  # seconds superseded NumPy segment files are kept for readers
+
+    # Search execution
+    SEARCH_BACKEND: str = "whoosh"  # "whoosh", "numpy" or "sqlite" (FTS5)
+    SEARCH_SHARDS: int = 1  # whoosh index shards routed by doc_id hash; searched in parallel
+    SEARCH_MAX_CONCURRENCY: int = 4  # worker threads dedicated to search
+    SEARCH_MAX_QUEUE: int = 64  # waiting searches before 503; 0 = unbounded
+    SEARCH_SEARCHER_POOL_SIZE: int = 4  # idle searchers kept open between queries
+    SEARCH_EXACT_TOTAL: bool = True  # False = estimate totals instead of counting
+    SEARCH_FILTER_CACHE_SIZE: int = 256  # cached filter doc sets; 0 = disabled
+    SEARCH_RESULT_CACHE_SIZE: int = 1024  # cached result pages; 0 = disabled
+    SEARCH_RESULT_CACHE_TTL: float = 300.0  # seconds; 0 = until next commit
+    SEARCH_SUGGEST_CACHE_SIZE: int = 1024  # cached prefix suggestions; 0 = disabled
+    SEARCH_DID_YOU_MEAN_MAX_HITS: int = 2  # offer a spelling correction at or below this
+    SEARCH_SPELL_MAX_DISTANCE: int = 2  # edits a correction may make per word; 0 = disabled
+    SEARCH_SPELL_PREFIX_LENGTH: int = 7  # characters of each term in the deletion index
+    SEARCH_RECENCY_HALF_LIFE_DAYS: float = 30.0  # sort=recency halves relevance per this age
+    SEARCH_CURSOR_MAX_PINS: int = 8  # index snapshots held open for cursor paging
+    SEARCH_CURSOR_TTL: float = 300.0  # seconds an unused cursor snapshot stays pinned
+    SEARCH_EXPORT_BATCH_SIZE: int = 500  # hits an export reads per executor call
+    SEARCH_LSA_DIMS: int = 128  # latent dimensions of python -m app.services.embeddings
+    SEARCH_HYBRID_CANDIDATES: int = 100  # BM25 hits re-ranked by hybrid search
+    SEARCH_HYBRID_WEIGHT: float = 0.3  # share of embedding similarity in hybrid scores
+    SEARCH_HIGHLIGHT_CONTEXT: int = 100  # characters of context around matches
+    SEARCH_HIGHLIGHT_FRAGMENTS: int = 2  # snippet fragments per hit
+    SEARCH_WARMUP: bool = True  # load jieba and prime the index before serving
+    SEARCH_WARMUP_QUERIES: list[str] = field(default_factory=lambda: ["文档", "document"])
+    JIEBA_CACHE_FILE: str = ""  # jieba dictionary cache path; empty = jieba default
+
+    # Near-duplicate detection
+    DEDUP_ENABLED: bool = True  # MinHash-sign uploads and report near-duplicates
+    DEDUP_SHINGLE_CHARS: int = 5  # characters per shingle of normalized text
+    DEDUP_NUM_PERM: int = 128  # MinHash functions; re-sign with python -m app.services.dedup --fresh
+    DEDUP_BANDS: int = 16  # LSH bands of DEDUP_NUM_PERM / DEDUP_BANDS values each
+    DEDUP_THRESHOLD: float = 0.8  # estimated Jaccard similarity of a near-duplicate
+
 
 settings = Settings()
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 from collections.abc import AsyncGenerator
+from typing import Optional
 
+from fastapi import Depends
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -26,6 +28,38 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    return AsyncSessionLocal
+
+
+class LazySession:
+    """An ``AsyncSession`` opened on the first :meth:`get`, for endpoints
+    that need the database only for some requests."""
+
+    def __init__(self, factory: async_sessionmaker[AsyncSession]):
+        self._factory = factory
+        self._session: Optional[AsyncSession] = None
+
+    def get(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+async def get_lazy_db(
+    factory: async_sessionmaker[AsyncSession] = Depends(get_session_factory),
+) -> AsyncGenerator[LazySession, None]:
+    session = LazySession(factory)
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
 async def init_db() -> None:
     try:
         from .. import models  # noqa: F401
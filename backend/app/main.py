@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
+import time
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -13,13 +16,36 @@ from .routers.folders import router as folders_router
 from .routers.health import router as health_router
 from .routers.search import router as search_router
 from .routers.tags import router as tags_router
+from .services.search_service import get_search_service, shutdown_search_service
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_search() -> None:
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(
+            get_search_service().warm_up, settings.SEARCH_WARMUP_QUERIES
+        )
+    except Exception:
+        logger.exception("Search warm-up failed; continuing with lazy initialization")
+    logger.info("Startup: search warm-up took %.1f ms", (time.perf_counter() - started) * 1000)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    started = time.perf_counter()
     await init_db()
+    logger.info("Startup: database init took %.1f ms", (time.perf_counter() - started) * 1000)
+    if settings.SEARCH_WARMUP:
+        await warm_up_search()
+    if settings.INDEX_WRITE_BEHIND:
+        await get_search_service().start_write_behind()
+    if settings.INDEX_MAINTENANCE_ENABLED:
+        get_search_service().start_maintenance()
     yield
+    await shutdown_search_service()
 
 
 app = FastAPI(title="Doc Search API", lifespan=lifespan)
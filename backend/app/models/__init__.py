@@ -2,7 +2,15 @@ from __future__ import annotations
 
 from .document import Document, DocumentTag
 from .folder import Folder
+from .minhash import DocumentSignature, document_bands
 from .tag import Tag
 
-__all__ = ["Document", "Folder", "Tag", "DocumentTag"]
+__all__ = [
+    "Document",
+    "Folder",
+    "Tag",
+    "DocumentTag",
+    "DocumentSignature",
+    "document_bands",
+]
 
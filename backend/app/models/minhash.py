@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, LargeBinary, Table
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ..core.database import Base
+
+# LSH buckets: one row per (band, bucket) a document's signature falls into
+document_bands = Table(
+    "document_bands",
+    Base.metadata,
+    Column("band", Integer, primary_key=True),
+    Column("bucket", BigInteger, primary_key=True),  # signed 64-bit hash of the band
+    Column("document_id", ForeignKey("documents.id"), primary_key=True),
+    Index("ix_document_bands_document_id", "document_id"),
+)
+
+
+class DocumentSignature(Base):
+    __tablename__ = "document_signatures"
+
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), primary_key=True)
+    signature: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)  # uint32 MinHash values
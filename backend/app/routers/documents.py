@@ -38,11 +38,19 @@ class DocumentListResponse(BaseModel):
     total: int
 
 
+class DuplicateResponse(DocumentResponse):
+    similarity: float  # estimated Jaccard similarity of the text shingles
+
+
+class UploadResponse(DocumentResponse):
+    duplicates: List[DuplicateResponse] = []
+
+
 class MoveDocumentRequest(BaseModel):
     folder_id: Optional[int] = None
 
 
-@router.post("", response_model=DocumentResponse)
+@router.post("", response_model=UploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
     folder_id: Optional[int] = None,
@@ -74,11 +82,25 @@ async def upload_document(
     content = b"".join(chunks)
 
     service = DocumentService(db)
-    document = await service.save_document(file.filename, content, file_type, folder_id)
-    return document
+    document, duplicates = await service.save_document(
+        file.filename, content, file_type, folder_id
+    )
+    return UploadResponse(
+        **DocumentResponse.model_validate(document).model_dump(),
+        duplicates=_duplicates(duplicates),
+    )
 
 
-@router.post("/upload", response_model=DocumentResponse, include_in_schema=False)
+def _duplicates(matches) -> List[DuplicateResponse]:
+    return [
+        DuplicateResponse(
+            **DocumentResponse.model_validate(doc).model_dump(), similarity=similarity
+        )
+        for doc, similarity in matches
+    ]
+
+
+@router.post("/upload", response_model=UploadResponse, include_in_schema=False)
 async def upload_document_legacy(
     file: UploadFile = File(...),
     folder_id: Optional[int] = None,
@@ -108,6 +130,15 @@ async def get_document(document_id: int, db: AsyncSession = Depends(get_db)):
     return doc
 
 
+@router.get("/{document_id}/duplicates", response_model=List[DuplicateResponse])
+async def get_document_duplicates(document_id: int, db: AsyncSession = Depends(get_db)):
+    """Documents whose text nearly matches this one, most similar first."""
+    service = DocumentService(db)
+    if not await service.get_document(document_id):
+        raise HTTPException(404, "Document not found")
+    return _duplicates(await service.find_duplicates(document_id))
+
+
 @router.get("/{document_id}/file")
 async def download_document_file(document_id: int, db: AsyncSession = Depends(get_db)):
     service = DocumentService(db)
@@ -1,10 +1,16 @@
+import json
 import time
+from contextlib import aclosing
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from app.core.database import LazySession, get_lazy_db
+from app.services.dedup import DuplicateService
+from app.services.search_cursor import CursorExpiredError
 from app.services.search_service import get_search_service
 
 router = APIRouter(prefix="/api", tags=["search"])
@@ -16,11 +22,16 @@ class SearchResultItem(BaseModel):
     folder_id: Optional[int]
     score: float
     highlight: str
+    duplicates: Optional[List[int]] = None  # near-duplicates folded into this hit
 
 
 class SearchResponse(BaseModel):
     items: List[SearchResultItem]
     total: int
+    total_exact: bool = True
+    did_you_mean: Optional[str] = None
+    facets: Optional[Dict[str, Dict[str, int]]] = None
+    next_cursor: Optional[str] = None
     took_ms: int
 
 
@@ -29,25 +40,49 @@ async def search_documents(
     q: str = Query(..., min_length=1, description="Search query"),
     type: Optional[str] = Query(None, description="Filter by file type"),
     folder_id: Optional[int] = Query(None, description="Filter by folder"),
+    include_subfolders: bool = Query(
+        True, description="Also match documents in the folder's subfolders"
+    ),
     tag_ids: Optional[str] = Query(None, description="Filter by tag IDs (comma-separated)"),
     date_from: Optional[datetime] = Query(None, description="Filter by date from"),
     date_to: Optional[datetime] = Query(None, description="Filter by date to"),
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    exact_total: Optional[bool] = Query(
+        None, description="Count every match instead of estimating the total"
+    ),
+    facets: bool = Query(
+        False, description="Include hit counts per file type, folder, tag and year"
+    ),
+    sort: str = Query(
+        "relevance",
+        description="relevance, recency (relevance decayed by age), or created_at, "
+        "file_size, doc_id; prefix a field with '-' for descending",
+    ),
+    cursor: Optional[str] = Query(
+        None,
+        description="'*' for the first page, then the previous page's next_cursor; "
+        "pages stay consistent while the cursor is live. Cannot be combined with skip",
+    ),
+    hybrid: bool = Query(
+        False,
+        description="Re-rank the best BM25 hits by latent semantic similarity to the query",
+    ),
+    collapse_duplicates: bool = Query(
+        False,
+        description="Fold near-duplicates on the page into their best-ranked copy; "
+        "the page may come back shorter than limit",
+    ),
+    db: LazySession = Depends(get_lazy_db),
 ):
     start = time.time()
 
     search_service = get_search_service()
 
-    tag_id_list = None
-    if tag_ids:
-        try:
-            tag_id_list = [int(t.strip()) for t in tag_ids.split(",") if t.strip()]
-        except ValueError as exc:
-            raise HTTPException(400, "Invalid tag_ids format") from exc
+    tag_id_list = _parse_tag_ids(tag_ids)
 
     try:
-        items, total = search_service.search(
+        result = await search_service.asearch(
             query=q,
             file_type=type,
             folder_id=folder_id,
@@ -56,14 +91,117 @@ async def search_documents(
             date_to=date_to,
             skip=skip,
             limit=limit,
+            exact_total=exact_total,
+            facets=facets,
+            include_subfolders=include_subfolders,
+            sort=sort,
+            cursor=cursor,
+            hybrid=hybrid,
         )
+    except CursorExpiredError as exc:
+        raise HTTPException(410, str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
     except RuntimeError as exc:
         raise HTTPException(503, str(exc)) from exc
 
+    items = result.items
+    if collapse_duplicates:
+        # Only collapsing reads the database, so plain searches open no session
+        items = await DuplicateService(db.get()).collapse(items)
+
     took_ms = int((time.time() - start) * 1000)
 
     return SearchResponse(
         items=[SearchResultItem(**item) for item in items],
-        total=total,
+        total=result.total,
+        total_exact=result.total_exact,
+        did_you_mean=result.did_you_mean,
+        facets=result.facets,
+        next_cursor=result.next_cursor,
         took_ms=took_ms,
     )
+
+
+def _parse_tag_ids(tag_ids: Optional[str]) -> Optional[List[int]]:
+    if not tag_ids:
+        return None
+    try:
+        return [int(t.strip()) for t in tag_ids.split(",") if t.strip()]
+    except ValueError as exc:
+        raise HTTPException(400, "Invalid tag_ids format") from exc
+
+
+@router.get("/search/export")
+async def export_search(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Search query"),
+    type: Optional[str] = Query(None, description="Filter by file type"),
+    folder_id: Optional[int] = Query(None, description="Filter by folder"),
+    include_subfolders: bool = Query(
+        True, description="Also match documents in the folder's subfolders"
+    ),
+    tag_ids: Optional[str] = Query(None, description="Filter by tag IDs (comma-separated)"),
+    date_from: Optional[datetime] = Query(None, description="Filter by date from"),
+    date_to: Optional[datetime] = Query(None, description="Filter by date to"),
+):
+    """Stream every match as NDJSON, one hit with its metadata and score per
+    line, in index order rather than ranked."""
+    batches = get_search_service().aexport(
+        q,
+        file_type=type,
+        folder_id=folder_id,
+        tag_ids=_parse_tag_ids(tag_ids),
+        date_from=date_from,
+        date_to=date_to,
+        include_subfolders=include_subfolders,
+    )
+    # The first batch is read up front so errors still get a status code
+    try:
+        first = await anext(batches, None)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    except RuntimeError as exc:
+        raise HTTPException(503, str(exc)) from exc
+
+    async def lines():
+        async with aclosing(batches):
+            batch = first
+            while batch:
+                yield "".join(json.dumps(hit, ensure_ascii=False) + "\n" for hit in batch)
+                if await request.is_disconnected():
+                    return
+                batch = await anext(batches, None)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+class Suggestion(BaseModel):
+    term: str
+    df: int
+
+
+class SuggestResponse(BaseModel):
+    items: List[Suggestion]
+    took_ms: float
+
+
+@router.get("/search/suggest", response_model=SuggestResponse)
+async def suggest_terms(
+    prefix: str = Query(..., min_length=1, description="Text typed so far"),
+    limit: int = Query(10, ge=1, le=50),
+):
+    start = time.time()
+    try:
+        items = await get_search_service().asuggest(prefix, limit)
+    except RuntimeError as exc:
+        raise HTTPException(503, str(exc)) from exc
+    return SuggestResponse(
+        items=[Suggestion(**item) for item in items],
+        took_ms=round((time.time() - start) * 1000, 2),
+    )
+
+
+@router.get("/search/stats")
+async def search_stats():
+    return get_search_service().stats()
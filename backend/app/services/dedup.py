@@ -0,0 +1,348 @@
+"""Near-duplicate detection with MinHash signatures and LSH banding.
+
+Usage::
+
+    python -m app.services.dedup [--fresh] [--chunk-size N]
+
+A document's text is case-folded, its whitespace collapsed, and cut into
+overlapping shingles of ``DEDUP_SHINGLE_CHARS`` characters, which needs no
+word segmentation for CJK text. Its MinHash signature keeps, for each of
+``DEDUP_NUM_PERM`` hash functions, the smallest hash over its shingles; two
+signatures agree in a position with probability equal to the Jaccard
+similarity of the two shingle sets.
+
+The signature is split into ``DEDUP_BANDS`` bands and each band is hashed to
+a bucket row in ``document_bands``. Candidates are the documents sharing any
+bucket, one indexed lookup per band instead of a scan of every signature, and
+are kept when the fraction of agreeing positions reaches ``DEDUP_THRESHOLD``.
+With ``b`` bands of ``r`` rows a pair of similarity ``s`` becomes a candidate
+with probability ``1 - (1 - s**r)**b``; the defaults (16 x 8) find a pair at
+0.8 about 99.8% of the time and one at 0.5 about 6%.
+
+Uploads are signed by ``DocumentService.save_document``. The job signs the
+documents that have no signature yet; after changing ``DEDUP_NUM_PERM`` or
+``DEDUP_BANDS`` run it with ``--fresh`` to re-sign everything.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import Document, DocumentSignature, document_bands
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE = (1 << 61) - 1
+_CHUNK = 2048  # shingles hashed per step; bounds the (chunk, perm) matrix
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass(frozen=True)
+class DuplicateMatch:
+    document_id: int
+    similarity: float
+
+
+def shingle_hashes(text: str, size: int) -> "np.ndarray":
+    """Distinct 64-bit hashes of the ``size``-character shingles of ``text``."""
+    normalized = _WHITESPACE.sub(" ", text.casefold()).strip()
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    size = min(size, len(codes))
+    # Polynomial hash of every window at once, wrapping modulo 2**64
+    hashes = np.zeros(len(codes) - size + 1, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(size):
+            hashes = hashes * np.uint64(1099511628211) + codes[offset : offset + len(hashes)]
+    return np.unique(hashes)
+
+
+class MinHasher:
+    """Signs texts with ``num_perm`` universal hashes ``(a*x + b) mod 2**61-1``."""
+
+    def __init__(self, num_perm: int, bands: int, shingle_size: int, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("DEDUP_NUM_PERM must be a multiple of DEDUP_BANDS")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MERSENNE, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> Optional["np.ndarray"]:
+        """The uint32 signature of ``text``, or None when it has no shingles."""
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) == 0:
+            return None
+        # Fold to 32 bits, the operand width _mulmod supports
+        values = (hashes >> np.uint64(32)) ^ (hashes & np.uint64(0xFFFFFFFF))
+        signature = np.full(self.num_perm, _MERSENNE, dtype=np.uint64)
+        for start in range(0, len(values), _CHUNK):
+            chunk = values[start : start + _CHUNK, None]
+            permuted = (_mulmod(chunk, self.a) + self.b) % np.uint64(_MERSENNE)
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        # The low 32 bits of each minimum are stored; collisions are 2**-32 rare
+        return (signature & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def buckets(self, signature: "np.ndarray") -> List[Tuple[int, int]]:
+        """``(band, bucket)`` of each band of ``signature``."""
+        return [
+            (
+                band,
+                int.from_bytes(
+                    hashlib.blake2b(
+                        signature[band * self.rows : (band + 1) * self.rows].tobytes(),
+                        digest_size=8,
+                    ).digest(),
+                    "little",
+                    signed=True,
+                ),
+            )
+            for band in range(self.bands)
+        ]
+
+
+def _mulmod(x: "np.ndarray", a: "np.ndarray") -> "np.ndarray":
+    """``x * a mod 2**61-1`` for ``x < 2**32`` and ``a < 2**61`` without overflow."""
+    # Split a into 29- and 32-bit halves; each partial product fits in 64 bits
+    mask = np.uint64((1 << 32) - 1)
+    low = x * (a & mask)
+    high = (x * (a >> np.uint64(32))) % np.uint64(_MERSENNE)
+    # high * 2**32 mod 2**61-1: rotate the 61-bit value left by 32
+    high = ((high << np.uint64(32)) & np.uint64(_MERSENNE)) + (high >> np.uint64(29))
+    return (low % np.uint64(_MERSENNE) + high) % np.uint64(_MERSENNE)
+
+
+def similarity(first: "np.ndarray", second: "np.ndarray") -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    if len(first) != len(second):
+        return 0.0
+    return float(np.mean(first == second))
+
+
+_hasher: Optional[MinHasher] = None
+
+
+def get_hasher() -> MinHasher:
+    global _hasher
+    key = (settings.DEDUP_NUM_PERM, settings.DEDUP_BANDS, settings.DEDUP_SHINGLE_CHARS)
+    if _hasher is None or (_hasher.num_perm, _hasher.bands, _hasher.shingle_size) != key:
+        _hasher = MinHasher(*key)
+    return _hasher
+
+
+def _decode(blob: bytes) -> "np.ndarray":
+    return np.frombuffer(blob, dtype=np.uint32)
+
+
+class DuplicateService:
+    """Signature storage and LSH lookups on the caller's session; the caller commits."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def index_document(self, document_id: int, text: str) -> List[DuplicateMatch]:
+        """Sign a document, return its near-duplicates and add it to the index."""
+        if np is None:
+            return []
+        hasher = get_hasher()
+        signature = await asyncio.to_thread(hasher.signature, text)
+        await self.remove(document_id)
+        if signature is None:
+            return []
+        buckets = hasher.buckets(signature)
+        matches = await self._matches(signature, buckets, exclude=document_id)
+        self.db.add(DocumentSignature(document_id=document_id, signature=signature.tobytes()))
+        await self.db.execute(
+            insert(document_bands),
+            [
+                {"band": band, "bucket": bucket, "document_id": document_id}
+                for band, bucket in buckets
+            ],
+        )
+        return matches
+
+    async def find(self, document_id: int) -> List[DuplicateMatch]:
+        """Near-duplicates of an already signed document."""
+        if np is None:
+            return []
+        stored = await self.db.get(DocumentSignature, document_id)
+        if stored is None:
+            return []
+        signature = _decode(stored.signature)
+        if len(signature) != settings.DEDUP_NUM_PERM:
+            return []
+        return await self._matches(signature, get_hasher().buckets(signature), document_id)
+
+    async def remove(self, document_id: int) -> None:
+        await self.db.execute(
+            delete(document_bands).where(document_bands.c.document_id == document_id)
+        )
+        await self.db.execute(
+            delete(DocumentSignature).where(DocumentSignature.document_id == document_id)
+        )
+
+    async def collapse(self, items: Sequence[dict]) -> List[dict]:
+        """Fold near-duplicates in ranked ``items`` into the best-ranked copy.
+
+        A kept item lists the ids it absorbed under ``duplicates``.
+        """
+        ids = [item["doc_id"] for item in items]
+        if np is None or len(ids) < 2:
+            return list(items)
+        pairs = await self._pairs_among(ids)
+        if not pairs:
+            return list(items)
+        kept: List[dict] = []
+        absorbed: Dict[int, List[int]] = {}
+        for item in items:
+            doc_id = item["doc_id"]
+            into = next((k["doc_id"] for k in kept if (k["doc_id"], doc_id) in pairs), None)
+            if into is None:
+                kept.append(dict(item))
+            else:
+                absorbed.setdefault(into, []).append(doc_id)
+        for item in kept:
+            if item["doc_id"] in absorbed:
+                item["duplicates"] = absorbed[item["doc_id"]]
+        return kept
+
+    async def _pairs_among(self, ids: Sequence[int]) -> set:
+        """Near-duplicate pairs within ``ids``, both orders, from a band self-join."""
+        left, right = document_bands.alias(), document_bands.alias()
+        candidates = (
+            await self.db.execute(
+                select(left.c.document_id, right.c.document_id)
+                .join(
+                    right,
+                    and_(
+                        left.c.band == right.c.band,
+                        left.c.bucket == right.c.bucket,
+                        left.c.document_id < right.c.document_id,
+                    ),
+                )
+                .where(left.c.document_id.in_(ids), right.c.document_id.in_(ids))
+                .distinct()
+            )
+        ).all()
+        if not candidates:
+            return set()
+        signatures = await self._signatures({doc_id for pair in candidates for doc_id in pair})
+        pairs = set()
+        for first, second in candidates:
+            if (
+                first in signatures
+                and second in signatures
+                and similarity(signatures[first], signatures[second]) >= settings.DEDUP_THRESHOLD
+            ):
+                pairs.update({(first, second), (second, first)})
+        return pairs
+
+    async def _matches(
+        self, signature: "np.ndarray", buckets: Iterable[Tuple[int, int]], exclude: int
+    ) -> List[DuplicateMatch]:
+        candidates = (
+            await self.db.execute(
+                select(document_bands.c.document_id)
+                .where(
+                    or_(
+                        *(
+                            and_(document_bands.c.band == band, document_bands.c.bucket == bucket)
+                            for band, bucket in buckets
+                        )
+                    ),
+                    document_bands.c.document_id != exclude,
+                )
+                .distinct()
+            )
+        ).scalars().all()
+        if not candidates:
+            return []
+        signatures = await self._signatures(candidates)
+        matches = [
+            DuplicateMatch(doc_id, score)
+            for doc_id, other in signatures.items()
+            if (score := similarity(signature, other)) >= settings.DEDUP_THRESHOLD
+        ]
+        matches.sort(key=lambda match: (-match.similarity, match.document_id))
+        return matches
+
+    async def _signatures(self, ids: Iterable[int]) -> Dict[int, "np.ndarray"]:
+        rows = await self.db.execute(
+            select(DocumentSignature.document_id, DocumentSignature.signature).where(
+                DocumentSignature.document_id.in_(list(ids))
+            )
+        )
+        return {doc_id: _decode(blob) for doc_id, blob in rows.all()}
+
+
+async def sign_documents(
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+    fresh: bool = False,
+    chunk_size: int = 500,
+) -> int:
+    """Sign every document without a signature; returns how many were read.
+
+    Documents without text get no signature and are read again by every run.
+    """
+    if np is None:
+        raise RuntimeError("Install 'numpy' to detect near-duplicates.")
+    signed, last_id = 0, 0
+    async with session_factory() as session:
+        if fresh:
+            await session.execute(delete(document_bands))
+            await session.execute(delete(DocumentSignature))
+            await session.commit()
+        service = DuplicateService(session)
+        while True:
+            rows = (
+                await session.execute(
+                    select(Document.id, Document.content_text)
+                    .outerjoin(DocumentSignature, DocumentSignature.document_id == Document.id)
+                    .where(Document.id > last_id, DocumentSignature.document_id.is_(None))
+                    .order_by(Document.id)
+                    .limit(chunk_size)
+                )
+            ).all()
+            if not rows:
+                return signed
+            last_id = rows[-1].id
+            for row in rows:
+                await service.index_document(row.id, row.content_text or "")
+            await session.commit()
+            signed += len(rows)
+            logger.info("Signed %d documents", signed)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Sign documents for near-duplicate detection")
+    parser.add_argument("--fresh", action="store_true", help="drop and rebuild all signatures")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows per DB fetch")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    signed = asyncio.run(sign_documents(fresh=args.fresh, chunk_size=args.chunk_size))
+    print(f"Signed documents: {signed} read")
+
+
+if __name__ == "__main__":
+    main()
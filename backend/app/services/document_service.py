@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 import uuid
 from pathlib import Path
 from typing import Optional
 
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 try:
     from app.services.search_service import get_search_service
@@ -18,8 +20,11 @@ except ModuleNotFoundError as exc:  # pragma: no cover
 
 from ..core.config import settings
 from ..models import Document
+from .dedup import DuplicateService
 from .parser import DocumentParser
 
+logger = logging.getLogger(__name__)
+
 
 class DocumentService:
     def __init__(self, db: AsyncSession):
@@ -31,7 +36,9 @@ class DocumentService:
         content: bytes,
         file_type: str,
         folder_id: Optional[int] = None,
-    ) -> Document:
+    ) -> tuple[Document, list[tuple[Document, float]]]:
+        """Store, sign and index an upload; returns it with its near-duplicates
+        as :meth:`find_duplicates` lists them."""
         upload_dir = Path(settings.UPLOAD_DIR)
         upload_dir.mkdir(parents=True, exist_ok=True)
 
@@ -55,40 +62,90 @@ class DocumentService:
             folder_id=folder_id,
         )
         self.db.add(document)
+        search_service = get_search_service() if get_search_service is not None else None
+        transactional = search_service is not None and search_service.transactional
+        if transactional or settings.DEDUP_ENABLED:
+            await self.db.flush()
+        duplicates = []
+        if settings.DEDUP_ENABLED:
+            # The signature commits together with the document
+            duplicates = await DuplicateService(self.db).index_document(
+                document.id, content_text or ""
+            )
+            if duplicates:
+                logger.info(
+                    "Document %s is a near-duplicate of %s",
+                    document.id,
+                    ", ".join(str(match.document_id) for match in duplicates),
+                )
+        if transactional:
+            # The index row commits or rolls back together with the document
+            await search_service.stage_document(self.db, document.id, content_text or "")
         await self.db.commit()
         await self.db.refresh(document)
 
         # After saving document to DB, index it
-        if get_search_service is not None:
+        if search_service is not None and not search_service.transactional:
             try:
-                search_service = get_search_service()
-                search_service.index_document(
+                folder_path = None
+                if document.folder_id:
+                    from app.services.folder_service import FolderService
+
+                    paths = await FolderService(self.db).ancestor_paths()
+                    folder_path = paths.get(document.folder_id)
+                await search_service.aindex_document(
                     doc_id=document.id,
                     content=document.content_text or "",
                     file_type=document.file_type,
                     folder_id=document.folder_id,
-                    tag_ids=[],  # Tags not implemented yet
+                    tag_ids=[],  # A new document has no tags yet
                     created_at=document.created_at,
+                    folder_path=folder_path,
+                    file_size=document.file_size,
                 )
             except Exception:
-                pass
-        return document
+                logger.exception("Failed to index document %s", document.id)
+        return document, await self._matched_documents(duplicates)
 
     async def get_document(self, document_id: int) -> Optional[Document]:
         return await self.db.get(Document, document_id)
 
+    async def find_duplicates(self, document_id: int) -> list[tuple[Document, float]]:
+        """Near-duplicates of a document with their estimated similarity, best first."""
+        return await self._matched_documents(await DuplicateService(self.db).find(document_id))
+
+    async def _matched_documents(self, matches) -> list[tuple[Document, float]]:
+        if not matches:
+            return []
+        result = await self.db.execute(
+            select(Document).where(Document.id.in_([match.document_id for match in matches]))
+        )
+        documents = {doc.id: doc for doc in result.scalars()}
+        return [
+            (documents[match.document_id], match.similarity)
+            for match in matches
+            if match.document_id in documents
+        ]
+
     async def move_document(
         self, document_id: int, folder_id: Optional[int]
     ) -> Optional[Document]:
-        doc = await self.get_document(document_id)
+        from app.services.folder_service import FolderService
+
+        result = await self.db.execute(
+            select(Document)
+            .where(Document.id == document_id)
+            .options(selectinload(Document.tags))
+            # Tags may have been linked through the association table directly
+            .execution_options(populate_existing=True)
+        )
+        doc = result.scalar_one_or_none()
         if not doc:
             return None
 
+        folder_service = FolderService(self.db)
         # Validate folder exists if specified
         if folder_id:
-            from app.services.folder_service import FolderService
-
-            folder_service = FolderService(self.db)
             folder = await folder_service.get_folder(folder_id)
             if not folder:
                 raise ValueError("Target folder not found")
@@ -97,19 +154,12 @@ class DocumentService:
         await self.db.commit()
         await self.db.refresh(doc)
 
-        if get_search_service is not None:
+        # Transactional backends read folder_id from the documents table
+        if get_search_service is not None and not get_search_service().transactional:
             try:
-                search_service = get_search_service()
-                search_service.index_document(
-                    doc_id=doc.id,
-                    content=doc.content_text or "",
-                    file_type=doc.file_type,
-                    folder_id=doc.folder_id,
-                    tag_ids=[],  # Tags not implemented yet
-                    created_at=doc.created_at,
-                )
+                await folder_service.reindex_documents([doc])
             except Exception:
-                pass
+                logger.exception("Failed to reindex document %s", doc.id)
 
         return doc
 
@@ -140,14 +190,16 @@ class DocumentService:
 
         file_path = Path(settings.UPLOAD_DIR) / document.filename
 
-        # Before or after deleting from DB
-        if get_search_service is not None:
+        search_service = get_search_service() if get_search_service is not None else None
+        if search_service is not None and search_service.transactional:
+            await search_service.stage_removal(self.db, document_id)
+        elif search_service is not None:
             try:
-                search_service = get_search_service()
-                search_service.remove_document(document_id)
+                await search_service.aremove_document(document_id)
             except Exception:
-                pass
+                logger.exception("Failed to remove document %s from the search index", document_id)
 
+        await DuplicateService(self.db).remove(document_id)
         await self.db.delete(document)
         await self.db.commit()
 
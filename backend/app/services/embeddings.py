@@ -0,0 +1,549 @@
+"""Latent semantic (LSA) document embeddings for hybrid ranking.
+
+Usage::
+
+    python -m app.services.embeddings [--dims N] [--chunk-size N]
+
+The job weighs each document's terms by sublinear TF-IDF and factors the
+document-term matrix with a randomized truncated SVD (Halko, Martinsson and
+Tropp), in NumPy on the CPU. A document's embedding is its TF-IDF row
+projected onto the top right singular vectors and scaled to unit length, so
+the cosine similarity of two documents is a dot product. Under
+``<INDEX_DIR>/lsa``:
+
+- ``meta.json``: dimensions and counts, rewritten by every build;
+- ``terms.npy`` (sorted) and ``idf.npy``: the vocabulary fixed at build time;
+- ``basis.npy``: the float32 ``(terms, dims)`` projection;
+- ``vectors.<n>.f32``, ``doc_ids.<n>.i64`` and ``digests.<n>.i64``: raw
+  float32 ``(rows, dims)`` unit vectors, the document of each row and a hash
+  of the text it was embedded from, memory-mapped by readers;
+- ``rows.json``: the segment ``n`` and how many of its rows are committed.
+
+New documents are folded in by projecting them onto the existing basis and
+appending a row, so an upload never rebuilds the matrix; a document's latest
+row wins. Documents whose text is unchanged, such as those reindexed for a
+tag or folder change, keep their row. Appends become visible together when
+``rows.json`` is replaced, so a reader never sees a vector without its
+document id; rows past the committed count are left by an interrupted append
+and overwritten by the next one. Once replaced rows outnumber the live ones
+the live rows are copied into segment ``n + 1``, and readers still mapping
+segment ``n`` keep their open files.
+
+Terms first seen after the build are ignored until the next one, and rows of
+deleted documents stay until then. Only the process applying index batches
+folds documents in. Like ``index_rebuild``, the job does not carry over
+uploads made while it runs.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import Document
+from app.services.index_journal import index_write_lock
+from app.services.index_queue import IndexBatch
+from app.services.query_parser import tokenize
+
+logger = logging.getLogger(__name__)
+
+LSA_DIR = "lsa"
+META = "meta.json"
+ROWS = "rows.json"
+_COMPACT_MIN_DEAD = 1024  # replaced rows before a fold-in may compact the segment
+
+
+def _segment_files(segment: int) -> Dict[str, str]:
+    return {
+        "vectors": f"vectors.{segment}.f32",
+        "doc_ids": f"doc_ids.{segment}.i64",
+        "digests": f"digests.{segment}.i64",
+    }
+
+
+def content_digest(text: str) -> int:
+    """A 64-bit hash of the text a row was embedded from."""
+    digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _write_rows(path: Path, segment: int, rows: int) -> None:
+    """Commit ``rows`` rows of ``segment``; readers see all of them or none."""
+    tmp = path / (ROWS + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"segment": segment, "rows": rows}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path / ROWS)
+
+
+def tokens(text: str) -> List[str]:
+    """Lower-cased index tokens of ``text``, without punctuation."""
+    return [
+        word.lower()
+        for word, _start, _end in tokenize(text)
+        if any(ch.isalnum() for ch in word)
+    ]
+
+
+class SparseRows:
+    """A documents-by-terms matrix in coordinate form.
+
+    Products with dense matrices are one ``np.bincount`` per column, which
+    keeps memory at a few arrays the size of the non-zeros.
+    """
+
+    def __init__(self, rows, cols, vals, shape: Tuple[int, int]):
+        self.rows = rows
+        self.cols = cols
+        self.vals = vals
+        self.shape = shape
+
+    def dot(self, dense):
+        """``self @ dense`` for a ``(terms, k)`` array."""
+        return np.column_stack(
+            [
+                np.bincount(self.rows, self.vals * dense[self.cols, j], minlength=self.shape[0])
+                for j in range(dense.shape[1])
+            ]
+        )
+
+    def tdot(self, dense):
+        """``self.T @ dense`` for a ``(documents, k)`` array."""
+        return np.column_stack(
+            [
+                np.bincount(self.cols, self.vals * dense[self.rows, j], minlength=self.shape[1])
+                for j in range(dense.shape[1])
+            ]
+        )
+
+
+def truncated_svd(matrix: SparseRows, dims: int, oversample: int = 10, iterations: int = 4,
+                  seed: int = 0):
+    """Top ``dims`` right singular vectors ``(terms, dims)`` and singular values.
+
+    Randomized range finder with power iterations, re-orthonormalized after
+    every product so small singular values are not lost to rounding.
+    """
+    n, m = matrix.shape
+    width = min(dims + oversample, n, m)
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(matrix.dot(rng.standard_normal((m, width))))
+    for _ in range(iterations):
+        z, _ = np.linalg.qr(matrix.tdot(q))
+        q, _ = np.linalg.qr(matrix.dot(z))
+    # The small (width, terms) matrix q.T @ A has the same top singular space
+    _, singular, vt = np.linalg.svd(matrix.tdot(q).T, full_matrices=False)
+    k = min(dims, len(singular))
+    return vt[:k].T, singular[:k]
+
+
+def _unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class LsaBuilder:
+    """Collects term counts document by document, then factors them."""
+
+    def __init__(self, dims: int = 128, min_df: int = 2):
+        self.dims = dims
+        self.min_df = min_df  # terms in fewer documents carry no co-occurrence
+        self.vocab: Dict[str, int] = {}
+        self.doc_ids: List[int] = []
+        self.digests: List[int] = []
+        self._rows: List[np.ndarray] = []
+        self._cols: List[np.ndarray] = []
+        self._counts: List[np.ndarray] = []
+
+    def add(self, documents: Iterable[Tuple[int, str]]) -> None:
+        for doc_id, text in documents:
+            counts = Counter(tokens(text or ""))
+            row = len(self.doc_ids)
+            self.doc_ids.append(int(doc_id))
+            self.digests.append(content_digest(text or ""))
+            if not counts:
+                continue
+            cols = [self.vocab.setdefault(term, len(self.vocab)) for term in counts]
+            self._rows.append(np.full(len(cols), row, dtype=np.int64))
+            self._cols.append(np.asarray(cols, dtype=np.int64))
+            self._counts.append(np.fromiter(counts.values(), dtype=np.float64))
+
+    def finish(self, path: Path) -> dict:
+        """Factor the matrix and publish the model in ``path``; returns its meta."""
+        n = len(self.doc_ids)
+        if not self._rows:
+            raise ValueError("No document text to build embeddings from")
+        rows = np.concatenate(self._rows)
+        cols = np.concatenate(self._cols)
+        tf = np.concatenate(self._counts)
+        df = np.bincount(cols, minlength=len(self.vocab))
+        names = np.array(list(self.vocab), dtype=str)
+        kept = np.flatnonzero(df >= self.min_df)
+        kept = kept[np.argsort(names[kept])]
+        if len(kept) < 2:
+            raise ValueError("Too few shared terms to build embeddings")
+        # Old term number -> column of the sorted, pruned vocabulary
+        remap = np.full(len(self.vocab), -1, dtype=np.int64)
+        remap[kept] = np.arange(len(kept))
+        keep = remap[cols] >= 0
+        rows, cols, tf = rows[keep], remap[cols[keep]], tf[keep]
+
+        idf = np.log((1 + n) / (1 + df[kept])) + 1
+        vals = (1 + np.log(tf)) * idf[cols]
+        norms = np.sqrt(np.bincount(rows, vals * vals, minlength=n))
+        vals /= norms[rows]
+        matrix = SparseRows(rows, cols, vals, (n, len(kept)))
+
+        started = time.perf_counter()
+        basis, singular = truncated_svd(matrix, self.dims)
+        vectors = _unit_rows(matrix.dot(basis)).astype(np.float32)
+        meta = {
+            "dims": int(basis.shape[1]),
+            "terms": int(len(kept)),
+            "documents": n,
+            "singular_values": [round(float(s), 6) for s in singular[:10]],
+            "svd_seconds": round(time.perf_counter() - started, 3),
+            "built_at": time.time(),
+        }
+        build_dir = path.with_name(path.name + ".build")
+        # An index rebuild carries the store over to its new directory; the
+        # lock keeps it from copying a half-written build
+        with index_write_lock(path.parent):
+            shutil.rmtree(build_dir, ignore_errors=True)
+            build_dir.mkdir(parents=True)
+            np.save(build_dir / "terms.npy", names[kept])
+            np.save(build_dir / "idf.npy", idf.astype(np.float32))
+            np.save(build_dir / "basis.npy", basis.astype(np.float32))
+            files = _segment_files(0)
+            vectors.tofile(build_dir / files["vectors"])
+            np.asarray(self.doc_ids, dtype=np.int64).tofile(build_dir / files["doc_ids"])
+            np.asarray(self.digests, dtype=np.int64).tofile(build_dir / files["digests"])
+            _write_rows(build_dir, 0, n)
+            (build_dir / META).write_text(json.dumps(meta), encoding="utf-8")
+            _swap_dir(build_dir, path)
+        return meta
+
+
+def _swap_dir(build_dir: Path, path: Path) -> None:
+    # Readers keep their memory maps of the old files until they reload
+    backup = path.with_name(path.name + ".old")
+    shutil.rmtree(backup, ignore_errors=True)
+    if path.exists():
+        os.rename(path, backup)
+    os.rename(build_dir, path)
+    shutil.rmtree(backup, ignore_errors=True)
+
+
+@dataclass
+class _Model:
+    terms: "np.ndarray"
+    idf: "np.ndarray"
+    basis: "np.ndarray"
+    vectors: "np.ndarray"
+    doc_ids: "np.ndarray"
+    digests: "np.ndarray"
+    rows: Dict[int, int]  # doc_id -> its latest row
+    meta_mtime: tuple  # (inode, mtime) of meta.json
+    segment: int
+    count: int  # committed rows when loaded
+
+    def digest(self, doc_id: int) -> Optional[int]:
+        row = self.rows.get(doc_id)
+        return None if row is None else int(self.digests[row])
+
+
+class EmbeddingIndex:
+    """Reads, extends and queries the embeddings built in ``path``."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._model: Optional[_Model] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._current() is not None
+
+    def generation(self) -> Optional[tuple]:
+        """Changes whenever a build or fold-in changes the embeddings."""
+        model = self._current()
+        return None if model is None else (model.meta_mtime, model.segment, model.count)
+
+    def _state(self) -> tuple:
+        meta = (self.path / META).stat()
+        rows = json.loads((self.path / ROWS).read_text(encoding="utf-8"))
+        # A rebuild swaps in a new file, so the inode changes even within one tick
+        return (meta.st_ino, meta.st_mtime_ns), rows["segment"], rows["rows"]
+
+    def _current(self) -> Optional[_Model]:
+        """The model, reloaded after a build or compaction and extended after
+        fold-ins, including those made by another process."""
+        if np is None:
+            return None
+        for _attempt in range(3):
+            try:
+                mtime, segment, count = self._state()
+            except FileNotFoundError:
+                self._model = None
+                return None
+            model = self._model
+            if model is not None and (model.meta_mtime, model.segment, model.count) == (
+                mtime, segment, count
+            ):
+                return model
+            with self._lock:
+                model = self._model
+                try:
+                    if model is None or model.meta_mtime != mtime or model.segment != segment:
+                        model = self._load(mtime, segment, count)
+                    elif model.count != count:
+                        model = self._extend(model, count)
+                except FileNotFoundError:
+                    # A compaction or build replaced the files after rows.json was read
+                    continue
+                self._model = model
+            return model
+        return self._model
+
+    def _load(self, mtime: tuple, segment: int, count: int) -> _Model:
+        basis = np.load(self.path / "basis.npy", mmap_mode="r")
+        model = _Model(
+            terms=np.load(self.path / "terms.npy", mmap_mode="r"),
+            idf=np.load(self.path / "idf.npy"),
+            basis=basis,
+            vectors=np.zeros((0, basis.shape[1]), dtype=np.float32),
+            doc_ids=np.zeros(0, dtype=np.int64),
+            digests=np.zeros(0, dtype=np.int64),
+            rows={},
+            meta_mtime=mtime,
+            segment=segment,
+            count=0,
+        )
+        return self._extend(model, count)
+
+    def _extend(self, model: _Model, count: int) -> _Model:
+        dims = model.basis.shape[1]
+        vectors, doc_ids, digests = model.vectors, model.doc_ids, model.digests
+        # A copy: searches still running on the old model index its own,
+        # shorter vectors with its own rows
+        rows = dict(model.rows)
+        if count:
+            files = {k: self.path / v for k, v in _segment_files(model.segment).items()}
+            # Mapped up to the committed count; later bytes may be a torn append
+            vectors = np.memmap(files["vectors"], dtype=np.float32, mode="r", shape=(count, dims))
+            doc_ids = np.memmap(files["doc_ids"], dtype=np.int64, mode="r", shape=(count,))
+            digests = np.memmap(files["digests"], dtype=np.int64, mode="r", shape=(count,))
+            rows.update(zip(doc_ids[model.count:].tolist(), range(model.count, count)))
+        return _Model(model.terms, model.idf, model.basis, vectors, doc_ids, digests, rows,
+                      model.meta_mtime, model.segment, count)
+
+    @staticmethod
+    def _embed(model: _Model, texts: List[str]):
+        """Unit embeddings of ``texts``; all zeros when no term is known."""
+        out = np.zeros((len(texts), model.basis.shape[1]), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = Counter(tokens(text))
+            if not counts:
+                continue
+            words = np.array(list(counts), dtype=str)
+            at = np.searchsorted(model.terms, words)
+            at = np.minimum(at, len(model.terms) - 1)
+            known = model.terms[at] == words
+            if not known.any():
+                continue
+            tf = np.fromiter(counts.values(), dtype=np.float64)[known]
+            weights = (1 + np.log(tf)) * model.idf[at[known]]
+            out[i] = weights @ model.basis[at[known]]
+        return _unit_rows(out)
+
+    def embed(self, texts: List[str]):
+        model = self._current()
+        if model is None:
+            raise RuntimeError("No embeddings built; run python -m app.services.embeddings")
+        return self._embed(model, texts)
+
+    def fold_in(self, batch: IndexBatch) -> int:
+        """Embed the batch's updated documents whose text changed; returns how many."""
+        model = self._current()
+        if model is None:
+            return 0
+        docs = []
+        for doc_id, fields in batch.items():
+            if fields is None:
+                continue
+            text = fields.get("content") or ""
+            digest = content_digest(text)
+            if model.digest(doc_id) != digest:
+                docs.append((doc_id, text, digest))
+        if not docs:
+            return 0
+        vectors = self._embed(model, [text for _doc_id, text, _digest in docs])
+        doc_ids = np.asarray([doc_id for doc_id, _text, _digest in docs], dtype=np.int64)
+        digests = np.asarray([digest for _doc_id, _text, digest in docs], dtype=np.int64)
+        with self._write_lock, index_write_lock(self.path.parent):
+            current = self._current()
+            if current is None or current.meta_mtime != model.meta_mtime:
+                # Rebuilt meanwhile; the vectors belong to the old basis
+                return 0
+            replaced = current.count - len(current.rows)
+            replaced += sum(1 for doc_id in doc_ids.tolist() if doc_id in current.rows)
+            if replaced >= max(_COMPACT_MIN_DEAD, len(current.rows)):
+                self._compact(current, vectors, doc_ids, digests)
+            else:
+                self._append(current, vectors, doc_ids, digests)
+        self._current()
+        return len(docs)
+
+    def _append(self, model: _Model, vectors, doc_ids, digests) -> None:
+        count = model.count
+        files = _segment_files(model.segment)
+        for kind, array in (("vectors", vectors), ("doc_ids", doc_ids), ("digests", digests)):
+            with open(self.path / files[kind], "ab") as f:
+                # Drop rows an interrupted append wrote but never committed
+                f.truncate(count * array[:1].nbytes)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        _write_rows(self.path, model.segment, count + len(doc_ids))
+
+    def _compact(self, model: _Model, vectors, doc_ids, digests) -> None:
+        """Copy the live rows and the new ones into the next segment."""
+        replaced = set(doc_ids.tolist())
+        live = np.array(
+            sorted(row for doc_id, row in model.rows.items() if doc_id not in replaced),
+            dtype=np.int64,
+        )
+        segment = model.segment + 1
+        files = _segment_files(segment)
+        for kind, old, new in (
+            ("vectors", model.vectors, vectors),
+            ("doc_ids", model.doc_ids, doc_ids),
+            ("digests", model.digests, digests),
+        ):
+            with open(self.path / files[kind], "wb") as f:
+                f.write(np.asarray(old[live]).tobytes())
+                f.write(new.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        _write_rows(self.path, segment, len(live) + len(doc_ids))
+        for name in _segment_files(model.segment).values():
+            # Readers that mapped the old segment keep their open files
+            (self.path / name).unlink(missing_ok=True)
+
+    def rerank(self, query: str, items: List[dict], weight: float) -> List[dict]:
+        """Order BM25 ``items`` by their score, scaled to the best one, blended
+        with the cosine similarity of document and query embeddings.
+
+        Documents without an embedding count as dissimilar. When no query
+        term is in the vocabulary the items are returned as they are.
+        """
+        model = self._current()
+        if model is None or not items:
+            return items
+        query_vector = self._embed(model, [query])[0]
+        if not query_vector.any():
+            return items
+        rows = np.array([model.rows.get(int(item["doc_id"]), -1) for item in items])
+        known = rows >= 0
+        similarity = np.zeros(len(items))
+        # One gather and one matrix-vector product for the whole candidate list
+        similarity[known] = model.vectors[rows[known]] @ query_vector
+        relevance = np.array([item["score"] for item in items], dtype=np.float64)
+        if relevance.max() > 0:
+            relevance /= relevance.max()
+        blended = (1 - weight) * relevance + weight * np.clip(similarity, 0, None)
+        order = np.argsort(-blended, kind="stable")
+        return [dict(items[i], score=float(blended[i])) for i in order]
+
+    def stats(self) -> Optional[dict]:
+        model = self._current()
+        if model is None:
+            return None
+        return {
+            "dims": int(model.basis.shape[1]),
+            "terms": int(len(model.terms)),
+            "rows": int(model.count),
+            "segment": int(model.segment),
+            "documents": len(model.rows),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._model = None
+
+
+async def iter_documents(
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+    chunk_size: int = 500,
+) -> AsyncIterator[List[Tuple[int, str]]]:
+    """Yield ``(id, text)`` of every document in keyset-paginated chunks."""
+    last_id = 0
+    async with session_factory() as session:
+        while True:
+            rows = (
+                await session.execute(
+                    select(Document.id, Document.content_text)
+                    .where(Document.id > last_id)
+                    .order_by(Document.id)
+                    .limit(chunk_size)
+                )
+            ).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield [(row.id, row.content_text or "") for row in rows]
+
+
+async def build_embeddings(
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+    path: Optional[Path] = None,
+    dims: Optional[int] = None,
+    chunk_size: int = 500,
+) -> dict:
+    if np is None:
+        raise RuntimeError("Install 'numpy' to build embeddings.")
+    builder = LsaBuilder(dims or settings.SEARCH_LSA_DIMS)
+    async for chunk in iter_documents(session_factory, chunk_size):
+        await asyncio.to_thread(builder.add, chunk)
+    path = path or Path(settings.INDEX_DIR) / LSA_DIR
+    return await asyncio.to_thread(builder.finish, path)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build LSA embeddings of every document")
+    parser.add_argument("--dims", type=int, default=None, help="latent dimensions")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows per DB fetch")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    meta = asyncio.run(build_embeddings(dims=args.dims, chunk_size=args.chunk_size))
+    print(
+        f"Embedded {meta['documents']} documents in {meta['dims']} dimensions over "
+        f"{meta['terms']} terms (SVD {meta['svd_seconds']:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
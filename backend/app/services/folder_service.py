@@ -1,4 +1,5 @@
-from typing import List, Optional
+import logging
+from typing import Dict, List, Optional
 
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,9 +15,16 @@ except ModuleNotFoundError as exc:  # pragma: no cover
     else:
         raise
 
+logger = logging.getLogger(__name__)
+
 MAX_FOLDER_DEPTH = 5
 
 
+def _needs_reindex() -> bool:
+    # Transactional backends join the documents table at query time
+    return not get_search_service().transactional
+
+
 class FolderService:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -55,18 +63,24 @@ class FolderService:
         if not folder:
             return False
 
-        # Get documents that will be moved to root
+        # Documents in the folder move to root; those further down the subtree
+        # keep their folder but lose this one from their ancestor path
+        subtree = [
+            fid for fid, path in (await self.ancestor_paths()).items() if folder_id in path
+        ]
         doc_result = await self.db.execute(
-            select(Document).where(Document.folder_id == folder_id)
+            select(Document)
+            .where(Document.folder_id.in_(subtree))
+            .options(selectinload(Document.tags))
+            # Tags may have been linked through the association table directly
+            .execution_options(populate_existing=True)
         )
         affected_docs = list(doc_result.scalars().all())
 
         # Move documents to root (folder_id = None)
-        await self.db.execute(
-            Document.__table__.update()
-            .where(Document.folder_id == folder_id)
-            .values(folder_id=None)
-        )
+        for doc in affected_docs:
+            if doc.folder_id == folder_id:
+                doc.folder_id = None
 
         # Move child folders to parent
         await self.db.execute(
@@ -78,24 +92,50 @@ class FolderService:
         await self.db.delete(folder)
         await self.db.commit()
 
-        # Reindex affected documents with updated folder_id
-        if get_search_service is not None and affected_docs:
+        # Reindex the subtree's documents with their new folder paths
+        if get_search_service is not None and affected_docs and _needs_reindex():
             try:
-                search_service = get_search_service()
-                for doc in affected_docs:
-                    search_service.index_document(
-                        doc_id=doc.id,
-                        content=doc.content_text or "",
-                        file_type=doc.file_type,
-                        folder_id=None,  # Now moved to root
-                        tag_ids=[],
-                        created_at=doc.created_at,
-                    )
+                await self.reindex_documents(affected_docs)
             except Exception:
-                pass
+                logger.exception("Failed to reindex documents of deleted folder %s", folder_id)
 
         return True
 
+    async def ancestor_paths(self) -> Dict[int, List[int]]:
+        """Map every folder id to the ids from its top-level folder down to itself."""
+        rows = (await self.db.execute(select(Folder.id, Folder.parent_id))).all()
+        parents = {row.id: row.parent_id for row in rows}
+        paths: Dict[int, List[int]] = {}
+        for folder_id in parents:
+            path = [folder_id]
+            parent_id = parents[folder_id]
+            while parent_id and parent_id in parents and len(path) <= MAX_FOLDER_DEPTH:
+                path.append(parent_id)
+                parent_id = parents[parent_id]
+            paths[folder_id] = path[::-1]
+        return paths
+
+    async def reindex_documents(self, documents: List[Document]) -> None:
+        """Reindex ``documents`` (with their tags loaded) in one batch, after
+        the folder hierarchy they are in has changed."""
+        search_service = get_search_service()
+        paths = await self.ancestor_paths()
+        await search_service.asubmit_many(
+            {
+                doc.id: search_service.document_fields(
+                    doc.id,
+                    doc.content_text or "",
+                    doc.file_type,
+                    doc.folder_id,
+                    [tag.id for tag in doc.tags],
+                    doc.created_at,
+                    paths.get(doc.folder_id),
+                    doc.file_size,
+                )
+                for doc in documents
+            }
+        )
+
     async def get_folder_tree(self) -> List[dict]:
         result = await self.db.execute(select(Folder).order_by(Folder.name))
         folders = result.scalars().all()
@@ -0,0 +1,693 @@
+"""Search backend on an SQLite FTS5 table inside the application database.
+
+``documents_fts`` holds one row per document, keyed by ``rowid = documents.id``:
+``tokens`` is the document text pre-segmented by jieba (search mode) into
+space-separated tokens and the unindexed ``spans`` column the character
+offsets of those tokens, so snippets are cut from FTS5's ``highlight()``
+without scanning the text. Queries are ranked by FTS5's ``bm25()`` and
+filtered by joining the live ``documents`` and ``document_tags`` tables, so
+tag changes and folder moves need no index update at all.
+
+Because the index lives in the same database, services write it inside their
+own transaction (see :meth:`FtsBackend.stage_document`): a document and its
+index row are committed or rolled back together. :meth:`FtsBackend.apply_batch`
+remains for callers without a session, such as rebuilds and tests.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import jieba
+except ImportError:  # pragma: no cover
+    jieba = None
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.services.highlighter import OffsetHighlighter, merge_spans
+from app.services.index_queue import IndexBatch
+from app.services.query_parser import (
+    AndQ,
+    EveryQ,
+    NotQ,
+    NullQ,
+    OrQ,
+    PhraseQ,
+    PrefixQ,
+    QueryParser,
+    TermQ,
+    tokenize,
+)
+from app.services.search_backend import (
+    PinnedSnapshot,
+    SearchFilters,
+    SearchResult,
+    SearchSort,
+    export_hit,
+    format_facets,
+)
+from app.services.suggest import TermDictionary
+
+logger = logging.getLogger(__name__)
+
+TABLE = "documents_fts"
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(tokens, spans UNINDEXED)"
+)
+INSERT_ROW = f"INSERT INTO {TABLE}(rowid, tokens, spans) VALUES (?, ?, ?)"
+# Marks highlight() puts around the matched tokens
+_OPEN, _CLOSE = "\x01", "\x02"
+VOCAB = f"{TABLE}_vocab"
+# A temp table per connection, so the application schema is left alone
+CREATE_VOCAB = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{VOCAB} USING fts5vocab(main, {TABLE}, row)"
+)
+# SQLAlchemy's SQLite DateTime storage format, so date filters compare as text
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_SORT_COLUMNS = {"created_at": "d.created_at", "file_size": "d.file_size", "doc_id": "d.id"}
+# Numeric and ascending in rank order, for keyset paging
+_KEY_COLUMNS = {"created_at": "julianday(d.created_at)", "file_size": "d.file_size", "doc_id": "d.id"}
+
+
+def sqlite_path(database_url: str) -> Optional[Path]:
+    """Return the database file of a SQLite URL, or None for anything else."""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return Path(url.database)
+
+
+def segment(content: str) -> Tuple[str, str]:
+    """Jieba search-mode tokens of ``content`` joined by spaces, and their
+    ``start,end`` character offsets in the same order."""
+    tokens, spans = [], []
+    for word, start, end in tokenize(content or ""):
+        tokens.append(word)
+        spans.append(f"{start},{end}")
+    return " ".join(tokens), " ".join(spans)
+
+
+def marked_spans(marked: str, spans: str) -> List[Tuple[int, int]]:
+    """Offsets of the tokens ``highlight()`` marked in the ``tokens`` column;
+    a matched phrase is marked once around all of its tokens."""
+    found = []
+    inside = False
+    for token, span in zip(marked.split(" "), spans.split(" ")):
+        if inside or _OPEN in token:
+            start, end = span.split(",")
+            found.append((int(start), int(end)))
+        opened, closed = token.rfind(_OPEN), token.rfind(_CLOSE)
+        if opened != closed:
+            inside = opened > closed
+    return found
+
+
+class ContentSlices:
+    """A document's ``content_text`` read in slices with ``substr()``, so a
+    snippet loads only the characters around its matches."""
+
+    def __init__(self, conn: sqlite3.Connection, doc_id: int, length: int):
+        self._conn = conn
+        self.doc_id = doc_id
+        self.length = length
+        self._loaded: List[Tuple[int, str]] = []
+
+    def load(self, ranges: Iterable[Tuple[int, int]]) -> None:
+        ranges = [(start, end) for start, end in ranges if end > start]
+        if not ranges:
+            return
+        columns = ", ".join("substr(content_text, ?, ?)" for _ in ranges)
+        params = [value for start, end in ranges for value in (start + 1, end - start)]
+        row = self._conn.execute(
+            f"SELECT {columns} FROM documents WHERE id = ?", params + [self.doc_id]
+        ).fetchone()
+        self._loaded.extend(
+            (start, chunk or "") for (start, _end), chunk in zip(ranges, row or [""] * len(ranges))
+        )
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bool__(self) -> bool:
+        return self.length > 0
+
+    def __getitem__(self, key: slice) -> str:
+        start, stop, _ = key.indices(self.length)
+        if stop <= start:
+            return ""
+        for offset, chunk in self._loaded:
+            if offset <= start and stop <= offset + len(chunk):
+                return chunk[start - offset : stop - offset]
+        self.load([(start, stop)])
+        offset, chunk = self._loaded[-1]
+        return chunk[start - offset : stop - offset]
+
+
+def _fts5_supported() -> bool:
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(tokens)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _or(exprs: List[str]) -> str:
+    return exprs[0] if len(exprs) == 1 else "(" + " OR ".join(exprs) + ")"
+
+
+def _and(exprs: List[str]) -> str:
+    return exprs[0] if len(exprs) == 1 else "(" + " AND ".join(exprs) + ")"
+
+
+def compile_query(node) -> Tuple[Optional[str], Optional[str]]:
+    """Translate a parsed query into ``(include, exclude)`` MATCH expressions.
+
+    A document matches when it matches ``include`` (every document when None)
+    and does not match ``exclude`` (nothing excluded when None). FTS5's ``NOT``
+    is binary, so a bare ``NOT x`` can only be expressed as an exclusion.
+    """
+    if isinstance(node, TermQ):
+        return _quote(node.text), None
+    if isinstance(node, PrefixQ):
+        return _quote(node.prefix) + " *", None
+    if isinstance(node, PhraseQ):
+        # FTS5 splits the quoted tokens into a phrase, matched by position
+        return _quote(" ".join(node.terms)), None
+    if isinstance(node, EveryQ):
+        return None, None
+    if isinstance(node, NotQ):
+        include, exclude = compile_query(node.child)
+        if include is None:
+            # NOT NOT x is x; NOT * matches nothing (an empty phrase)
+            return exclude if exclude is not None else '""', None
+        return None, include if exclude is None else f"({include} NOT {exclude})"
+    if isinstance(node, AndQ):
+        includes, excludes = [], []
+        for child in node.children:
+            include, exclude = compile_query(child)
+            if include is not None:
+                includes.append(include)
+            if exclude is not None:
+                excludes.append(exclude)
+        return (
+            _and(includes) if includes else None,
+            _or(excludes) if excludes else None,
+        )
+    if isinstance(node, OrQ):
+        positives, negatives = [], []
+        for child in node.children:
+            include, exclude = compile_query(child)
+            if include is None and exclude is None:
+                return None, None
+            if include is None:
+                negatives.append(exclude)
+            elif exclude is None:
+                positives.append(include)
+            else:
+                positives.append(f"({include} NOT {exclude})")
+        if not negatives:
+            return _or(positives), None
+        # a OR NOT b  ==  everything except (b NOT a)
+        excluded = _and(negatives)
+        return None, f"({excluded} NOT {_or(positives)})" if positives else excluded
+    raise TypeError(f"Unsupported query node {node!r}")
+
+
+def _structure_segments(block: bytes) -> int:
+    """Segment count from the FTS5 structure record (4-byte cookie, then
+    varints nLevel and nSegment)."""
+    pos = 4
+    values = []
+    for _ in range(2):
+        value = 0
+        for i in range(9):
+            byte = block[pos]
+            pos += 1
+            if i == 8:
+                value = (value << 8) | byte
+                break
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                break
+        values.append(value)
+    return values[1]
+
+
+def _recency_key(score: float, created: Optional[int], half_life: float) -> float:
+    return SearchSort("recency", True, half_life).recency_key(score, created or 0)
+
+
+def _date_param(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(_DATE_FORMAT)
+
+
+class FtsBackend:
+    """BM25 backend on an FTS5 table in the application's SQLite database."""
+
+    name = "sqlite"
+    missing = "Use a SQLite DATABASE_URL with FTS5 support and install 'jieba' to enable search."
+    transactional = True
+
+    def __init__(self, database_url: Optional[str] = None):
+        self.path = sqlite_path(database_url or settings.DATABASE_URL)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._watch: Optional[sqlite3.Connection] = None
+        self._watch_lock = threading.Lock()
+        self._available: Optional[bool] = None
+        self._highlighter = OffsetHighlighter(
+            context_chars=settings.SEARCH_HIGHLIGHT_CONTEXT,
+            max_fragments=settings.SEARCH_HIGHLIGHT_FRAGMENTS,
+        )
+        if self.available:
+            self._create_table()
+
+    @property
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = jieba is not None and self.path is not None and _fts5_supported()
+        return self._available
+
+    def _require_backend(self) -> None:
+        if not self.available:
+            raise RuntimeError(f"Search backend is not available. {self.missing}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        conn.create_function("recency_key", 3, _recency_key, deterministic=True)
+        return conn
+
+    def _create_table(self) -> None:
+        """Create the index table once, at startup; a table from before the
+        ``spans`` column is re-segmented from the documents."""
+        conn = self._connect()
+        try:
+            with conn:
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")]
+                if columns and "spans" not in columns:
+                    logger.info("Re-segmenting %s to store token offsets", TABLE)
+                    conn.execute(f"DROP TABLE {TABLE}")
+                    conn.execute(CREATE_TABLE)
+                    rows = conn.execute("SELECT id, content_text FROM documents").fetchall()
+                    conn.executemany(
+                        INSERT_ROW, [(doc_id, *segment(content)) for doc_id, content in rows]
+                    )
+                else:
+                    conn.execute(CREATE_TABLE)
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread so concurrent searches read in parallel
+        self._require_backend()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # --- Writes --------------------------------------------------------------
+
+    async def stage_document(self, session: AsyncSession, doc_id: int, content: str) -> None:
+        """Write a document's index row in ``session``'s open transaction."""
+        tokens, spans = await asyncio.to_thread(segment, content)
+        await session.execute(text(f"DELETE FROM {TABLE} WHERE rowid = :id"), {"id": doc_id})
+        await session.execute(
+            text(f"INSERT INTO {TABLE}(rowid, tokens, spans) VALUES (:id, :tokens, :spans)"),
+            {"id": doc_id, "tokens": tokens, "spans": spans},
+        )
+
+    async def stage_removal(self, session: AsyncSession, doc_id: int) -> None:
+        """Delete a document's index row in ``session``'s open transaction."""
+        await session.execute(text(f"DELETE FROM {TABLE} WHERE rowid = :id"), {"id": doc_id})
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Re-segment updated documents; their other fields come from the joins."""
+        self._require_backend()
+        rows = [
+            (int(doc_id), *segment(fields.get("content", "")))
+            for doc_id, fields in batch.items()
+            if fields is not None
+        ]
+        conn = self._conn()
+        with self._writer_lock, conn:
+            conn.executemany(
+                f"DELETE FROM {TABLE} WHERE rowid = ?", [(int(doc_id),) for doc_id in batch]
+            )
+            conn.executemany(INSERT_ROW, rows)
+
+    def generation(self) -> int:
+        """``PRAGMA data_version`` of a connection that never writes, so it
+        moves on every commit to the database, including tag and folder changes."""
+        self._require_backend()
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._connect()
+            return int(self._watch.execute("PRAGMA data_version").fetchone()[0])
+
+    def segment_stats(self) -> dict:
+        conn = self._conn()
+        row = conn.execute(f"SELECT block FROM {TABLE}_data WHERE id = 10").fetchone()
+        docs = conn.execute(f"SELECT count(*) FROM {TABLE}_docsize").fetchone()[0]
+        return {
+            "generation": self.generation(),
+            "segments": _structure_segments(row[0]) if row else 0,
+            "docs": docs,
+            # FTS5 purges deleted rows while merging and does not report them
+            "deleted": 0,
+            "deleted_ratio": 0.0,
+        }
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        """Run FTS5's incremental merge to completion, or ``optimize`` into one b-tree."""
+        conn = self._conn()
+        with self._writer_lock:
+            if optimize:
+                with conn:
+                    conn.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+                return
+            while True:
+                before = conn.total_changes
+                with conn:
+                    conn.execute(f"INSERT INTO {TABLE}({TABLE}, rank) VALUES ('merge', 500)")
+                # Fewer than two changes means there was nothing left to merge
+                if conn.total_changes - before < 2:
+                    break
+
+    # --- Queries -------------------------------------------------------------
+
+    def term_dictionaries(self, known: set) -> List[TermDictionary]:
+        """The whole vocabulary as one dictionary per generation; FTS5 does
+        not expose the terms of its segments separately."""
+        key = self.generation()
+        if key in known:
+            return [(key, None)]
+        conn = self._conn()
+        conn.execute(CREATE_VOCAB)
+        return [(key, conn.execute(f"SELECT term, doc FROM temp.{VOCAB}").fetchall())]
+
+    def parse(self, query: str):
+        return QueryParser().parse(query)
+
+    def _where(self, parsed, filters: SearchFilters) -> Tuple[Optional[str], List[str], list]:
+        """Return the MATCH expression, the extra WHERE clauses and their parameters."""
+        include, exclude = compile_query(parsed)
+        clauses: List[str] = []
+        params: list = []
+        if exclude is not None:
+            clauses.append(f"d.id NOT IN (SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH ?)")
+            params.append(exclude)
+        if filters.file_type:
+            clauses.append("d.file_type = ?")
+            params.append(filters.file_type)
+        if filters.folder_id and filters.include_subfolders:
+            # The folder hierarchy is read at query time, so moves need no reindex
+            clauses.append(
+                "d.folder_id IN (WITH RECURSIVE subtree(id) AS (SELECT ? UNION "
+                "SELECT f.id FROM folders f JOIN subtree s ON f.parent_id = s.id) "
+                "SELECT id FROM subtree)"
+            )
+            params.append(filters.folder_id)
+        elif filters.folder_id:
+            clauses.append("d.folder_id = ?")
+            params.append(filters.folder_id)
+        if filters.tag_ids:
+            # Documents carrying any of the requested tags
+            marks = ", ".join("?" for _ in filters.tag_ids)
+            clauses.append(
+                f"d.id IN (SELECT document_id FROM document_tags WHERE tag_id IN ({marks}))"
+            )
+            params.extend(filters.tag_ids)
+        if filters.date_from:
+            clauses.append("d.created_at >= ?")
+            params.append(_date_param(filters.date_from))
+        if filters.date_to:
+            clauses.append("d.created_at <= ?")
+            params.append(_date_param(filters.date_to))
+        return include, clauses, params
+
+    def _from(self, include: Optional[str], clauses: List[str], params: list) -> Tuple[str, list]:
+        if include is not None:
+            sql = (
+                f"FROM {TABLE} f JOIN documents d ON d.id = f.rowid WHERE {TABLE} MATCH ?"
+            )
+            params = [include] + params
+        else:
+            sql = f"FROM {TABLE} f JOIN documents d ON d.id = f.rowid WHERE 1"
+        for clause in clauses:
+            sql += f" AND {clause}"
+        return sql, params
+
+    def search(
+        self,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        snapshot: Optional[PinnedSnapshot] = None,
+        after: Optional[tuple] = None,
+    ) -> SearchResult:
+        """Rank matches with ``bm25()`` or ``sort``; totals are always exact.
+
+        With ``after`` the page is found by a row-value comparison on the
+        rank key; nothing is pinned, so it reads the live tables.
+        """
+        if isinstance(parsed, NullQ):
+            return SearchResult(
+                items=[],
+                total=0,
+                facets=format_facets({}) if facets else None,
+                keys=[] if after is not None else None,
+            )
+        include, clauses, params = self._where(parsed, filters)
+        from_sql, params = self._from(include, clauses, params)
+        # bm25() is lower-is-better; constant score when nothing is matched on
+        score = f"-bm25({TABLE})" if include is not None else "1.0"
+        conn = self._conn()
+        facet_counts = None
+        if facets:
+            total, counts = self._facet_counts(conn, from_sql, params)
+            facet_counts = format_facets(counts)
+        else:
+            total = conn.execute(f"SELECT count(*) {from_sql}", params).fetchone()[0]
+        if not total or limit <= 0:
+            return SearchResult(
+                items=[],
+                total=total,
+                facets=facet_counts,
+                keys=[] if after is not None else None,
+            )
+        if after is not None:
+            return self._search_after(
+                conn, include, query, from_sql, params, score, sort, after, skip, limit,
+                total, facet_counts,
+            )
+        order_by = "score DESC, d.id"
+        if sort is not None and sort.recency:
+            # Ranked by recency_key, which becomes the decayed score below
+            score = self._recency_score(score, sort)
+        elif sort is not None:
+            direction = "DESC" if sort.descending else "ASC"
+            order_by = f"{_SORT_COLUMNS[sort.field]} {direction}, {order_by}"
+        rows = conn.execute(
+            f"SELECT d.id, {score} AS score, d.file_type, d.folder_id, "
+            f"{self._snippet_columns(include)} {from_sql} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            params + [limit, skip],
+        ).fetchall()
+        items = [self._row_to_item(conn, row, query) for row in rows]
+        if sort is not None and sort.recency:
+            now = time.time()
+            for item in items:
+                item["score"] = sort.recency_score(item["score"], now)
+        return SearchResult(items=items, total=total, total_exact=True, facets=facet_counts)
+
+    @staticmethod
+    def _snippet_columns(include: Optional[str]) -> str:
+        """Text length, marked tokens and token offsets of a hit;
+        ``highlight()`` only works under a MATCH."""
+        marked = f"highlight({TABLE}, 0, char(1), char(2))" if include is not None else "NULL"
+        return f"length(d.content_text) AS length, {marked} AS marked, f.spans AS spans"
+
+    @staticmethod
+    def _recency_score(score: str, sort: SearchSort) -> str:
+        created = "CAST(strftime('%s', d.created_at) AS INTEGER)"
+        return f"recency_key({score}, {created}, {sort.half_life!r})"
+
+    def _search_after(
+        self, conn, include, query, from_sql, params, score, sort, after, skip, limit,
+        total, facet_counts,
+    ) -> SearchResult:
+        if sort is None:
+            keys = [f"-({score})", "d.id"]
+        elif sort.recency:
+            score = self._recency_score(score, sort)
+            keys = [f"-({score})", "d.id"]
+        else:
+            column = _KEY_COLUMNS[sort.field]
+            keys = [f"-{column}" if sort.descending else column, f"-({score})", "d.id"]
+        names = [f"k{i}" for i in range(len(keys))]
+        sql = (
+            f"SELECT id, score, file_type, folder_id, length, marked, spans, "
+            f"{', '.join(names)} FROM (SELECT d.id AS id, {score} AS score, "
+            f"d.file_type AS file_type, d.folder_id AS folder_id, "
+            f"{self._snippet_columns(include)}, "
+            + ", ".join(f"{key} AS {name}" for key, name in zip(keys, names))
+            + f" {from_sql})"
+        )
+        page_params = list(params)
+        if after:
+            if len(after) != len(keys):
+                raise ValueError("Invalid cursor")
+            sql += f" WHERE ({', '.join(names)}) > ({', '.join('?' * len(keys))})"
+            page_params += list(after)
+        rows = conn.execute(
+            f"{sql} ORDER BY {', '.join(names)} LIMIT ? OFFSET ?",
+            page_params + [limit, skip],
+        ).fetchall()
+        items = [self._row_to_item(conn, row[:7], query) for row in rows]
+        if sort is not None and sort.recency:
+            now = time.time()
+            for item in items:
+                item["score"] = sort.recency_score(item["score"], now)
+        return SearchResult(
+            items=items,
+            total=total,
+            total_exact=True,
+            facets=facet_counts,
+            keys=[tuple(row[7:]) for row in rows],
+        )
+
+    def pin(self) -> None:
+        # Reads are on the live tables; cursors page by key alone
+        return None
+
+    @staticmethod
+    def _facet_counts(
+        conn: sqlite3.Connection, from_sql: str, params: list
+    ) -> Tuple[int, dict]:
+        """Collect the matches' columns once into a temp table, then count
+        them and each facet from there."""
+        conn.execute("DROP TABLE IF EXISTS temp.facet_hits")
+        conn.execute(
+            "CREATE TEMP TABLE facet_hits AS SELECT d.id AS id, d.file_type AS file_type, "
+            "d.folder_id AS folder_id, strftime('%Y', d.created_at) AS year "
+            f"{from_sql}",
+            params,
+        )
+        try:
+            total = conn.execute("SELECT count(*) FROM temp.facet_hits").fetchone()[0]
+            counts = {
+                name: dict(
+                    conn.execute(
+                        f"SELECT {name}, count(*) FROM temp.facet_hits GROUP BY {name}"
+                    ).fetchall()
+                )
+                for name in ("file_type", "folder_id", "year")
+            }
+            counts["tag_ids"] = dict(
+                conn.execute(
+                    "SELECT t.tag_id, count(*) FROM temp.facet_hits h "
+                    "JOIN document_tags t ON t.document_id = h.id GROUP BY t.tag_id"
+                ).fetchall()
+            )
+        finally:
+            conn.execute("DROP TABLE temp.facet_hits")
+        return total, counts
+
+    def iter_hits(self, parsed, filters: SearchFilters) -> Iterator[dict]:
+        """Step an unordered query on a connection of its own, whose read
+        transaction keeps the rows consistent until the generator closes."""
+        if isinstance(parsed, NullQ):
+            return
+        include, clauses, params = self._where(parsed, filters)
+        from_sql, params = self._from(include, clauses, params)
+        score = f"-bm25({TABLE})" if include is not None else "1.0"
+        self._require_backend()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            rows = conn.execute(
+                f"SELECT d.id, d.file_type, d.folder_id, d.created_at, d.file_size, {score} "
+                f"{from_sql}",
+                params,
+            )
+            for doc_id, file_type, folder_id, created_at, file_size, rank in rows:
+                created = datetime.fromisoformat(created_at) if created_at else None
+                yield export_hit(doc_id, file_type, folder_id, created, file_size, rank)
+        finally:
+            conn.close()
+
+    def count(self, parsed, filters: SearchFilters) -> int:
+        if isinstance(parsed, NullQ):
+            return 0
+        from_sql, params = self._from(*self._where(parsed, filters))
+        return self._conn().execute(f"SELECT count(*) {from_sql}", params).fetchone()[0]
+
+    def _row_to_item(self, conn: sqlite3.Connection, row: tuple, query: str) -> dict:
+        from app.services.search_service import highlight_snippet
+
+        doc_id, score, file_type, folder_id, length, marked, spans = row
+        content = ContentSlices(conn, int(doc_id), length or 0)
+        highlighted = None
+        if marked and spans:
+            # The stored offsets of the tokens FTS5 matched, mapped back to the text
+            found = merge_spans(marked_spans(marked, spans))
+            highlighted = self._highlighter.render(content, found)
+        if highlighted is None:
+            highlighted = highlight_snippet(content[: 10 * self._highlighter.context_chars], query)
+        return {
+            "doc_id": int(doc_id),
+            "file_type": file_type or "",
+            "folder_id": int(folder_id) if folder_id else None,
+            "score": float(score),
+            "highlight": highlighted,
+        }
+
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        def prime() -> None:
+            self._conn().execute(f"SELECT count(*) FROM {TABLE}_docsize").fetchone()
+
+        return [("index_open", self._conn), ("searcher", prime)]
+
+    def stats(self) -> dict:
+        return {"fts_index": self.segment_stats() if self.available else None}
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
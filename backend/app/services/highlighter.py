@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+Span = Tuple[int, int]
+
+
+def merge_spans(spans: Iterable[Span]) -> List[Span]:
+    """Sort character spans and merge the ones that overlap or touch."""
+    merged: List[Span] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def densest_windows(spans: Sequence[Span], width: int, max_windows: int) -> List[List[Span]]:
+    """Pick up to ``max_windows`` non-overlapping groups of spans that each fit
+    in ``width`` characters, taking the group with the most matches first."""
+    windows: List[List[Span]] = []
+    remaining = list(spans)
+    while remaining and len(windows) < max_windows:
+        best_start, best_end = 0, 1
+        j = 0
+        for i in range(len(remaining)):
+            j = max(j, i + 1)
+            while j < len(remaining) and remaining[j][1] - remaining[i][0] <= width:
+                j += 1
+            if j - i > best_end - best_start:
+                best_start, best_end = i, j
+        windows.append(remaining[best_start:best_end])
+        del remaining[best_start:best_end]
+    windows.sort(key=lambda group: group[0][0])
+    return windows
+
+
+class OffsetHighlighter:
+    """Builds snippets from character offsets stored in the index postings.
+
+    Match positions come straight from the ``chars=True`` postings of the
+    query's terms for a single document, so the document text is neither
+    re-tokenized nor scanned; only the characters around the densest clusters
+    of matches are sliced out and marked up.
+    """
+
+    def __init__(
+        self,
+        fieldname: str = "content",
+        context_chars: int = 100,
+        max_fragments: int = 2,
+        separator: str = "...",
+    ):
+        self.fieldname = fieldname
+        self.context_chars = context_chars
+        self.max_fragments = max(1, max_fragments)
+        self.separator = separator
+
+    def spans(self, reader, docnum: int, terms: Iterable[str]) -> List[Span]:
+        """Return the merged character spans of ``terms`` in one document."""
+        found: List[Span] = []
+        for text in terms:
+            if (self.fieldname, text) not in reader:
+                continue
+            matcher = reader.postings(self.fieldname, text)
+            matcher.skip_to(docnum)
+            if matcher.is_active() and matcher.id() == docnum:
+                found.extend((start, end) for _pos, start, end in matcher.value_as("characters"))
+        return merge_spans(found)
+
+    def render(self, text: str, spans: Sequence[Span]) -> Optional[str]:
+        if not spans:
+            return None
+        width = 2 * self.context_chars
+        groups = densest_windows(spans, width, self.max_fragments)
+
+        ranges = []
+        for group in groups:
+            cluster_start, cluster_end = group[0][0], group[-1][1]
+            pad = max(0, (width - (cluster_end - cluster_start)) // 2)
+            ranges.append([max(0, cluster_start - pad), min(len(text), cluster_end + pad)])
+        for k in range(1, len(ranges)):
+            # Padding must not spill into the neighbouring fragment
+            ranges[k - 1][1] = min(ranges[k - 1][1], groups[k][0][0])
+            ranges[k][0] = max(ranges[k][0], ranges[k - 1][1])
+        load = getattr(text, "load", None)
+        if load is not None:
+            # Stored text: fetch every fragment's blocks in one read up front
+            load(ranges)
+
+        output = [self.separator] if ranges[0][0] > 0 else []
+        for k, (group, (start, end)) in enumerate(zip(groups, ranges)):
+            if k and start > ranges[k - 1][1]:
+                output.append(self.separator)
+            cursor = start
+            for span_start, span_end in group:
+                output.append(text[cursor:span_start])
+                output.append(f"<mark>{text[span_start:span_end]}</mark>")
+                cursor = span_end
+            output.append(text[cursor:end])
+        if ranges[-1][1] < len(text):
+            output.append(self.separator)
+        return "".join(output)
+
+    def highlight(self, reader, docnum: int, text: str, terms: Iterable[str]) -> Optional[str]:
+        """Return a marked-up snippet, or None when no stored offsets matched."""
+        if not text:
+            return None
+        return self.render(text, self.spans(reader, docnum, terms))
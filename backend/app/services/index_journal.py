@@ -0,0 +1,58 @@
+"""Coordination between live index writes and an offline rebuild.
+
+A rebuild (see :mod:`app.services.index_rebuild`) streams the database into
+``<INDEX_DIR>.rebuild`` while the app keeps committing to the live index.
+Every live commit takes :func:`index_write_lock` and, while a rebuild is in
+progress, appends the ids it touched to the rebuild's journal. The rebuild
+takes the same lock to replay the journal from the database and swap the
+result in, so no update is lost and writers wait only for that last step.
+
+The lock is an ``flock`` on a file next to the index directory, so it holds
+across worker processes.
+"""
+
+from __future__ import annotations
+
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+STATE_FILE = ".rebuild_state.json"  # leading dot: ignored by Whoosh file cleanup
+JOURNAL_FILE = ".rebuild_journal"  # doc ids committed to the live index mid-rebuild
+
+
+def build_dir_for(index_dir: Path) -> Path:
+    return index_dir.with_name(index_dir.name + ".rebuild")
+
+
+@contextmanager
+def index_write_lock(index_dir: Path) -> Iterator[None]:
+    """Hold the exclusive write lock of ``index_dir``."""
+    path = index_dir.with_name(index_dir.name + ".lock")
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def journal_writes(index_dir: Path, doc_ids: Iterable[int]) -> None:
+    """Record ``doc_ids`` for a rebuild of ``index_dir`` in progress, if any.
+
+    Call under :func:`index_write_lock`, after the live commit.
+    """
+    build_dir = build_dir_for(index_dir)
+    if not (build_dir / STATE_FILE).exists():
+        return
+    with open(build_dir / JOURNAL_FILE, "a", encoding="utf-8") as journal:
+        journal.write("".join(f"{int(doc_id)}\n" for doc_id in doc_ids))
+
+
+def read_journal(build_dir: Path) -> List[int]:
+    """The distinct doc ids journaled for the rebuild in ``build_dir``, in order."""
+    path = build_dir / JOURNAL_FILE
+    if not path.exists():
+        return []
+    return sorted({int(line) for line in path.read_text(encoding="utf-8").split()})
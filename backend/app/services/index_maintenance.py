@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from datetime import time as dt_time
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_window(window: str) -> Optional[Tuple[dt_time, dt_time]]:
+    """Parse ``"HH:MM-HH:MM"`` into a (start, end) pair; empty means always."""
+    window = (window or "").strip()
+    if not window:
+        return None
+    try:
+        start, end = (part.strip() for part in window.split("-", 1))
+        return dt_time.fromisoformat(start), dt_time.fromisoformat(end)
+    except ValueError as exc:
+        raise ValueError(f"Invalid maintenance window {window!r}, expected HH:MM-HH:MM") from exc
+
+
+def in_window(window: Optional[Tuple[dt_time, dt_time]], now: datetime) -> bool:
+    if window is None:
+        return True
+    start, end = window
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    # Window wraps past midnight, e.g. 22:00-04:00
+    return current >= start or current < end
+
+
+class IndexMaintenance:
+    """Background task that merges index segments during quiet windows.
+
+    Every ``interval`` seconds the segment count and deleted-document ratio are
+    checked. Too many segments trigger a small-segment merge; too many deleted
+    documents trigger a full optimize, which also purges the deletions. Merges
+    go through the search service's writer lock and readers keep serving the
+    old segments until they refresh.
+    """
+
+    def __init__(
+        self,
+        service: Any,
+        interval: float = 300.0,
+        max_segments: int = 10,
+        max_deleted_ratio: float = 0.2,
+        window: str = "",
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.service = service
+        self.interval = interval
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.window = parse_window(window)
+        self._clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.last_run: Optional[dict] = None
+
+    def plan(self, stats: dict) -> Optional[str]:
+        """Return ``"optimize"``, ``"merge"`` or None for the given segment stats."""
+        # Even a single segment is rewritten to reclaim its deleted documents
+        if stats["deleted_ratio"] > self.max_deleted_ratio:
+            return "optimize"
+        if stats["segments"] > self.max_segments:
+            return "merge"
+        return None
+
+    async def run_once(self, force: bool = False) -> Optional[dict]:
+        if not force and not in_window(self.window, self._clock()):
+            return None
+        before = await asyncio.to_thread(self.service.segment_stats)
+        action = self.plan(before)
+        if action is None:
+            return None
+
+        start = time.perf_counter()
+        await asyncio.to_thread(self.service.merge_segments, action == "optimize")
+        after = await asyncio.to_thread(self.service.segment_stats)
+        report = {
+            "action": action,
+            "before": before,
+            "after": after,
+            "took_ms": int((time.perf_counter() - start) * 1000),
+            "finished_at": self._clock().isoformat(),
+        }
+        self.runs += 1
+        self.last_run = report
+        logger.info(
+            "Index %s: %d -> %d segments, deleted ratio %.2f -> %.2f in %d ms",
+            action,
+            before["segments"],
+            after["segments"],
+            before["deleted_ratio"],
+            after["deleted_ratio"],
+            report["took_ms"],
+        )
+        return report
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self._run(), name="index-maintenance"
+            )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Index maintenance failed")
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "runs": self.runs,
+            "last_run": self.last_run,
+        }
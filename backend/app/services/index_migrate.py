@@ -0,0 +1,165 @@
+"""Move document text out of an existing search index into a text store.
+
+Usage::
+
+    python -m app.services.index_migrate [--index-dir DIR] [--batch-size N] [--optimize]
+
+Indexes created before ``SEARCH_STORE_CONTENT`` existed keep every document's
+full text in their stored fields. This copies the index into
+``<INDEX_DIR>.migrate`` with content indexed but not stored, writes the text
+into a compressed :class:`TextStore` next to it, and swaps the result in place
+of ``INDEX_DIR``. No database access or re-parsing of uploads is needed.
+
+Like a rebuild, updates made by the running app during the migration are not
+carried over; run it during a quiet window.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from app.core.config import settings
+from app.services import search_service as search_module
+from app.services.index_journal import index_write_lock
+from app.services.index_rebuild import dir_size, swap_index_dir
+from app.services.text_store import TextStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MigrationReport:
+    migrated: int
+    index_bytes_before: int
+    index_bytes_after: int
+    text_store_bytes: int
+    elapsed: float
+
+    @property
+    def saved_ratio(self) -> float:
+        """Fraction of the index files removed by dropping stored content."""
+        if self.index_bytes_before <= 0:
+            return 0.0
+        return 1 - self.index_bytes_after / self.index_bytes_before
+
+
+def migrate_index(
+    index_dir: Optional[str] = None,
+    batch_size: int = 1000,
+    optimize: bool = False,
+    swap: bool = True,
+) -> Optional[MigrationReport]:
+    """Convert ``index_dir``; returns None when content is already external."""
+    if not search_module._SEARCH_BACKEND_AVAILABLE:
+        raise RuntimeError(
+            "Search backend is not available. Install 'whoosh' and 'jieba' to enable search."
+        )
+    index_dir = Path(index_dir or settings.INDEX_DIR)
+    source = search_module.index.open_dir(str(index_dir))
+    if not source.schema["content"].stored:
+        source.close()
+        return None
+
+    start = time.perf_counter()
+    bytes_before = dir_size(index_dir)
+    build_dir = index_dir.with_name(index_dir.name + ".migrate")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+    target = search_module.index.create_in(
+        str(build_dir), search_module.build_schema(store_content=False)
+    )
+    store = TextStore(build_dir / TextStore.FILENAME)
+
+    migrated = 0
+    writer = target.writer()
+    try:
+        with source.reader() as reader:
+            batch: List[dict] = []
+            for _docnum, fields in reader.iter_docs():
+                batch.append(fields)
+                if len(batch) >= batch_size:
+                    migrated += _copy(store, writer, batch)
+                    batch = []
+            migrated += _copy(store, writer, batch)
+    except BaseException:
+        writer.cancel()
+        store.close()
+        source.close()
+        raise
+    writer.commit(optimize=optimize)
+    store.close()
+    target.close()
+    source.close()
+
+    text_store_bytes = (build_dir / TextStore.FILENAME).stat().st_size
+    index_bytes_after = dir_size(build_dir) - text_store_bytes
+    if swap:
+        with index_write_lock(index_dir):
+            swap_index_dir(build_dir, index_dir)
+    report = MigrationReport(
+        migrated=migrated,
+        index_bytes_before=bytes_before,
+        index_bytes_after=index_bytes_after,
+        text_store_bytes=text_store_bytes,
+        elapsed=time.perf_counter() - start,
+    )
+    logger.info(
+        "Migrated %d documents: index %d -> %d bytes (%.0f%% smaller), text store %d bytes",
+        migrated,
+        bytes_before,
+        index_bytes_after,
+        report.saved_ratio * 100,
+        text_store_bytes,
+    )
+    return report
+
+
+def _copy(store: TextStore, writer, batch: List[dict]) -> int:
+    if not batch:
+        return 0
+    store.put_many((int(fields["doc_id"]), fields.get("content", "")) for fields in batch)
+    for fields in batch:
+        # Indexes from before folder paths only know each document's own folder
+        fields.setdefault("folder_path", fields.get("folder_id") or "")
+        fields.setdefault("doc_num", int(fields["doc_id"]))
+        writer.add_document(**fields)
+    return len(batch)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Move stored document text out of the search index"
+    )
+    parser.add_argument("--index-dir", default=None, help="defaults to INDEX_DIR")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per text batch")
+    parser.add_argument("--optimize", action="store_true", help="merge into one segment")
+    parser.add_argument(
+        "--no-swap", action="store_true", help="leave the result in <INDEX_DIR>.migrate"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    report = migrate_index(
+        index_dir=args.index_dir,
+        batch_size=args.batch_size,
+        optimize=args.optimize,
+        swap=not args.no_swap,
+    )
+    if report is None:
+        print("Index content is already stored outside the index; nothing to do")
+        return
+    print(
+        f"Migrated {report.migrated} documents in {report.elapsed:.1f}s: index "
+        f"{report.index_bytes_before} -> {report.index_bytes_after} bytes "
+        f"({report.saved_ratio:.0%} smaller), text store {report.text_store_bytes} bytes"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# doc_id -> stored fields to write, or None to delete the document
+IndexBatch = Dict[int, Optional[dict]]
+
+
+class IndexWriteQueue:
+    """Write-behind buffer that commits index updates from a single writer task.
+
+    Updates are coalesced per ``doc_id`` (the latest one wins) and committed
+    together once ``batch_size`` documents are pending or ``interval`` seconds
+    have passed since the first pending update, whichever comes first.
+
+    When a commit fails its documents are committed one at a time, so one bad
+    document cannot hold back the others. Those that still fail are retried
+    after ``interval`` and dropped, with an error logged, after
+    ``max_attempts`` failed commits. Failures are not counted when no
+    document of a batch could be committed, which points at the index rather
+    than the documents.
+    """
+
+    def __init__(
+        self,
+        apply_batch: Callable[[IndexBatch], None],
+        batch_size: int = 200,
+        interval: float = 1.0,
+        max_attempts: int = 5,
+    ):
+        self._apply_batch = apply_batch
+        self.batch_size = max(1, batch_size)
+        self.interval = max(0.0, interval)
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._pending: IndexBatch = {}
+        self._attempts: Dict[int, int] = {}
+        self._flush_waiters: List[asyncio.Future] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.commits = 0
+        self.committed_docs = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = self._loop.create_task(self._run(), name="index-writer")
+
+    def put(self, doc_id: int, fields: Optional[dict]) -> None:
+        with self._lock:
+            if doc_id in self._pending:
+                self.coalesced += 1
+            self._pending[doc_id] = fields
+            self.enqueued += 1
+        self._wake()
+
+    async def flush(self) -> None:
+        """Wait until everything enqueued so far has been committed."""
+        if not self.running:
+            batch = self._take_pending()
+            if batch:
+                await asyncio.to_thread(self._commit, batch)
+            return
+        waiter = self._loop.create_future()
+        with self._lock:
+            self._flush_waiters.append(waiter)
+        self._wake()
+        await waiter
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._stopping = True
+        try:
+            await self.flush()
+        finally:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _wake(self) -> None:
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take_pending(self) -> IndexBatch:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def _commit(self, batch: IndexBatch) -> None:
+        self._apply_batch(batch)
+        self.commits += 1
+        self.committed_docs += len(batch)
+        self.last_batch_size = len(batch)
+
+    def _commit_each(self, batch: IndexBatch) -> IndexBatch:
+        """Commit documents one at a time; returns those that failed."""
+        failed: IndexBatch = {}
+        for doc_id, fields in batch.items():
+            try:
+                self._commit({doc_id: fields})
+            except Exception:
+                logger.warning("Index commit of document %s failed", doc_id, exc_info=True)
+                failed[doc_id] = fields
+        return failed
+
+    def _requeue(self, failed: IndexBatch, count: bool) -> None:
+        dropped = []
+        with self._lock:
+            for doc_id, fields in failed.items():
+                if doc_id in self._pending:
+                    # Superseded while committing; the newer update gets a fresh start
+                    self._attempts.pop(doc_id, None)
+                    continue
+                attempts = self._attempts.get(doc_id, 0) + count
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(doc_id, None)
+                    dropped.append(doc_id)
+                else:
+                    self._attempts[doc_id] = attempts
+                    self._pending[doc_id] = fields
+            self.dropped += len(dropped)
+        if dropped:
+            logger.error(
+                "Dropped index updates of documents %s after %d failed commits; "
+                "reindex them once the cause is fixed",
+                ", ".join(map(str, dropped)),
+                self.max_attempts,
+            )
+
+    def _should_commit_now(self) -> bool:
+        with self._lock:
+            return (
+                self._stopping
+                or bool(self._flush_waiters)
+                or len(self._pending) >= self.batch_size
+            )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            deadline = loop.time() + self.interval
+            while not self._should_commit_now():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            self._wakeup.clear()
+
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                waiters, self._flush_waiters = self._flush_waiters, []
+
+            error: Optional[BaseException] = None
+            failed: IndexBatch = {}
+            if batch:
+                try:
+                    await asyncio.to_thread(self._commit, batch)
+                except Exception as exc:
+                    self.failures += 1
+                    logger.exception("Index commit of %d documents failed", len(batch))
+                    failed = await asyncio.to_thread(self._commit_each, batch)
+                    if failed:
+                        error = exc
+                with self._lock:
+                    for doc_id in batch.keys() - failed.keys():
+                        self._attempts.pop(doc_id, None)
+                if failed:
+                    self._requeue(failed, count=len(batch) == 1 or len(failed) < len(batch))
+
+            for waiter in waiters:
+                if waiter.done():
+                    continue
+                if error is not None:
+                    waiter.set_exception(error)
+                else:
+                    waiter.set_result(None)
+
+            with self._lock:
+                has_pending = bool(self._pending)
+            if has_pending:
+                if error is not None:
+                    await asyncio.sleep(self.interval)
+                self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "running": self.running,
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "commits": self.commits,
+            "committed_docs": self.committed_docs,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_batch_size": self.last_batch_size,
+            "batch_size": self.batch_size,
+            "interval": self.interval,
+        }
@@ -0,0 +1,415 @@
+"""Rebuild the search index from the ``documents`` table.
+
+Usage::
+
+    python -m app.services.index_rebuild [--procs N] [--chunk-size N]
+                                         [--commit-every N] [--fresh] [--optimize]
+
+Documents are streamed in keyset-paginated chunks and tokenized by Whoosh's
+multiprocessing writer into ``<INDEX_DIR>.rebuild``. Progress is checkpointed
+after every commit so an interrupted rebuild resumes where it stopped. The
+finished index is published under a newer generation than the live one, so
+running searchers refresh onto it. When the schema does not store content,
+document text is written to the rebuild's text store too.
+
+``INDEX_DIR`` is a symlink to a directory named after the index generation,
+and publishing replaces the link in one ``rename``, so the path never goes
+missing. An index directory from before this layout is moved aside on its
+first swap, the only time the path briefly does not exist.
+
+Documents the running app updates while a rebuild is in progress are
+journaled (see :mod:`app.services.index_journal`) and read again from the
+database just before the swap, with live index writes held off meanwhile.
+
+With ``SEARCH_SHARDS > 1`` each shard directory is rebuilt in turn from the
+documents routed to it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import shutil
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import Document
+from app.models.document import document_tags
+from app.services import search_service as search_module
+from app.services.folder_service import FolderService
+from app.services.index_journal import (
+    JOURNAL_FILE,
+    STATE_FILE,
+    build_dir_for,
+    index_write_lock,
+    read_journal,
+)
+from app.services.sharded_backend import shard_dir, shard_for
+from app.services.text_store import TextStore
+
+logger = logging.getLogger(__name__)
+
+
+
+def swap_index_dir(build_dir: Path, index_dir: Path) -> None:
+    """Publish a finished index from ``build_dir`` as ``index_dir``.
+
+    The build becomes ``<index_dir>.gen<N>`` and ``index_dir`` a symlink to
+    it, replaced atomically; the directory it pointed to is then removed.
+    Stores kept in subdirectories of the live index (embeddings, ...) are
+    hard-linked into the build first. Call under
+    :func:`~app.services.index_journal.index_write_lock`, which their writers
+    also take.
+    """
+    live_generation = -1
+    if search_module.index.exists_in(str(index_dir)):
+        live_generation = search_module.index.open_dir(str(index_dir)).latest_generation()
+    generation = _bump_generation(build_dir, live_generation + 1)
+    _carry_over(index_dir, build_dir)
+
+    target = index_dir.with_name(f"{index_dir.name}.gen{generation}")
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(build_dir, target)
+    previous = None
+    if index_dir.is_symlink():
+        previous = index_dir.parent / os.readlink(index_dir)
+    elif index_dir.exists():
+        # An index from before versioned directories; the link takes its place
+        previous = index_dir.with_name(f"{index_dir.name}.gen{live_generation}")
+        os.rename(index_dir, previous)
+    link = index_dir.with_name(index_dir.name + ".link")
+    link.unlink(missing_ok=True)
+    os.symlink(target.name, link)
+    os.replace(link, index_dir)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def _carry_over(index_dir: Path, build_dir: Path) -> None:
+    # The Whoosh index and its text store are files; everything in a
+    # subdirectory belongs to another store that the rebuild does not write
+    if not index_dir.is_dir():
+        return
+    for entry in index_dir.iterdir():
+        if entry.is_dir() and not (build_dir / entry.name).exists():
+            shutil.copytree(entry, build_dir / entry.name, copy_function=_link_or_copy)
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _bump_generation(index_dir: Path, min_generation: int) -> int:
+    # Searchers only refresh when the generation number moves forward, so
+    # the rebuilt index must be published with a newer one than the live index.
+    ix = search_module.index.open_dir(str(index_dir))
+    toc = ix._read_toc()
+    if toc.generation >= min_generation:
+        return toc.generation
+    old_name = toc._filename(ix.indexname, toc.generation)
+    toc.generation = min_generation
+    toc.write(ix.storage, ix.indexname)
+    ix.storage.delete_file(old_name)
+    return min_generation
+
+
+def dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+@dataclass
+class RebuildReport:
+    indexed: int
+    resumed_from: int
+    elapsed: float
+    swapped: bool
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.indexed / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class IndexRebuilder:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+        index_dir: Optional[str] = None,
+        procs: Optional[int] = None,
+        chunk_size: int = 500,
+        commit_every: int = 10000,
+        limitmb: int = 128,
+        shard: Optional[Tuple[int, int]] = None,
+    ):
+        self.session_factory = session_factory
+        self.shard = shard  # (shard, shards): only index the documents routed to it
+        if index_dir is None and shard is not None:
+            index_dir = str(shard_dir(Path(settings.INDEX_DIR), shard[0]))
+        self.index_dir = Path(index_dir or settings.INDEX_DIR)
+        self.build_dir = build_dir_for(self.index_dir)
+        self.procs = procs if procs is not None else (os.cpu_count() or 1)
+        self.chunk_size = max(1, chunk_size)
+        self.commit_every = max(self.chunk_size, commit_every)
+        self.limitmb = limitmb
+
+    async def iter_chunks(
+        self, after_id: int = 0, ids: Optional[Sequence[int]] = None
+    ) -> AsyncIterator[List[dict]]:
+        """Yield index field dicts for documents with ``id > after_id`` in id
+        order, only those in ``ids`` if given."""
+        last_id = after_id
+        wanted = sorted(ids) if ids is not None else None
+        async with self.session_factory() as session:
+            paths = await FolderService(session).ancestor_paths()
+            while True:
+                query = (
+                    select(
+                        Document.id,
+                        Document.content_text,
+                        Document.file_type,
+                        Document.folder_id,
+                        Document.created_at,
+                        Document.file_size,
+                    )
+                    .where(Document.id > last_id)
+                    .order_by(Document.id)
+                    .limit(self.chunk_size)
+                )
+                if wanted is not None:
+                    # A chunk of ids at a time keeps under SQLite's variable limit
+                    start = bisect.bisect_right(wanted, last_id)
+                    batch = wanted[start : start + self.chunk_size]
+                    if not batch:
+                        return
+                    query = query.where(Document.id.in_(batch))
+                rows = (await session.execute(query)).all()
+                if wanted is None and not rows:
+                    return
+
+                # Ids of the batch that matched no row were deleted since
+                last_id = batch[-1] if wanted is not None else rows[-1].id
+                if self.shard is not None:
+                    shard, shards = self.shard
+                    rows = [row for row in rows if shard_for(row.id, shards) == shard]
+                if not rows:
+                    continue
+
+                chunk_ids = [row.id for row in rows]
+                tag_rows = await session.execute(
+                    select(document_tags.c.document_id, document_tags.c.tag_id).where(
+                        document_tags.c.document_id.in_(chunk_ids)
+                    )
+                )
+                tags_by_doc = defaultdict(list)
+                for tag_row in tag_rows:
+                    tags_by_doc[tag_row.document_id].append(tag_row.tag_id)
+
+                yield [
+                    search_module.SearchService.document_fields(
+                        row.id,
+                        row.content_text or "",
+                        row.file_type,
+                        row.folder_id,
+                        sorted(tags_by_doc.get(row.id, [])),
+                        row.created_at,
+                        paths.get(row.folder_id),
+                        row.file_size,
+                    )
+                    for row in rows
+                ]
+                # Release ORM state between chunks to keep memory flat
+                session.expunge_all()
+
+    async def run(
+        self, fresh: bool = False, optimize: bool = False, swap: bool = True
+    ) -> RebuildReport:
+        if not search_module._SEARCH_BACKEND_AVAILABLE or search_module.SCHEMA is None:
+            raise RuntimeError(
+                "Search backend is not available. Install 'whoosh' and 'jieba' to enable search."
+            )
+
+        state = None if fresh else self._load_state()
+        if state is None:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            self.build_dir.mkdir(parents=True)
+            search_module.index.create_in(str(self.build_dir), search_module.SCHEMA)
+            state = {"last_id": 0, "indexed": 0}
+            self._save_state(state)
+        else:
+            logger.info(
+                "Resuming rebuild after document %d (%d already indexed)",
+                state["last_id"],
+                state["indexed"],
+            )
+
+        ix = search_module.index.open_dir(str(self.build_dir))
+        resumed_from = state["indexed"]
+        # The first batch after a resume may overlap a commit whose checkpoint was lost
+        replace = resumed_from > 0
+        start = time.perf_counter()
+        pending: List[dict] = []
+
+        async def commit() -> None:
+            nonlocal pending, replace
+            await asyncio.to_thread(self._commit, ix, pending, replace)
+            replace = False
+            state["last_id"] = int(pending[-1]["doc_id"])
+            state["indexed"] += len(pending)
+            self._save_state(state)
+            done = state["indexed"] - resumed_from
+            elapsed = time.perf_counter() - start
+            logger.info(
+                "Indexed %d documents (%.1f docs/sec)",
+                state["indexed"],
+                done / elapsed if elapsed > 0 else 0.0,
+            )
+            pending = []
+
+        async for chunk in self.iter_chunks(state["last_id"]):
+            pending.extend(chunk)
+            if len(pending) >= self.commit_every:
+                await commit()
+        if pending:
+            await commit()
+
+        if optimize:
+            await asyncio.to_thread(ix.optimize)
+
+        if swap:
+            with index_write_lock(self.index_dir):
+                await self.replay(ix)
+                ix.close()
+                self.swap()
+        else:
+            ix.close()
+
+        return RebuildReport(
+            indexed=state["indexed"] - resumed_from,
+            resumed_from=resumed_from,
+            elapsed=time.perf_counter() - start,
+            swapped=swap,
+        )
+
+    def _commit(self, ix, docs: List[dict], replace: bool) -> None:
+        if not ix.schema["content"].stored:
+            store = TextStore(self.build_dir / TextStore.FILENAME)
+            try:
+                store.put_many((int(fields["doc_id"]), fields["content"]) for fields in docs)
+            finally:
+                store.close()
+        if self.procs > 1:
+            writer = ix.writer(procs=self.procs, multisegment=True, limitmb=self.limitmb)
+        else:
+            writer = ix.writer(limitmb=self.limitmb)
+        add = writer.update_document if replace else writer.add_document
+        try:
+            for fields in docs:
+                add(**fields)
+        except Exception:
+            writer.cancel()
+            raise
+        writer.commit()
+
+    async def replay(self, ix) -> int:
+        """Carry over documents the live index changed during the rebuild.
+
+        Call under :func:`~app.services.index_journal.index_write_lock`.
+        Returns how many journaled documents were updated or removed.
+        """
+        ids = read_journal(self.build_dir)
+        if not ids:
+            return 0
+        docs: List[dict] = []
+        async for chunk in self.iter_chunks(ids=ids):
+            docs.extend(chunk)
+        found = {int(fields["doc_id"]) for fields in docs}
+        removed = [doc_id for doc_id in ids if doc_id not in found]
+        await asyncio.to_thread(self._apply_journal, ix, docs, removed)
+        logger.info("Replayed %d documents changed during the rebuild", len(ids))
+        return len(ids)
+
+    def _apply_journal(self, ix, docs: List[dict], removed: List[int]) -> None:
+        if not ix.schema["content"].stored:
+            store = TextStore(self.build_dir / TextStore.FILENAME)
+            try:
+                store.put_many((int(fields["doc_id"]), fields["content"]) for fields in docs)
+                store.delete_many(removed)
+            finally:
+                store.close()
+        writer = ix.writer(limitmb=self.limitmb)
+        try:
+            for fields in docs:
+                writer.update_document(**fields)
+            for doc_id in removed:
+                writer.delete_by_term("doc_id", str(doc_id))
+        except Exception:
+            writer.cancel()
+            raise
+        writer.commit()
+
+    def swap(self) -> None:
+        """Replace the live index directory with the finished rebuild."""
+        (self.build_dir / STATE_FILE).unlink(missing_ok=True)
+        (self.build_dir / JOURNAL_FILE).unlink(missing_ok=True)
+        swap_index_dir(self.build_dir, self.index_dir)
+
+    def _load_state(self) -> Optional[dict]:
+        path = self.build_dir / STATE_FILE
+        if not path.exists() or not search_module.index.exists_in(str(self.build_dir)):
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _save_state(self, state: dict) -> None:
+        path = self.build_dir / STATE_FILE
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the search index from the database")
+    parser.add_argument("--procs", type=int, default=None, help="tokenizer processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows per DB fetch")
+    parser.add_argument(
+        "--commit-every", type=int, default=10000, help="documents per checkpointed commit"
+    )
+    parser.add_argument("--fresh", action="store_true", help="discard a partial rebuild")
+    parser.add_argument("--optimize", action="store_true", help="merge into one segment")
+    parser.add_argument(
+        "--no-swap", action="store_true", help="leave the result in <INDEX_DIR>.rebuild"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    options = dict(procs=args.procs, chunk_size=args.chunk_size, commit_every=args.commit_every)
+    shards = settings.SEARCH_SHARDS
+    targets = [("", {})]
+    if shards > 1:
+        targets = [(f"Shard {i}: ", {"shard": (i, shards)}) for i in range(shards)]
+    for label, shard_options in targets:
+        rebuilder = IndexRebuilder(**options, **shard_options)
+        report = asyncio.run(
+            rebuilder.run(fresh=args.fresh, optimize=args.optimize, swap=not args.no_swap)
+        )
+        print(
+            f"{label}Indexed {report.indexed} documents in {report.elapsed:.1f}s "
+            f"({report.docs_per_sec:.1f} docs/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Single indexer process for deployments with several web workers.
+
+Usage::
+
+    python -m app.services.index_server [--socket PATH]
+
+Each ``uvicorn --workers N`` worker has its own :class:`SearchService`, and
+writers opened by several of them on one ``INDEX_DIR`` contend for Whoosh's
+lock. Instead, run this process once next to the workers and start the workers
+with ``INDEX_WRITER=remote``: they send every index update to it over a Unix
+socket and only ever read the index, refreshing onto each generation it
+commits. The indexer batches the updates with the write-behind queue and runs
+segment maintenance; it is the only process that opens a writer.
+
+The protocol is one JSON object per line in each direction. Requests are
+``{"op": "put", "doc_id": 1, "fields": {...}}`` (``fields`` null deletes),
+``{"op": "put_many", "docs": [[1, {...}], [2, null]]}``, queued together,
+``{"op": "flush"}`` and ``{"op": "stats"}``; every request gets
+``{"ok": true, ...}`` or ``{"ok": false, "error": "..."}`` back.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class IndexUnavailableError(RuntimeError):
+    """The indexer process could not be reached or rejected an update."""
+
+
+def encode_fields(fields: Optional[dict]) -> Optional[dict]:
+    if fields is None:
+        return None
+    encoded = dict(fields)
+    if isinstance(encoded.get("created_at"), datetime):
+        encoded["created_at"] = encoded["created_at"].isoformat()
+    return encoded
+
+
+def decode_fields(fields: Optional[dict]) -> Optional[dict]:
+    if fields is None:
+        return None
+    decoded = dict(fields)
+    if isinstance(decoded.get("created_at"), str):
+        decoded["created_at"] = datetime.fromisoformat(decoded["created_at"])
+    return decoded
+
+
+class IndexClient:
+    """Blocking client used by read-only workers to hand updates to the indexer.
+
+    One connection is kept open and shared under a lock; a request that fails
+    to connect or finds the connection broken is sent again once on a new one,
+    since it never reached the indexer. A timeout fails the request without a
+    resend: the indexer may still be working on it. ``timeout`` has to cover a
+    ``flush``, which waits for a batched commit. Async callers go through
+    :meth:`SearchService.asubmit_many`, which runs requests in a worker thread.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self.sent = 0
+        self.failures = 0
+
+    def put(self, doc_id: int, fields: Optional[dict]) -> None:
+        self.request({"op": "put", "doc_id": doc_id, "fields": encode_fields(fields)})
+
+    def put_many(self, batch: dict) -> None:
+        self.request(
+            {
+                "op": "put_many",
+                "docs": [[doc_id, encode_fields(fields)] for doc_id, fields in batch.items()],
+            }
+        )
+
+    def flush(self) -> None:
+        self.request({"op": "flush"})
+
+    def remote_stats(self) -> dict:
+        return self.request({"op": "stats"})["stats"]
+
+    def request(self, message: dict) -> dict:
+        payload = (json.dumps(message) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                try:
+                    reply = self._roundtrip(payload)
+                except (ConnectionError, FileNotFoundError):
+                    # Refused, or a connection the indexer dropped (say on restart)
+                    self._disconnect()
+                    reply = self._roundtrip(payload)
+            except OSError as exc:
+                self._disconnect()
+                self.failures += 1
+                raise IndexUnavailableError(
+                    f"Indexer at {self.socket_path} is unavailable: {exc}"
+                ) from exc
+            if not reply.get("ok"):
+                self.failures += 1
+                raise IndexUnavailableError(reply.get("error") or "indexer rejected the request")
+            self.sent += 1
+            return reply
+
+    def _roundtrip(self, payload: bytes) -> dict:
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock, self._file = sock, sock.makefile("rb")
+        self._sock.sendall(payload)
+        line = self._file.readline()
+        if not line:
+            raise ConnectionResetError("indexer closed the connection")
+        return json.loads(line)
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": "remote",
+            "socket": self.socket_path,
+            "sent": self.sent,
+            "failures": self.failures,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+
+class IndexServer:
+    """Accepts index updates from the workers and applies them to ``service``."""
+
+    def __init__(self, service: Any, socket_path: str):
+        self.service = service
+        self.socket_path = socket_path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    async def start(self) -> None:
+        if self.service.backend.available:
+            # Workers only open the index, so it has to exist before they search
+            await asyncio.to_thread(self.service.backend.generation)
+        await self.service.start_write_behind()
+        if settings.INDEX_MAINTENANCE_ENABLED:
+            self.service.start_maintenance()
+        path = Path(self.socket_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            # Left behind by an indexer that did not shut down cleanly
+            path.unlink()
+        self._server = await asyncio.start_unix_server(self._handle, path=str(path))
+        os.chmod(path, 0o660)
+        logger.info("Indexer listening on %s", path)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            Path(self.socket_path).unlink(missing_ok=True)
+        await self.service.stop_maintenance()
+        await self.service.stop_write_behind()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self._dispatch(line)
+                writer.write((json.dumps(reply, default=str) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line: bytes) -> dict:
+        self.requests += 1
+        try:
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "put":
+                self.service.submit(int(message["doc_id"]), decode_fields(message.get("fields")))
+                return {"ok": True}
+            if op == "put_many":
+                self.service.submit_many(
+                    {int(doc_id): decode_fields(fields) for doc_id, fields in message["docs"]}
+                )
+                return {"ok": True}
+            if op == "flush":
+                await self.service.flush()
+                return {"ok": True}
+            if op == "stats":
+                return {"ok": True, "stats": self.service.stats()}
+            return {"ok": False, "error": f"unknown op {op!r}"}
+        except Exception as exc:
+            logger.exception("Indexer request failed")
+            return {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the single search indexer process")
+    parser.add_argument("--socket", default=None, help="defaults to INDEX_SOCKET")
+    args = parser.parse_args(argv)
+
+    from app.services.search_service import SearchService
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    # This process is the writer, whatever the workers are configured with
+    server = IndexServer(SearchService(writer="local"), args.socket or settings.INDEX_SOCKET)
+
+    async def run() -> None:
+        try:
+            await server.serve_forever()
+        finally:
+            await server.stop()
+            server.service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,945 @@
+"""In-process BM25 search engine on NumPy arrays.
+
+The index is a list of immutable segments, each a directory of ``.npy`` files
+that are memory-mapped on open:
+
+- ``terms`` (sorted) and ``term_ptr`` map a term to its slice of postings;
+- ``post_doc`` holds the segment row of each posting and ``post_occ`` its
+  slice of occurrences (term frequency is the slice length);
+- ``occ_start`` / ``occ_end`` are the character offsets of every occurrence,
+  used for highlighting and phrase matching;
+- per-document columns ``doc_ids``, ``doc_len``, ``file_type``, ``folder_id``,
+  ``created_at``, ``file_size`` and the ``tag_doc`` / ``tag_id`` and
+  ``path_doc`` / ``path_id`` (each document's folder and its ancestors) pairs
+  serve the filters and sorts.
+
+Every commit writes one new segment plus copy-on-write deletion masks and then
+publishes them through ``manifest.json``, so searches run lock-free on the
+snapshot they started with. Files a new manifest no longer uses are deleted
+``INDEX_FILE_GRACE`` seconds later, so other processes can still open the
+manifest they just read. Scores follow Whoosh's BM25F (same idf, B, K1
+and byte-quantized field lengths) so both backends rank alike.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    import jieba
+except ImportError:  # pragma: no cover
+    jieba = None
+
+from app.core.config import settings
+from app.services.highlighter import OffsetHighlighter, merge_spans
+from app.services.index_queue import IndexBatch
+from app.services.query_parser import (
+    AndQ,
+    EveryQ,
+    NotQ,
+    OrQ,
+    PhraseQ,
+    PrefixQ,
+    QueryParser,
+    TermQ,
+    query_terms,
+    tokenize,
+)
+from app.services.search_backend import (
+    FACETS,
+    PinnedSnapshot,
+    SearchFilters,
+    SearchResult,
+    SearchSort,
+    export_hit,
+    format_facets,
+)
+from app.services.suggest import TermDictionary
+from app.services.text_store import TextStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+B = 0.75
+K1 = 1.2
+_EPOCH = datetime(1970, 1, 1)
+_NO_DATE = -(2**63)
+_EXPORT_CHUNK = 1024  # rows whose columns iter_hits converts at once
+
+if np is not None:
+    # Whoosh stores field lengths in one byte; these are the lengths each byte
+    # decodes to (whoosh.util.numeric._length_byte_cache)
+    _LENGTH_TABLE = np.round((1.033 ** np.arange(256) - 1) * 27).astype(np.float64)
+
+
+def _quantize_lengths(lengths):
+    codes = np.minimum(np.searchsorted(_LENGTH_TABLE, lengths, side="left"), 255)
+    return _LENGTH_TABLE[codes]
+
+
+def _to_micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return _NO_DATE
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+# --- Segments ----------------------------------------------------------------
+
+_ARRAYS = (
+    "terms",
+    "term_ptr",
+    "post_doc",
+    "post_occ",
+    "occ_start",
+    "occ_end",
+    "doc_ids",
+    "doc_len",
+    "file_type",
+    "folder_id",
+    "created_at",
+    "file_size",
+    "tag_doc",
+    "tag_id",
+    "path_doc",
+    "path_id",
+)
+# Columns that segments written by earlier versions do not have
+_ADDED_ARRAYS = ("file_size", "path_doc", "path_id")
+
+
+def _load_array(path: Path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Zero-length arrays cannot be memory-mapped
+        return np.load(path)
+
+
+class Segment:
+    """One immutable, memory-mapped batch of documents."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        for array in _ARRAYS:
+            if array in _ADDED_ARRAYS and not (path / f"{array}.npy").exists():
+                continue
+            setattr(self, array, _load_array(path / f"{array}.npy"))
+        self.doc_count = len(self.doc_ids)
+        if not hasattr(self, "file_size"):
+            self.file_size = np.zeros(self.doc_count, dtype=np.int64)
+        if not hasattr(self, "path_id"):
+            # Written before folder paths: each document is in its own folder only
+            self.path_doc = np.flatnonzero(self.folder_id).astype(np.int32)
+            self.path_id = np.asarray(self.folder_id)[self.path_doc]
+        self.total_length = int(self.doc_len.sum()) if self.doc_count else 0
+        self.norm_length = _quantize_lengths(self.doc_len)
+
+    def postings(self, text: str) -> Tuple[int, int]:
+        """Return the ``[start, stop)`` postings slice of ``text``."""
+        i = int(np.searchsorted(self.terms, text))
+        if i < len(self.terms) and self.terms[i] == text:
+            return int(self.term_ptr[i]), int(self.term_ptr[i + 1])
+        return 0, 0
+
+    def spans(self, row: int, terms: List[str]) -> List[Tuple[int, int]]:
+        found = []
+        for text in terms:
+            found.extend(self.term_spans(row, text))
+        return found
+
+    def term_spans(self, row: int, text: str) -> List[Tuple[int, int]]:
+        """Character spans of ``text`` in ``row``, in document order."""
+        start, stop = self.postings(text)
+        if start == stop:
+            return []
+        p = start + int(np.searchsorted(self.post_doc[start:stop], row))
+        if p < stop and self.post_doc[p] == row:
+            a, b = int(self.post_occ[p]), int(self.post_occ[p + 1])
+            return list(zip(self.occ_start[a:b].tolist(), self.occ_end[a:b].tolist()))
+        return []
+
+    def occurrences(self):
+        """Expand postings back to per-occurrence (term index, row, start, end)."""
+        tf = np.diff(self.post_occ)
+        post_term = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.term_ptr))
+        return (
+            np.repeat(post_term, tf),
+            np.repeat(np.asarray(self.post_doc), tf),
+            np.asarray(self.occ_start),
+            np.asarray(self.occ_end),
+        )
+
+
+def _write_segment(
+    path: Path,
+    terms,
+    occ_term,
+    occ_doc,
+    occ_start,
+    occ_end,
+    columns: Dict[str, Any],
+) -> Segment:
+    """Group occurrences into CSR postings and save them as a segment directory."""
+    n_docs = len(columns["doc_ids"])
+    # Drop vocabulary that no longer has occurrences (e.g. only in deleted docs)
+    used = np.bincount(occ_term, minlength=len(terms)) > 0
+    remap = np.cumsum(used) - 1
+    terms = terms[used]
+    occ_term = remap[occ_term] if len(occ_term) else occ_term
+
+    order = np.lexsort((occ_start, occ_doc, occ_term))
+    occ_term, occ_doc = occ_term[order], occ_doc[order]
+    occ_start, occ_end = occ_start[order], occ_end[order]
+
+    boundary = np.ones(len(occ_term), dtype=bool)
+    boundary[1:] = (occ_term[1:] != occ_term[:-1]) | (occ_doc[1:] != occ_doc[:-1])
+    post_first = np.flatnonzero(boundary)
+    term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_ptr[1:] = np.cumsum(np.bincount(occ_term[post_first], minlength=len(terms)))
+
+    arrays = dict(
+        terms=terms if len(terms) else np.array([], dtype="<U1"),
+        term_ptr=term_ptr,
+        post_doc=occ_doc[post_first].astype(np.int32),
+        post_occ=np.append(post_first, len(occ_term)).astype(np.int64),
+        occ_start=occ_start.astype(np.int32),
+        occ_end=occ_end.astype(np.int32),
+        doc_len=np.bincount(occ_doc, minlength=n_docs).astype(np.int32),
+        **columns,
+    )
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(tmp / f"{name}.npy", array)
+    os.replace(tmp, path)
+    return Segment(path)
+
+
+def _columns(docs: List[dict]) -> Dict[str, Any]:
+    tag_doc, tag_id = [], []
+    path_doc, path_id = [], []
+    for row, fields in enumerate(docs):
+        for tag in filter(None, (fields.get("tag_ids") or "").split(",")):
+            tag_doc.append(row)
+            tag_id.append(int(tag))
+        path = fields.get("folder_path", fields.get("folder_id")) or ""
+        for folder in filter(None, path.split(",")):
+            path_doc.append(row)
+            path_id.append(int(folder))
+    return dict(
+        doc_ids=np.array([int(f["doc_id"]) for f in docs], dtype=np.int64),
+        file_type=np.array([f.get("file_type") or "" for f in docs], dtype=str),
+        folder_id=np.array([int(f.get("folder_id") or 0) for f in docs], dtype=np.int64),
+        created_at=np.array([_to_micros(f.get("created_at")) for f in docs], dtype=np.int64),
+        file_size=np.array([int(f.get("file_size") or 0) for f in docs], dtype=np.int64),
+        tag_doc=np.array(tag_doc, dtype=np.int32),
+        tag_id=np.array(tag_id, dtype=np.int64),
+        path_doc=np.array(path_doc, dtype=np.int32),
+        path_id=np.array(path_id, dtype=np.int64),
+    )
+
+
+@dataclass
+class _Snapshot:
+    generation: int
+    segments: Tuple[Segment, ...]
+    deleted: Tuple[Optional[Any], ...]  # bool mask per segment, or None
+    deleted_files: Tuple[Optional[str], ...]
+
+    @property
+    def doc_count_all(self) -> int:
+        return sum(seg.doc_count for seg in self.segments)
+
+    def live(self, k: int):
+        mask = self.deleted[k]
+        if mask is None:
+            return np.ones(self.segments[k].doc_count, dtype=bool)
+        return ~mask
+
+
+class _Scoring:
+    """Index-wide statistics for one query, shared by every segment.
+
+    Like Whoosh, document counts, frequencies and lengths include deleted
+    documents until their segment is merged.
+    """
+
+    def __init__(self, snap: _Snapshot):
+        self.snap = snap
+        self.doc_count_all = snap.doc_count_all
+        total_length = sum(seg.total_length for seg in snap.segments)
+        self.avgfl = (total_length / (self.doc_count_all or 1)) or 1
+        self._idf: Dict[str, float] = {}
+        self._prefixes: Dict[str, List[str]] = {}
+
+    def idf(self, text: str) -> float:
+        if text not in self._idf:
+            df = 0
+            for seg in self.snap.segments:
+                start, stop = seg.postings(text)
+                df += stop - start
+            self._idf[text] = float(np.log(self.doc_count_all / (df + 1)) + 1)
+        return self._idf[text]
+
+    def expand(self, prefix: str) -> List[str]:
+        if prefix not in self._prefixes:
+            terms = set()
+            for seg in self.snap.segments:
+                lo = int(np.searchsorted(seg.terms, prefix, side="left"))
+                hi = int(np.searchsorted(seg.terms, prefix + chr(0x10FFFF), side="left"))
+                terms.update(seg.terms[lo:hi].tolist())
+            self._prefixes[prefix] = sorted(terms)
+        return self._prefixes[prefix]
+
+
+class NumpyBackend:
+    """BM25 backend that evaluates queries with vectorized NumPy operations."""
+
+    name = "numpy"
+    transactional = False
+    missing = "Install 'numpy' and 'jieba' to enable search."
+    SUBDIR = "bm25"
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._snap: Optional[_Snapshot] = None
+        self._manifest_mtime: Optional[int] = None
+        self._text_store: Optional[TextStore] = None
+        self._highlighter = OffsetHighlighter(
+            context_chars=settings.SEARCH_HIGHLIGHT_CONTEXT,
+            max_fragments=settings.SEARCH_HIGHLIGHT_FRAGMENTS,
+        )
+
+    @property
+    def available(self) -> bool:
+        return np is not None and jieba is not None
+
+    def _require_backend(self) -> None:
+        if not self.available:
+            raise RuntimeError(f"Search backend is not available. {self.missing}")
+
+    @property
+    def text_store(self) -> TextStore:
+        if self._text_store is None:
+            with self._lock:
+                if self._text_store is None:
+                    self._text_store = TextStore(self.index_dir / TextStore.FILENAME)
+        return self._text_store
+
+    # --- Snapshots -----------------------------------------------------------
+
+    def _manifest_stat(self) -> Optional[int]:
+        try:
+            return os.stat(self.index_dir / MANIFEST).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _snapshot(self) -> _Snapshot:
+        """Current snapshot, reloaded if another process published a newer one."""
+        self._require_backend()
+        mtime = self._manifest_stat()
+        if self._snap is None or mtime != self._manifest_mtime:
+            with self._lock:
+                if self._snap is None or mtime != self._manifest_mtime:
+                    for attempt in range(3):
+                        try:
+                            self._snap = self._load(self._snap)
+                            break
+                        except FileNotFoundError:
+                            # Read a manifest whose files outlived their grace
+                            # period; a newer manifest replaced it meanwhile
+                            if attempt == 2:
+                                raise
+                            mtime = self._manifest_stat()
+                    self._manifest_mtime = mtime
+        return self._snap
+
+    def _load(self, previous: Optional[_Snapshot]) -> _Snapshot:
+        path = self.index_dir / MANIFEST
+        if not path.exists():
+            return _Snapshot(0, (), (), ())
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        if previous is not None and previous.generation == manifest["generation"]:
+            return previous
+        reuse = {seg.name: seg for seg in previous.segments} if previous else {}
+        segments, deleted, deleted_files = [], [], []
+        for entry in manifest["segments"]:
+            segment = reuse.get(entry["name"]) or Segment(self.index_dir / entry["name"])
+            segments.append(segment)
+            deleted_files.append(entry["deleted"])
+            deleted.append(
+                np.load(self.index_dir / entry["deleted"]) if entry["deleted"] else None
+            )
+        return _Snapshot(
+            manifest["generation"], tuple(segments), tuple(deleted), tuple(deleted_files)
+        )
+
+    def _publish(self, snap: _Snapshot) -> None:
+        retired, expired = self._retire_files(snap)
+        manifest = {
+            "generation": snap.generation,
+            "segments": [
+                {"name": seg.name, "deleted": name, "docs": seg.doc_count}
+                for seg, name in zip(snap.segments, snap.deleted_files)
+            ],
+            "retired": retired,
+        }
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_dir / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp, self.index_dir / MANIFEST)
+        with self._lock:
+            self._snap = snap
+            self._manifest_mtime = self._manifest_stat()
+        for name in expired:
+            path = self.index_dir / name
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+    def _retire_files(self, snap: _Snapshot) -> Tuple[Dict[str, float], List[str]]:
+        """Split files ``snap`` no longer uses into those kept a while longer,
+        with the time they were first unused, and those to delete now.
+
+        Other processes may still be opening a superseded manifest's files,
+        so they are only deleted ``INDEX_FILE_GRACE`` seconds after the
+        manifest that stopped using them. The times live in the manifest so
+        every writer process sees them.
+        """
+        path = self.index_dir / MANIFEST
+        previous = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        since = previous.get("retired", {})
+        keep = {seg.name for seg in snap.segments} | set(filter(None, snap.deleted_files))
+        keep |= {MANIFEST, TextStore.FILENAME}
+        now = time.time()
+        retired: Dict[str, float] = {}
+        expired: List[str] = []
+        if self.index_dir.exists():
+            for file in self.index_dir.iterdir():
+                if file.name in keep or file.name.startswith(TextStore.FILENAME):
+                    continue
+                first_unused = since.get(file.name, now)
+                if now - first_unused >= settings.INDEX_FILE_GRACE:
+                    expired.append(file.name)
+                else:
+                    retired[file.name] = first_unused
+        return retired, expired
+
+    # --- Writes --------------------------------------------------------------
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Apply updates (fields) and deletions (None) in a single commit."""
+        self._require_backend()
+        with self._writer_lock:
+            snap = self._snapshot()
+            generation = snap.generation + 1
+            updates = [fields for fields in batch.values() if fields is not None]
+            self.text_store.refresh()
+            self.text_store.put_many((int(f["doc_id"]), f["content"]) for f in updates)
+
+            # Every doc_id in the batch replaces or removes its older versions
+            doc_ids = np.fromiter(batch.keys(), dtype=np.int64, count=len(batch))
+            segments = list(snap.segments)
+            deleted, deleted_files = list(snap.deleted), list(snap.deleted_files)
+            for k, seg in enumerate(segments):
+                hit = np.isin(seg.doc_ids, doc_ids)
+                if deleted[k] is not None:
+                    hit &= ~deleted[k]
+                if hit.any():
+                    mask = hit if deleted[k] is None else deleted[k] | hit
+                    name = f"del_{seg.name}_{generation}.npy"
+                    np.save(self.index_dir / name, mask)
+                    deleted[k], deleted_files[k] = mask, name
+
+            if updates:
+                segments.append(self._build(updates, f"seg_{generation:08d}"))
+                deleted.append(None)
+                deleted_files.append(None)
+
+            new_snap = _Snapshot(generation, tuple(segments), tuple(deleted), tuple(deleted_files))
+            self._publish(new_snap)
+            self.text_store.delete_many(
+                doc_id for doc_id, fields in batch.items() if fields is None
+            )
+            if len(segments) > settings.INDEX_MERGE_MAX_SEGMENTS:
+                self._merge(new_snap, optimize=False)
+
+    def _build(self, docs: List[dict], name: str) -> Segment:
+        words: List[str] = []
+        occ_doc: List[int] = []
+        starts: List[int] = []
+        ends: List[int] = []
+        for row, fields in enumerate(docs):
+            for word, start, end in tokenize(fields.get("content") or ""):
+                words.append(word)
+                occ_doc.append(row)
+                starts.append(start)
+                ends.append(end)
+        terms, occ_term = np.unique(np.array(words, dtype=str), return_inverse=True)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        return _write_segment(
+            self.index_dir / name,
+            terms,
+            occ_term.astype(np.int64),
+            np.array(occ_doc, dtype=np.int64),
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            _columns(docs),
+        )
+
+    def generation(self) -> int:
+        return self._snapshot().generation
+
+    def segment_stats(self) -> dict:
+        snap = self._snapshot()
+        docs = snap.doc_count_all
+        deleted = sum(int(mask.sum()) for mask in snap.deleted if mask is not None)
+        return {
+            "generation": snap.generation,
+            "segments": len(snap.segments),
+            "docs": docs,
+            "deleted": deleted,
+            "deleted_ratio": round(deleted / docs, 4) if docs else 0.0,
+        }
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        """Merge small segments, or rewrite everything into one when ``optimize``."""
+        with self._writer_lock:
+            self._merge(self._snapshot(), optimize)
+
+    def term_dictionaries(self, known: set) -> List[TermDictionary]:
+        """Terms and document frequencies of each segment."""
+        return [
+            (
+                seg.name,
+                None if seg.name in known
+                else list(zip(seg.terms.tolist(), np.diff(seg.term_ptr).tolist())),
+            )
+            for seg in self._snapshot().segments
+        ]
+
+    def _merge(self, snap: _Snapshot, optimize: bool) -> None:
+        if optimize:
+            chosen = list(range(len(snap.segments)))
+            if len(chosen) == 1 and snap.deleted[0] is None:
+                return
+        else:
+            # Everything but the largest segment, like Whoosh's small-segment merge
+            if len(snap.segments) < 3:
+                return
+            largest = max(range(len(snap.segments)), key=lambda k: snap.segments[k].doc_count)
+            chosen = [k for k in range(len(snap.segments)) if k != largest]
+        if not chosen:
+            return
+
+        generation = snap.generation + 1
+        terms = np.unique(np.concatenate([snap.segments[k].terms for k in chosen]))
+        parts = {key: [] for key in ("term", "doc", "start", "end")}
+        columns: Dict[str, List[Any]] = {
+            key: []
+            for key in (
+                "doc_ids", "file_type", "folder_id", "created_at", "file_size",
+                "tag_doc", "tag_id", "path_doc", "path_id",
+            )
+        }
+        offset = 0
+        for k in chosen:
+            seg, live = snap.segments[k], snap.live(k)
+            new_row = np.cumsum(live) - 1 + offset
+            term_idx, occ_doc, start, end = seg.occurrences()
+            keep = live[occ_doc]
+            global_term = np.searchsorted(terms, seg.terms)
+            parts["term"].append(global_term[term_idx[keep]])
+            parts["doc"].append(new_row[occ_doc[keep]])
+            parts["start"].append(start[keep])
+            parts["end"].append(end[keep])
+            for column in ("doc_ids", "file_type", "folder_id", "created_at", "file_size"):
+                columns[column].append(np.asarray(getattr(seg, column))[live])
+            for pair in ("tag", "path"):
+                doc, ids = getattr(seg, f"{pair}_doc"), getattr(seg, f"{pair}_id")
+                keep_pair = live[doc] if len(doc) else np.zeros(0, dtype=bool)
+                columns[f"{pair}_doc"].append(new_row[np.asarray(doc)[keep_pair]])
+                columns[f"{pair}_id"].append(np.asarray(ids)[keep_pair])
+            offset += int(live.sum())
+
+        merged_columns = {key: np.concatenate(values) for key, values in columns.items()}
+        for key in ("tag_doc", "path_doc"):
+            merged_columns[key] = merged_columns[key].astype(np.int32)
+        merged = _write_segment(
+            self.index_dir / f"seg_{generation:08d}",
+            terms,
+            np.concatenate(parts["term"]).astype(np.int64),
+            np.concatenate(parts["doc"]).astype(np.int64),
+            np.concatenate(parts["start"]).astype(np.int64),
+            np.concatenate(parts["end"]).astype(np.int64),
+            merged_columns,
+        )
+
+        rest = [k for k in range(len(snap.segments)) if k not in chosen]
+        self._publish(
+            _Snapshot(
+                generation,
+                tuple(snap.segments[k] for k in rest) + (merged,),
+                tuple(snap.deleted[k] for k in rest) + (None,),
+                tuple(snap.deleted_files[k] for k in rest) + (None,),
+            )
+        )
+
+    # --- Search --------------------------------------------------------------
+
+    def parse(self, query: str):
+        self._require_backend()
+        return QueryParser().parse(query)
+
+    def _matches(self, parsed, snap: _Snapshot, filters: SearchFilters):
+        """Yield (segment index, rows, scores) of the live, filtered matches."""
+        stats = _Scoring(snap)
+        for k, seg in enumerate(snap.segments):
+            if not seg.doc_count:
+                continue
+            mask, scores = self._evaluate(parsed, seg, stats)
+            if mask is None:
+                continue
+            mask &= snap.live(k)
+            mask &= self._filter_mask(seg, filters)
+            rows = np.flatnonzero(mask)
+            if len(rows):
+                yield k, rows, scores[rows]
+
+    def _evaluate(self, node, seg: Segment, stats: "_Scoring"):
+        """Return (match mask, scores) over the segment's rows, scored like Whoosh."""
+        n = seg.doc_count
+        if isinstance(node, TermQ):
+            return self._terms_union([node.text], seg, stats)
+        if isinstance(node, PrefixQ):
+            # Expanded against the whole index's vocabulary, then scored as an OR
+            return self._terms_union(stats.expand(node.prefix), seg, stats)
+        if isinstance(node, EveryQ):
+            return np.ones(n, dtype=bool), np.ones(n)
+        if isinstance(node, PhraseQ):
+            # Scored like Whoosh, as the conjunction of every token
+            conjunction = AndQ(tuple(TermQ(text) for text in dict.fromkeys(node.terms)))
+            mask, scores = self._evaluate(conjunction, seg, stats)
+            for row in np.flatnonzero(mask):
+                mask[row] = self._adjacent(seg, int(row), node.words)
+            return mask, scores
+        if isinstance(node, NotQ):
+            child_mask, _ = self._evaluate(node.child, seg, stats)
+            return ~child_mask, np.ones(n)
+        if isinstance(node, AndQ):
+            mask, scores = np.ones(n, dtype=bool), np.zeros(n)
+            for child in node.children:
+                child_mask, child_scores = self._evaluate(child, seg, stats)
+                mask &= child_mask
+                scores += child_scores
+            return mask, scores
+        if isinstance(node, OrQ):
+            if all(isinstance(child, TermQ) for child in node.children):
+                return self._terms_union([child.text for child in node.children], seg, stats)
+            mask, scores = np.zeros(n, dtype=bool), np.zeros(n)
+            for child in node.children:
+                child_mask, child_scores = self._evaluate(child, seg, stats)
+                mask |= child_mask
+                scores += np.where(child_mask, child_scores, 0.0)
+            return mask, scores
+        return None, None
+
+    def _adjacent(self, seg: Segment, row: int, words: Tuple[str, ...]) -> bool:
+        """Whether ``words`` occur back to back in ``row``, checked on the
+        stored text between the candidate occurrences only."""
+        content = None
+        ends: List[int] = []
+        for i, word in enumerate(words):
+            spans = seg.term_spans(row, word)
+            if i == 0:
+                ends = sorted(end for _start, end in spans)
+                continue
+            reached = []
+            for start, end in spans:
+                k = bisect.bisect_right(ends, start)
+                if not k:
+                    continue
+                gap = ends[k - 1]
+                if gap < start:
+                    if content is None:
+                        content = self.text_store.get(int(seg.doc_ids[row])) or ""
+                    if content[gap:start].strip():
+                        continue
+                reached.append(end)
+            ends = sorted(reached)
+            if not ends:
+                return False
+        return bool(ends)
+
+    @staticmethod
+    def _terms_union(terms: List[str], seg: Segment, stats: "_Scoring"):
+        """Match any of ``terms``, summing their BM25 scores in one pass."""
+        n = seg.doc_count
+        docs_parts, weight_parts = [], []
+        for text in terms:
+            start, stop = seg.postings(text)
+            if start == stop:
+                continue
+            docs = seg.post_doc[start:stop]
+            tf = np.diff(seg.post_occ[start : stop + 1]).astype(np.float64)
+            fl = seg.norm_length[docs]
+            docs_parts.append(docs)
+            weight_parts.append(
+                stats.idf(text) * (tf * (K1 + 1)) / (tf + K1 * ((1 - B) + B * fl / stats.avgfl))
+            )
+        if not docs_parts:
+            return np.zeros(n, dtype=bool), np.zeros(n)
+        docs = np.concatenate(docs_parts)
+        scores = np.bincount(docs, weights=np.concatenate(weight_parts), minlength=n)
+        return np.bincount(docs, minlength=n) > 0, scores
+
+    @staticmethod
+    def _filter_mask(seg: Segment, filters: SearchFilters):
+        mask = np.ones(seg.doc_count, dtype=bool)
+        if filters.file_type:
+            mask &= seg.file_type == filters.file_type
+        if filters.folder_id and filters.include_subfolders:
+            in_subtree = np.zeros(seg.doc_count, dtype=bool)
+            in_subtree[seg.path_doc[seg.path_id == filters.folder_id]] = True
+            mask &= in_subtree
+        elif filters.folder_id:
+            mask &= seg.folder_id == filters.folder_id
+        if filters.tag_ids:
+            tagged = np.zeros(seg.doc_count, dtype=bool)
+            tagged[seg.tag_doc[np.isin(seg.tag_id, filters.tag_ids)]] = True
+            mask &= tagged
+        if filters.date_from:
+            mask &= seg.created_at >= _to_micros(filters.date_from)
+        if filters.date_to:
+            mask &= (seg.created_at <= _to_micros(filters.date_to)) & (
+                seg.created_at != _NO_DATE
+            )
+        return mask
+
+    def search(
+        self,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        snapshot: Optional[PinnedSnapshot] = None,
+        after: Optional[tuple] = None,
+    ) -> SearchResult:
+        """Rank every match; totals are always exact.
+
+        Hits are ranked by key columns, most significant first. With ``after``
+        only the hits whose keys sort after it are ranked.
+        """
+        snap = snapshot.handle if snapshot is not None else self._snapshot()
+        matches = list(self._matches(parsed, snap, filters))
+        facet_counts = format_facets(self._facet_counts(snap, matches)) if facets else None
+        if not matches:
+            return SearchResult(
+                items=[], total=0, facets=facet_counts, keys=[] if after is not None else None
+            )
+
+        bases = np.cumsum([0] + [seg.doc_count for seg in snap.segments])
+        seg_index = np.concatenate([np.full(len(rows), k) for k, rows, _ in matches])
+        rows = np.concatenate([rows for _, rows, _ in matches])
+        scores = np.concatenate([scores for _, _, scores in matches])
+        total = len(rows)
+
+        def column(name: str):
+            return np.concatenate(
+                [np.asarray(getattr(snap.segments[s], name))[r] for s, r, _ in matches]
+            )
+
+        if sort is None:
+            # Best score first, then index order as Whoosh does, or doc_id
+            # when keyed since index order changes as segments merge
+            tiebreak = column("doc_ids") if after is not None else bases[seg_index] + rows
+            keys: List[Any] = [-scores, tiebreak]
+        elif sort.recency:
+            created = column("created_at")
+            seconds = np.where(created == _NO_DATE, 0, created) / 1e6
+            with np.errstate(divide="ignore"):
+                decayed = np.log(scores) + seconds * (np.log(2) / (sort.half_life * 86400))
+            keys = [-decayed, column("doc_ids")]
+        else:
+            doc_ids = column("doc_ids")
+            primary = doc_ids if sort.field == "doc_id" else column(sort.field)
+            if sort.descending:
+                primary = np.invert(primary)  # reverses int64 order without overflow
+            keys = [primary, -scores, doc_ids]
+
+        candidates = np.arange(total)
+        if after:
+            later = np.zeros(total, dtype=bool)
+            tied = np.ones(total, dtype=bool)
+            for values, bound in zip(keys, after):
+                later |= tied & (values > bound)
+                tied &= values == bound
+            candidates = np.flatnonzero(later)
+        k = min(skip + limit, len(candidates))
+        primary = keys[0][candidates]
+
+        if k < len(candidates):
+            top = np.argpartition(primary, k - 1)[:k]
+            # Keep every document tied with the k-th key so ties break alike
+            top = np.flatnonzero(primary <= primary[top].max())
+        else:
+            top = np.arange(len(candidates))
+        top = candidates[top]
+        order = top[np.lexsort(tuple(values[top] for values in reversed(keys)))]
+        order = order[skip : skip + limit]
+
+        if sort is not None and sort.recency:
+            now = time.time()
+            scores = scores.copy()
+            scores[order] = [sort.recency_score(-keys[0][i], now) for i in order]
+
+        terms = query_terms(parsed)
+        if len(order):
+            self.text_store.refresh()
+        items = [
+            self._hit_to_item(snap.segments[seg_index[i]], int(rows[i]), float(scores[i]),
+                              query, terms)
+            for i in order
+        ]
+        page_keys = None
+        if after is not None:
+            page_keys = [tuple(values[i].item() for values in keys) for i in order]
+        return SearchResult(
+            items=items, total=total, total_exact=True, facets=facet_counts, keys=page_keys
+        )
+
+    def pin(self) -> PinnedSnapshot:
+        # Snapshots are immutable and their segment files are memory-mapped,
+        # so holding one keeps its documents searchable after merges
+        snap = self._snapshot()
+        return PinnedSnapshot(snap.generation, snap)
+
+    @staticmethod
+    def _facet_counts(snap: _Snapshot, matches) -> Dict[str, Counter]:
+        """Count the matched rows per value straight from the segment columns."""
+        counts: Dict[str, Counter] = {name: Counter() for name in FACETS}
+
+        def add(name: str, values) -> None:
+            keys, n = np.unique(values, return_counts=True)
+            counts[name].update(dict(zip(keys.tolist(), n.tolist())))
+
+        for k, rows, _scores in matches:
+            seg = snap.segments[k]
+            add("file_type", seg.file_type[rows])
+            add("folder_id", seg.folder_id[rows])
+            matched = np.zeros(seg.doc_count, dtype=bool)
+            matched[rows] = True
+            add("tag_ids", seg.tag_id[matched[seg.tag_doc]])
+            created = seg.created_at[rows]
+            created = created[created != _NO_DATE]
+            years = created.astype("datetime64[us]").astype("datetime64[Y]")
+            add("year", years.astype(np.int64) + 1970)
+        return counts
+
+    def iter_hits(self, parsed, filters: SearchFilters) -> Iterator[dict]:
+        """Matches of one segment at a time, their columns read in chunks."""
+        snap = self._snapshot()
+        for k, rows, scores in self._matches(parsed, snap, filters):
+            seg = snap.segments[k]
+            for start in range(0, len(rows), _EXPORT_CHUNK):
+                chunk = rows[start : start + _EXPORT_CHUNK]
+                yield from map(
+                    export_hit,
+                    seg.doc_ids[chunk].tolist(),
+                    seg.file_type[chunk].tolist(),
+                    seg.folder_id[chunk].tolist(),
+                    [
+                        None if micros == _NO_DATE else _EPOCH + timedelta(microseconds=micros)
+                        for micros in seg.created_at[chunk].tolist()
+                    ],
+                    seg.file_size[chunk].tolist(),
+                    scores[start : start + _EXPORT_CHUNK].tolist(),
+                )
+
+    def count(self, parsed, filters: SearchFilters) -> int:
+        snap = self._snapshot()
+        return sum(len(rows) for _, rows, _ in self._matches(parsed, snap, filters))
+
+    def _hit_to_item(self, seg: Segment, row: int, score: float, query: str, terms) -> dict:
+        from app.services.search_service import highlight_snippet
+
+        doc_id = int(seg.doc_ids[row])
+        content = self.text_store.get(doc_id) or ""
+        highlighted = None
+        if terms and content:
+            highlighted = self._highlighter.render(content, merge_spans(seg.spans(row, terms)))
+        if highlighted is None:
+            if not isinstance(content, str):
+                content = content[: 10 * self._highlighter.context_chars]
+            highlighted = highlight_snippet(content, query)
+        folder_id = int(seg.folder_id[row])
+        return {
+            "doc_id": doc_id,
+            "file_type": str(seg.file_type[row]),
+            "folder_id": folder_id or None,
+            "score": score,
+            "highlight": highlighted,
+        }
+
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        def page_in() -> None:
+            # Read through the lookup arrays so the first query does not
+            # fault them in from disk
+            for seg in self._snapshot().segments:
+                for array in (seg.term_ptr, seg.doc_ids, seg.folder_id, seg.created_at):
+                    int(array.sum())
+                np.searchsorted(seg.terms, "")
+
+        return [("index_open", self._snapshot), ("searcher", page_in)]
+
+    def stats(self) -> dict:
+        snap = self._snap
+        index_stats = None
+        if snap is not None:
+            index_stats = {
+                **self.segment_stats(),
+                "terms": sum(len(seg.terms) for seg in snap.segments),
+                "postings": sum(len(seg.post_doc) for seg in snap.segments),
+                "bytes": sum(
+                    f.stat().st_size for seg in snap.segments for f in seg.path.iterdir()
+                ),
+            }
+        return {
+            "numpy_index": index_stats,
+            "text_store": self._text_store.stats() if self._text_store else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._snap = None
+            self._manifest_mtime = None
+        if self._text_store is not None:
+            self._text_store.close()
+            self._text_store = None
@@ -0,0 +1,208 @@
+"""Query syntax shared by the backends that do not run on Whoosh.
+
+:class:`QueryParser` turns a query string into a small tree of frozen
+dataclasses, which the NumPy backend evaluates over its postings and the FTS
+backend compiles to an FTS5 MATCH expression. Words are segmented by jieba in
+search mode, the same tokens the Whoosh schema indexes.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Tuple
+
+try:
+    import jieba
+except ImportError:  # pragma: no cover
+    jieba = None
+
+
+def tokenize(text: str) -> Iterator[Tuple[str, int, int]]:
+    """Same tokens as the Whoosh schema's JiebaTokenizer."""
+    for word, start, end in jieba.tokenize(text, mode="search"):
+        if word.strip():
+            yield word, start, end
+
+
+@dataclass(frozen=True)
+class TermQ:
+    text: str
+
+
+@dataclass(frozen=True)
+class PrefixQ:
+    prefix: str
+
+
+@dataclass(frozen=True)
+class EveryQ:
+    pass
+
+
+@dataclass(frozen=True)
+class NotQ:
+    child: Any
+
+
+@dataclass(frozen=True)
+class AndQ:
+    children: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class OrQ:
+    children: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class PhraseQ:
+    """A quoted phrase: ``terms`` are all its tokens in order, ``words`` the
+    ones not inside a longer token, which must follow each other in the text."""
+
+    terms: Tuple[str, ...]
+    words: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class NullQ:
+    pass
+
+
+def _compound(cls, children: List[Any]):
+    flat: List[Any] = []
+    for child in children:
+        if isinstance(child, NullQ):
+            continue
+        parts = child.children if isinstance(child, cls) else (child,)
+        for part in parts:
+            if part not in flat:
+                flat.append(part)
+    if not flat:
+        return NullQ()
+    if len(flat) == 1:
+        return flat[0]
+    return cls(tuple(flat))
+
+
+class QueryParser:
+    """Parses the subset of Whoosh's default query syntax the app relies on.
+
+    Whitespace-separated words are ANDed, ``OR`` binds tighter than that and
+    an explicit ``AND`` tighter still; ``NOT``, parentheses, ``word*``
+    prefixes and ``*`` work as in Whoosh. Each word is segmented by jieba
+    and its tokens are ANDed. A quoted phrase needs its words in order with
+    nothing but whitespace between them, and ``field:value`` is plain text.
+    """
+
+    def parse(self, query: str):
+        self._tokens = self._lex(query)
+        self._pos = 0
+        return self._implicit(top=True)
+
+    @staticmethod
+    def _lex(query: str) -> List[Tuple[str, str]]:
+        tokens: List[Tuple[str, str]] = []
+        i, n = 0, len(query)
+        while i < n:
+            ch = query[i]
+            if ch.isspace():
+                i += 1
+            elif ch in "()":
+                tokens.append((ch, ch))
+                i += 1
+            elif ch == '"' and query.find('"', i + 1) != -1:
+                end = query.find('"', i + 1)
+                tokens.append(("phrase", query[i + 1 : end]))
+                i = end + 1
+            else:
+                j = i
+                while j < n and not query[j].isspace() and query[j] not in "()":
+                    j += 1
+                word = query[i:j]
+                tokens.append((word if word in ("AND", "OR", "NOT") else "word", word))
+                i = j
+        return tokens
+
+    def _peek(self) -> Optional[str]:
+        return self._tokens[self._pos][0] if self._pos < len(self._tokens) else None
+
+    def _has_operand(self, offset: int = 1) -> bool:
+        pos = self._pos + offset
+        return pos < len(self._tokens) and self._tokens[pos][0] not in (")", "AND", "OR")
+
+    def _implicit(self, top: bool = False):
+        children = []
+        while self._peek() is not None:
+            if self._peek() == ")":
+                if top:
+                    self._pos += 1  # unbalanced: ignore
+                    continue
+                break
+            children.append(self._or())
+        return _compound(AndQ, children)
+
+    def _or(self):
+        children = [self._and()]
+        while self._peek() == "OR" and self._has_operand():
+            self._pos += 1
+            children.append(self._and())
+        return _compound(OrQ, children) if len(children) > 1 else children[0]
+
+    def _and(self):
+        children = [self._unary()]
+        while self._peek() == "AND" and self._has_operand():
+            self._pos += 1
+            children.append(self._unary())
+        return _compound(AndQ, children) if len(children) > 1 else children[0]
+
+    def _unary(self):
+        kind = self._peek()
+        if kind == "NOT" and self._has_operand():
+            self._pos += 1
+            child = self._unary()
+            return NotQ(child) if not isinstance(child, NullQ) else child
+        if kind == "(":
+            self._pos += 1
+            node = self._implicit()
+            if self._peek() == ")":
+                self._pos += 1
+            return node
+        _, text = self._tokens[self._pos]
+        self._pos += 1
+        if kind == "phrase":
+            return self._phrase(text)
+        if text == "*":
+            return EveryQ()
+        if len(text) > 1 and text.endswith("*") and "*" not in text[:-1]:
+            return PrefixQ(text[:-1])
+        return self._word(text)
+
+    @staticmethod
+    def _word(text: str):
+        return _compound(AndQ, [TermQ(word) for word, _start, _end in tokenize(text)])
+
+    @staticmethod
+    def _phrase(text: str):
+        tokens = list(tokenize(text))
+        # Search mode adds the sub-words of long words; only the longest count
+        words = tuple(
+            word
+            for word, start, end in tokens
+            if not any(a <= start and end <= b and b - a > end - start for _, a, b in tokens)
+        )
+        if len(words) < 2:
+            return QueryParser._word(text)
+        return PhraseQ(tuple(word for word, _start, _end in tokens), words)
+
+
+def query_terms(node) -> List[str]:
+    """The terms of a parsed query, for highlighting."""
+    if isinstance(node, TermQ):
+        return [node.text]
+    if isinstance(node, NotQ):
+        return query_terms(node.child)
+    if isinstance(node, PhraseQ):
+        return list(node.terms)
+    if isinstance(node, (AndQ, OrQ)):
+        return [text for child in node.children for text in query_terms(child)]
+    return []
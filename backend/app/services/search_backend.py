@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from math import exp, inf, log
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Protocol, Tuple
+
+from app.services.index_queue import IndexBatch
+from app.services.suggest import TermDictionary
+
+
+@dataclass
+class SearchResult:
+    items: List[dict]
+    total: int
+    total_exact: bool = True
+    did_you_mean: Optional[str] = None  # corrected query, for zero- and low-hit searches
+    facets: Optional[Dict[str, Dict[str, int]]] = None  # see format_facets
+    keys: Optional[List[tuple]] = None  # rank key per item, when paging with ``after``
+    next_cursor: Optional[str] = None  # resumes after the last item; see search_cursor
+
+
+FACETS = ("file_type", "folder_id", "tag_ids", "year")
+
+
+def format_facets(counts: Mapping[str, Mapping[Any, int]]) -> Dict[str, Dict[str, int]]:
+    """Hit counts per value of each facet, with string keys, largest first.
+
+    Documents without a folder, tags or date are not counted under any value.
+    """
+    return {
+        name: dict(
+            sorted(
+                ((str(value), int(n)) for value, n in counts.get(name, {}).items()
+                 if value not in (None, "", 0) and n),
+                key=lambda item: (-item[1], item[0]),
+            )
+        )
+        for name in FACETS
+    }
+
+
+def export_hit(
+    doc_id: Any,
+    file_type: Optional[str],
+    folder_id: Any,
+    created_at: Optional[datetime],
+    file_size: Any,
+    score: float,
+) -> dict:
+    """One line of a search export; see :meth:`SearchBackend.iter_hits`."""
+    return {
+        "doc_id": int(doc_id),
+        "file_type": file_type or "",
+        "folder_id": int(folder_id) if folder_id else None,
+        "created_at": created_at.isoformat() if created_at else None,
+        "file_size": int(file_size or 0),
+        "score": float(score),
+    }
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    """Structured filters shared by every backend; hashable for cache keys."""
+
+    file_type: Optional[str] = None
+    folder_id: Optional[int] = None
+    tag_ids: Optional[Tuple[int, ...]] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    include_subfolders: bool = True  # folder_id matches its whole subtree
+
+    @classmethod
+    def build(
+        cls,
+        file_type: Optional[str] = None,
+        folder_id: Optional[int] = None,
+        tag_ids: Optional[List[int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        include_subfolders: bool = True,
+    ) -> "SearchFilters":
+        return cls(
+            file_type=file_type or None,
+            folder_id=folder_id or None,
+            tag_ids=tuple(sorted(set(tag_ids))) if tag_ids else None,
+            date_from=date_from,
+            date_to=date_to,
+            # Irrelevant without a folder; normalized so cache keys match
+            include_subfolders=include_subfolders or not folder_id,
+        )
+
+    @property
+    def active(self) -> bool:
+        """Whether any filter narrows the matches."""
+        return bool(
+            self.file_type or self.folder_id or self.tag_ids or self.date_from or self.date_to
+        )
+
+
+SORT_FIELDS = ("created_at", "file_size", "doc_id")
+
+_LN2 = log(2)
+_DAY = 86400.0
+
+
+@dataclass(frozen=True)
+class SearchSort:
+    """An order for hits other than plain relevance; hashable for cache keys.
+
+    ``field`` is one of :data:`SORT_FIELDS`, with ties going to the more
+    relevant hit and then the lower ``doc_id``, or ``"recency"``: relevance
+    halved for every ``half_life`` days of a document's age.
+
+    Recency is ranked by :meth:`recency_key`, the log of the decayed score
+    shifted by a constant. It does not depend on the current time, so keys
+    from different shards or cached pages stay comparable.
+    """
+
+    field: str
+    descending: bool = False
+    half_life: float = 30.0  # days, for "recency"
+
+    @classmethod
+    def parse(cls, value: Optional[str], half_life: float = 30.0) -> Optional["SearchSort"]:
+        """Read ``relevance`` (None), ``recency``, ``created_at`` or
+        ``-created_at`` (descending) and so on; raises ValueError."""
+        if not value or value == "relevance":
+            return None
+        if value == "recency":
+            if half_life <= 0:
+                raise ValueError("Recency ranking needs a positive half-life")
+            return cls("recency", True, half_life)
+        field = value[1:] if value.startswith("-") else value
+        if field not in SORT_FIELDS:
+            choices = ", ".join(("relevance", "recency") + SORT_FIELDS)
+            raise ValueError(f"Unknown sort {value!r}; use one of {choices}, '-' for descending")
+        return cls(field, value.startswith("-"))
+
+    @property
+    def recency(self) -> bool:
+        return self.field == "recency"
+
+    def recency_key(self, score: float, created: float) -> float:
+        """Rank of a hit with ``score`` created at ``created`` (Unix seconds)."""
+        if score <= 0:
+            return -inf
+        return log(score) + created * _LN2 / (self.half_life * _DAY)
+
+    def recency_score(self, key: float, now: float) -> float:
+        """The decayed score at ``now`` of a hit ranked ``key``."""
+        return exp(key - now * _LN2 / (self.half_life * _DAY))
+
+
+@dataclass(eq=False)
+class PinnedSnapshot:
+    """A view of the index kept open so later pages see the same documents.
+
+    ``handle`` is backend-specific (Whoosh searchers of one generation, a
+    NumPy snapshot, ...) and must be safe to search from several threads.
+    ``leases`` and ``evicted`` are kept by
+    :class:`~app.services.search_cursor.SnapshotPins`, which closes a
+    snapshot only once it is evicted and no page is using it.
+    """
+
+    generation: Any
+    handle: Any
+    close: Callable[[], None] = lambda: None
+    leases: int = 0
+    evicted: bool = False
+
+
+class SearchBackend(Protocol):
+    """What :class:`~app.services.search_service.SearchService` needs from an engine.
+
+    Queries are parsed once with :meth:`parse`; the ``repr()`` of the parsed
+    query identifies it in the result cache, so equivalent spellings of a
+    query should parse to equal objects. :meth:`generation` must change on
+    every commit so cached pages are dropped.
+
+    Result items are dicts with ``doc_id``, ``file_type``, ``folder_id``,
+    ``score`` and ``highlight``.
+
+    A ``transactional`` backend also provides async ``stage_document`` and
+    ``stage_removal`` methods that write through an ``AsyncSession``, and reads
+    document metadata from the database, so tag and folder changes need no
+    reindexing.
+    """
+
+    name: str
+    available: bool
+    missing: str  # install hint shown when the backend is not available
+    transactional: bool  # index rows are written in the caller's DB transaction
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Apply updates (fields) and deletions (None) in a single commit."""
+
+    def parse(self, query: str) -> Any:
+        ...
+
+    def search(
+        self,
+        parsed: Any,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        snapshot: Optional[PinnedSnapshot] = None,
+        after: Optional[tuple] = None,
+    ) -> SearchResult:
+        """Return one page of hits; ``query`` is the raw text, for snippets.
+
+        With ``facets`` the result also counts every match per value of
+        :data:`FACETS`, in the same pass over the matches. With ``sort`` the
+        page is the top of that order instead of the most relevant hits; each
+        item's ``score`` stays its relevance, decayed for recency.
+
+        ``snapshot`` comes from :meth:`pin`. With ``after`` (``()`` to start)
+        hits are ranked by a key that ends in ``doc_id``, so no two tie; only
+        hits ranked after that key are collected, and ``keys`` lists the
+        page's keys for the next call.
+        """
+
+    def count(self, parsed: Any, filters: SearchFilters) -> int:
+        ...
+
+    def iter_hits(self, parsed: Any, filters: SearchFilters) -> Iterator[dict]:
+        """Yield every match as an :func:`export_hit`, in index order.
+
+        Matches are read one at a time from a snapshot held until the
+        generator is closed, and no document text is loaded.
+        """
+
+    def pin(self) -> Optional[PinnedSnapshot]:
+        """Hold the current index open for :meth:`search`, or None if the
+        backend cannot; the caller closes it."""
+
+    def generation(self) -> int:
+        ...
+
+    def segment_stats(self) -> dict:
+        ...
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        ...
+
+    def term_dictionaries(self, known: set) -> List[TermDictionary]:
+        """``(key, terms)`` for every segment of the content term dictionary.
+
+        ``terms`` lists ``(term, document frequency)``; it may be ``None`` for
+        keys in ``known``, which the caller read before. Keys must change
+        whenever a segment's terms do.
+        """
+
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        """Named steps that open the index and prime it for the first query."""
+
+    def stats(self) -> dict:
+        ...
+
+    def close(self) -> None:
+        ...
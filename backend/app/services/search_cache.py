@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def _default_sizer(value: Any) -> int:
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bound to a single index generation.
+
+    Entries are dropped in bulk when :meth:`bind_generation` sees a new index
+    generation, so nothing computed against an older commit is ever served.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        sizer: Callable[[Any], int] = _default_sizer,
+    ):
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._sizer = sizer
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[Any, float, int]] = OrderedDict()
+        self._generation: Any = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bind_generation(self, generation: Any) -> None:
+        with self._lock:
+            if generation != self._generation:
+                if self._data:
+                    self.invalidations += 1
+                self._clear_locked()
+                self._generation = generation
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if not self.maxsize:
+            return
+        size = self._sizer(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "generation": self._generation,
+            }
+
+
+def docset_size(docs: set) -> int:
+    """Approximate memory held by a set of document numbers."""
+    return sys.getsizeof(docs) + 28 * len(docs)
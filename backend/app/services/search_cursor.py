@@ -0,0 +1,175 @@
+"""Cursors for deep pagination ("search after").
+
+A cursor names the last hit of a page by its rank key, the tuple a backend
+sorts by when paging with ``after`` (see ``SearchBackend.search``). The next
+page collects only hits ranked after that key, keeping ``limit`` of them, so
+page 50 costs about as much as page 1 instead of ranking 1,000 hits.
+
+Cursors also carry the generation of the index they were made on. The first
+page pins a snapshot of that generation (:class:`SnapshotPins`) and later
+pages search the same snapshot, so documents indexed in between neither
+shift pages nor show up twice. Pins expire once unused for ``ttl`` seconds;
+a cursor for an expired pin raises :class:`CursorExpiredError`. Backends that
+cannot pin page over the live index, which keyset paging keeps free of
+duplicates for documents that do not change.
+
+The cursor text is URL-safe base64 of JSON and opaque to clients.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from app.services.search_backend import PinnedSnapshot
+
+START = "*"  # cursor value that starts a new walk
+
+
+class CursorExpiredError(LookupError):
+    """The snapshot a cursor was made on is no longer pinned."""
+
+
+@dataclass(frozen=True)
+class Cursor:
+    generation: Any  # of the pinned snapshot, or None when nothing is pinned
+    fingerprint: str  # of the query, filters and sort
+    key: tuple  # rank key of the last hit returned
+
+
+def fingerprint(*parts: Any) -> str:
+    """Short digest identifying the search a cursor belongs to."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    payload = json.dumps(
+        [cursor.generation, cursor.fingerprint, list(cursor.key)], separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(text: str) -> Cursor:
+    """Parse a cursor made by :func:`encode_cursor`; raises ValueError."""
+    try:
+        payload = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+        generation, digest, key = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(digest, str) or not isinstance(key, list) or not all(
+        isinstance(value, (int, float)) and not isinstance(value, bool) for value in key
+    ):
+        raise ValueError("Invalid cursor")
+    return Cursor(generation, digest, tuple(key))
+
+
+class SnapshotPins:
+    """Pinned index snapshots by generation, closed after ``ttl`` idle seconds
+    or when more than ``max_pins`` are open."""
+
+    def __init__(self, max_pins: int = 8, ttl: float = 300.0):
+        self.max_pins = max(1, max_pins)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pins: "OrderedDict[Any, PinnedSnapshot]" = OrderedDict()
+        self._used: dict = {}
+        self.pinned = 0
+        self.expired = 0
+
+    def pin(self, open_snapshot: Callable[[], Optional[PinnedSnapshot]]) -> Optional[PinnedSnapshot]:
+        """Pin the current snapshot, sharing an existing pin of its generation.
+
+        The snapshot is leased to the caller until :meth:`release`.
+        """
+        snapshot = open_snapshot()
+        if snapshot is None:
+            return None
+        stale = []
+        with self._lock:
+            existing = self._pins.get(snapshot.generation)
+            if existing is not None:
+                stale.append(snapshot)
+                snapshot = existing
+            else:
+                self._pins[snapshot.generation] = snapshot
+                self.pinned += 1
+            snapshot.leases += 1
+            self._touch(snapshot.generation)
+            stale.extend(self._evict())
+        self._close(stale)
+        return snapshot
+
+    def acquire(self, generation: Any) -> PinnedSnapshot:
+        """Lease the snapshot pinned for ``generation``; raises CursorExpiredError."""
+        with self._lock:
+            stale = self._evict()
+            snapshot = self._pins.get(generation)
+            if snapshot is not None:
+                snapshot.leases += 1
+                self._touch(generation)
+        self._close(stale)
+        if snapshot is None:
+            raise CursorExpiredError("The search cursor has expired; start again")
+        return snapshot
+
+    def release(self, snapshot: Optional[PinnedSnapshot]) -> None:
+        """End a lease from :meth:`pin` or :meth:`acquire`."""
+        if snapshot is None:
+            return
+        with self._lock:
+            snapshot.leases -= 1
+            done = snapshot.evicted and not snapshot.leases
+        if done:
+            snapshot.close()
+
+    def _touch(self, generation: Any) -> None:
+        self._pins.move_to_end(generation)
+        self._used[generation] = time.monotonic()
+
+    def _evict(self) -> list:
+        """Unpin expired snapshots; returns those no page is using."""
+        now = time.monotonic()
+        stale = []
+        for generation in list(self._pins):
+            too_many = len(self._pins) > self.max_pins
+            if too_many or now - self._used[generation] > self.ttl:
+                snapshot = self._pins.pop(generation)
+                del self._used[generation]
+                self.expired += 1
+                snapshot.evicted = True
+                if not snapshot.leases:
+                    # Leased ones are closed by the last release
+                    stale.append(snapshot)
+        return stale
+
+    @staticmethod
+    def _close(snapshots: list) -> None:
+        for snapshot in snapshots:
+            snapshot.close()
+
+    def close(self) -> None:
+        with self._lock:
+            stale = []
+            for snapshot in self._pins.values():
+                snapshot.evicted = True
+                if not snapshot.leases:
+                    stale.append(snapshot)
+            self._pins.clear()
+            self._used.clear()
+        self._close(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pinned": len(self._pins),
+                "generations": [str(generation) for generation in self._pins],
+                "opened": self.pinned,
+                "expired": self.expired,
+            }
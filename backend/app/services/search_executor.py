@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SearchQueueFullError(RuntimeError):
+    """Raised when too many searches are already waiting for a worker."""
+
+
+class SearchExecutor:
+    """Bounded thread pool that keeps blocking search work off the event loop.
+
+    Whoosh queries, jieba tokenization and highlighting are CPU/IO bound and
+    synchronous, so they run on a dedicated pool instead of the default
+    ``asyncio.to_thread`` executor that uploads and parsing share.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int = 0):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.max_queue = max(0, max_queue)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._peak_queued = 0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="search"
+                )
+            return self._pool
+
+    async def run(self, func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        pool = self._get_pool()
+        with self._lock:
+            if self.max_queue and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise SearchQueueFullError("Search queue is full, try again later")
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+        future = pool.submit(self._invoke, func, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _invoke(self, func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _on_done(self, future: Future) -> None:
+        with self._lock:
+            if future.cancelled():
+                # Cancelled before a worker picked it up
+                self._queued -= 1
+            elif future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self._queued,
+                "running": self._running,
+                "peak_queued": self._peak_queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
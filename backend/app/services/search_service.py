@@ -1,15 +1,38 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
+from collections import Counter
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
 try:
     import jieba
     from whoosh import index
     from whoosh.analysis import Token, Tokenizer
-    from whoosh.fields import DATETIME, ID, KEYWORD, TEXT, Schema
+    from whoosh.collectors import (
+        FacetCollector,
+        FilterCollector,
+        SortingCollector,
+        TopCollector,
+    )
+    from whoosh.fields import DATETIME, ID, KEYWORD, NUMERIC, TEXT, Schema
     from whoosh.qparser import MultifieldParser, QueryParser
-    from whoosh.query import And, Term, DateRange
+    from whoosh.query import DateRange, Term
     from whoosh.scoring import BM25F
+    from whoosh.searching import Searcher
+    from whoosh.sorting import (
+        Categorizer,
+        Count,
+        FacetType,
+        FieldFacet,
+        MultiFacet,
+        ScoreFacet,
+    )
 except ImportError:  # pragma: no cover
     jieba = None
     index = None
@@ -18,17 +41,52 @@ except ImportError:  # pragma: no cover
     DATETIME = None
     ID = None
     KEYWORD = None
+    NUMERIC = None
     TEXT = None
     Schema = None
     MultifieldParser = None
     QueryParser = None
     BM25F = None
+    Searcher = None
 
 from app.core.config import settings
+from app.services.embeddings import LSA_DIR, EmbeddingIndex
+from app.services.highlighter import OffsetHighlighter
+from app.services.index_maintenance import IndexMaintenance
+from app.services.index_journal import index_write_lock, journal_writes
+from app.services.index_queue import IndexBatch, IndexWriteQueue
+from app.services.index_server import IndexClient
+from app.services.search_backend import (
+    SearchBackend,
+    SearchFilters,
+    PinnedSnapshot,
+    SearchResult,
+    SearchSort,
+    export_hit,
+    format_facets,
+)
+from app.services.search_cache import LRUCache, docset_size
+from app.services.search_cursor import (
+    START,
+    Cursor,
+    SnapshotPins,
+    decode_cursor,
+    encode_cursor,
+    fingerprint,
+)
+from app.services.search_executor import SearchExecutor
+from app.services.searcher_pool import SearcherPool, SnapshotSearchers
+from app.services.spelling import SpellCorrector, correct_query
+from app.services.suggest import TermDictionary, TermSuggester
+from app.services.text_store import TextStore
 
 
+logger = logging.getLogger(__name__)
+
 _SEARCH_BACKEND_AVAILABLE = jieba is not None and index is not None
 
+_EPOCH = datetime(1970, 1, 1)  # created_at is naive UTC
+
 if _SEARCH_BACKEND_AVAILABLE:
 
     class JiebaTokenizer(Tokenizer):
@@ -46,60 +104,723 @@ if _SEARCH_BACKEND_AVAILABLE:
             mode="",
             **kwargs,
         ):
-            words = jieba.cut_for_search(value)
+            # jieba.tokenize reports true character offsets, including for the
+            # overlapping sub-words produced in search mode
             pos = start_pos
-            char_pos = start_char
-            for word in words:
-                word = word.strip()
-                if not word:
+            for word, start, end in jieba.tokenize(value, mode="search"):
+                if not word.strip():
                     continue
                 token = Token(positions, chars, removestops=removestops, mode=mode)
                 token.text = word
                 token.pos = pos
-                token.startchar = char_pos
-                token.endchar = char_pos + len(word)
+                token.startchar = start_char + start
+                token.endchar = start_char + end
                 pos += 1
-                char_pos += len(word)
                 yield token
 
     def get_jieba_analyzer():
         return JiebaTokenizer()
 
-    # Schema for document index
-    SCHEMA = Schema(
-        doc_id=ID(stored=True, unique=True),
-        content=TEXT(analyzer=get_jieba_analyzer(), stored=True),
-        file_type=KEYWORD(stored=True),
-        folder_id=ID(stored=True),
-        tag_ids=KEYWORD(stored=True, commas=True),
-        created_at=DATETIME(stored=True),
-    )
+    def build_schema(store_content: bool = False):
+        """Schema for the document index.
+
+        Content is only kept in the index when ``store_content`` is set;
+        otherwise snippets are read from the :class:`TextStore`.
+        """
+        return Schema(
+            doc_id=ID(stored=True, unique=True),
+            content=TEXT(analyzer=get_jieba_analyzer(), stored=store_content, chars=True),
+            # Columns for facet counts
+            file_type=KEYWORD(stored=True, sortable=True),
+            folder_id=ID(stored=True, sortable=True),
+            # The folder and all of its ancestors, so a subtree is one term
+            folder_path=KEYWORD(stored=True, commas=True),
+            tag_ids=KEYWORD(stored=True, commas=True),
+            created_at=DATETIME(stored=True, sortable=True),
+            # Columns for sorted results
+            file_size=NUMERIC(int, bits=64, stored=True, sortable=True),
+            doc_num=NUMERIC(int, bits=64, sortable=True),  # doc_id as a number
+        )
+
+    class TopSortingCollector(SortingCollector):
+        """``SortingCollector`` that keeps the best ``limit`` sort keys rather
+        than every match, trimming whenever twice that many are buffered.
+
+        With ``after`` only matches whose key sorts after it are kept, though
+        every match still counts towards the total.
+        """
+
+        def __init__(self, sortedby, limit=10, after: Optional[tuple] = None):
+            SortingCollector.__init__(self, sortedby, limit=limit)
+            self.after = after
+
+        def collect(self, sub_docnum):
+            global_docnum = self.offset + sub_docnum
+            sortkey = self.sort_key(sub_docnum)
+            self.docset.add(global_docnum)
+            if self.after is None or sortkey > self.after:
+                self.items.append((sortkey, global_docnum))
+                if self.limit and len(self.items) >= 2 * self.limit:
+                    self.items = heapq.nsmallest(self.limit, self.items)
+            return sortkey
+
+    class RecencyFacet(FacetType):
+        """Sorts by :meth:`SearchSort.recency_key`, best first, reading each
+        match's score and ``created_at`` column in the collector."""
+
+        def __init__(self, sort: SearchSort):
+            self.sort = sort
+
+        def categorizer(self, global_searcher):
+            return _RecencyCategorizer(self.sort)
+
+    class _RecencyCategorizer(Categorizer):
+        needs_current = True
+
+        def __init__(self, sort: SearchSort):
+            self.sort = sort
+            self._created = None
+
+        def set_searcher(self, segment_searcher, docoffset):
+            reader = segment_searcher.reader()
+            # Empty readers have no columns, and no documents to look up
+            self._created = (
+                reader.column_reader("created_at") if reader.has_column("created_at") else None
+            )
+
+        def key_for(self, matcher, docid):
+            created = self._created[docid] if self._created is not None else None
+            seconds = (created - _EPOCH).total_seconds() if created else 0.0
+            return -self.sort.recency_key(matcher.score(), seconds)
+
+    SCHEMA = build_schema(settings.SEARCH_STORE_CONTENT)
 else:
     SCHEMA = None
 
 
-class SearchService:
-    def __init__(self, index_dir: Optional[str] = None):
-        self.index_dir = Path(index_dir or settings.INDEX_DIR)
+def _result_size(result: SearchResult) -> int:
+    """Approximate memory held by a cached search page."""
+    return 200 + sum(200 + len(item.get("highlight") or "") for item in result.items)
+
+
+def highlight_snippet(content: str, query: str, context_chars: int = 100) -> str:
+    """Snippet around the first query term found by scanning the text."""
+    if not content or not query:
+        return content[:200] if content else ""
+
+    if jieba is None:
+        return content[:200] + ("..." if len(content) > 200 else "")
+
+    # Simple highlight: find query terms and extract context
+    terms = list(jieba.cut_for_search(query))
+    content_lower = content.lower()
+
+    for term in terms:
+        term_lower = term.lower()
+        idx = content_lower.find(term_lower)
+        if idx != -1:
+            start = max(0, idx - context_chars)
+            end = min(len(content), idx + len(term) + context_chars)
+            snippet = content[start:end]
+            # Highlight the term
+            highlighted = snippet.replace(term, f"<mark>{term}</mark>")
+            prefix = "..." if start > 0 else ""
+            suffix = "..." if end < len(content) else ""
+            return f"{prefix}{highlighted}{suffix}"
+
+    return content[:200] + ("..." if len(content) > 200 else "")
+
+
+class WhooshBackend:
+    """Search backend on a Whoosh index directory.
+
+    A ``read_only`` backend (a worker with ``INDEX_WRITER=remote``) never
+    creates the index; until the indexer process has, every operation raises.
+    """
+
+    name = "whoosh"
+    transactional = False
+
+    def __init__(self, index_dir: Path, read_only: bool = False):
+        self.index_dir = Path(index_dir)
         self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.read_only = read_only
         self._ix = None
+        self._ix_lock = threading.Lock()
+        self._searchers: Optional[SearcherPool] = None
+        self._text_store: Optional[TextStore] = None
+        self._writer_lock = threading.Lock()
+        self._highlighter = OffsetHighlighter(
+            context_chars=settings.SEARCH_HIGHLIGHT_CONTEXT,
+            max_fragments=settings.SEARCH_HIGHLIGHT_FRAGMENTS,
+        )
+        self._filter_cache = LRUCache(settings.SEARCH_FILTER_CACHE_SIZE, sizer=docset_size)
+
+    missing = "Install 'whoosh' and 'jieba' to enable search."
+
+    @property
+    def available(self) -> bool:
+        return _SEARCH_BACKEND_AVAILABLE and SCHEMA is not None
 
     def _require_backend(self) -> None:
-        if not _SEARCH_BACKEND_AVAILABLE or SCHEMA is None:
-            raise RuntimeError(
-                "Search backend is not available. Install 'whoosh' and 'jieba' to enable search."
-            )
+        if not self.available:
+            raise RuntimeError(f"Search backend is not available. {self.missing}")
 
     @property
     def ix(self):
         self._require_backend()
         if self._ix is None:
-            if index.exists_in(str(self.index_dir)):
-                self._ix = index.open_dir(str(self.index_dir))
-            else:
-                self._ix = index.create_in(str(self.index_dir), SCHEMA)
+            with self._ix_lock:
+                if self._ix is None:
+                    if index.exists_in(str(self.index_dir)):
+                        self._ix = index.open_dir(str(self.index_dir))
+                    elif self.read_only:
+                        # Checked again on the next call, once the indexer has started
+                        raise RuntimeError(
+                            f"Search index {self.index_dir} does not exist yet; "
+                            "start the indexer (python -m app.services.index_server)"
+                        )
+                    else:
+                        self._ix = index.create_in(str(self.index_dir), SCHEMA)
         return self._ix
 
+    @property
+    def stores_content(self) -> bool:
+        """Whether this index keeps document text in its own stored fields."""
+        return bool(self.ix.schema["content"].stored)
+
+    @property
+    def text_store(self) -> TextStore:
+        if self._text_store is None:
+            with self._ix_lock:
+                if self._text_store is None:
+                    self._text_store = TextStore(self.index_dir / TextStore.FILENAME)
+        return self._text_store
+
+    @property
+    def searchers(self) -> SearcherPool:
+        ix = self.ix
+        if self._searchers is None:
+            with self._ix_lock:
+                if self._searchers is None:
+                    self._searchers = SearcherPool(
+                        ix, BM25F, max_idle=settings.SEARCH_SEARCHER_POOL_SIZE
+                    )
+        return self._searchers
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Apply updates (fields) and deletions (None) in a single commit."""
+        self._require_backend()
+        # The file lock orders commits with the end of an offline rebuild,
+        # which replays the journaled ids before swapping its index in
+        with self._writer_lock, index_write_lock(self.index_dir):
+            if not self.stores_content:
+                # Text goes in before the commit so new hits always have snippets
+                self.text_store.refresh()
+                self.text_store.put_many(
+                    (doc_id, fields["content"])
+                    for doc_id, fields in batch.items()
+                    if fields is not None
+                )
+            writer = self.ix.writer()
+            # Indexes created before a field was added do not accept it
+            known = set(writer.schema.names())
+            try:
+                for doc_id, fields in batch.items():
+                    if fields is None:
+                        writer.delete_by_term("doc_id", str(doc_id))
+                    else:
+                        writer.update_document(
+                            **{name: value for name, value in fields.items() if name in known}
+                        )
+            except Exception:
+                writer.cancel()
+                raise
+            writer.commit()
+            if not self.stores_content:
+                self.text_store.delete_many(
+                    doc_id for doc_id, fields in batch.items() if fields is None
+                )
+            journal_writes(self.index_dir, batch.keys())
+
+    def generation(self) -> int:
+        return self.ix.latest_generation()
+
+    def segment_stats(self) -> dict:
+        self._require_backend()
+        segments = self.ix._segments()
+        docs = sum(seg.doc_count_all() for seg in segments)
+        deleted = sum(seg.deleted_count() for seg in segments)
+        return {
+            "generation": self.ix.latest_generation(),
+            "segments": len(segments),
+            "docs": docs,
+            "deleted": deleted,
+            "deleted_ratio": round(deleted / docs, 4) if docs else 0.0,
+        }
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        """Merge small segments, or rewrite everything into one when ``optimize``."""
+        self._require_backend()
+        with self._writer_lock:
+            writer = self.ix.writer()
+            writer.commit(optimize=optimize)
+
+    def term_dictionaries(self, known: set) -> List[TermDictionary]:
+        """``content`` terms and document frequencies of each segment."""
+        with self.searchers.searcher() as searcher:
+            dictionaries = []
+            for leaf, _base in searcher.reader().leaf_readers():
+                if leaf.segment() is None:
+                    continue  # empty index
+                key = leaf.segment().segment_id()
+                terms = None
+                if key not in known:
+                    terms = [
+                        (text.decode("utf-8"), info.doc_frequency())
+                        for text, info in leaf.iter_field("content")
+                    ]
+                dictionaries.append((key, terms))
+            return dictionaries
+
+    def parse(self, query: str):
+        self._require_backend()
+        parser = MultifieldParser(["content"], self.ix.schema)
+        return parser.parse(query).normalize()
+
+    def search(
+        self,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        snapshot: Optional[PinnedSnapshot] = None,
+        after: Optional[tuple] = None,
+    ) -> SearchResult:
+        """Score only the top ``skip + limit`` documents.
+
+        When ``exact_total`` is false the total is Whoosh's estimate unless the
+        collector already counted every match. Filtered searches are always
+        counted, since the estimate ignores the filter.
+        """
+        with self._searcher(snapshot) as searcher:
+            results = self.top_docs(
+                searcher, parsed, filters, skip + limit, facets, sort, after
+            )
+            if results is None:
+                return SearchResult(
+                    items=[], total=0, facets=format_facets({}) if facets else None
+                )
+            if exact_total or filters.active or results.has_exact_length():
+                total = len(results)
+                total_exact = True
+            else:
+                total = max(results.estimated_length(), results.scored_length())
+                total_exact = False
+            page = results[skip : skip + limit]
+
+            terms = self.content_terms(parsed)
+            now = time.time()
+            if page and not self.stores_content:
+                self.text_store.refresh()
+            items = [
+                self.hit_to_item(hit, query, terms, self.hit_score(hit, sort, now))
+                for hit in page
+            ]
+            return SearchResult(
+                items=items,
+                total=total,
+                total_exact=total_exact,
+                facets=format_facets(self.facet_counts(results)) if facets else None,
+                keys=[hit.score for hit in page] if after is not None else None,
+            )
+
+    @contextmanager
+    def _searcher(self, snapshot: Optional[PinnedSnapshot]):
+        pool = self.searchers if snapshot is None else snapshot.handle
+        with pool.searcher() as searcher:
+            yield searcher
+
+    def pin(self) -> PinnedSnapshot:
+        searchers = self.pin_searchers()
+        with searchers.searcher() as searcher:
+            generation = self.reader_generation(searcher)
+        return PinnedSnapshot(generation, searchers, searchers.close)
+
+    def pin_searchers(self, weighting: Optional[Callable[[], Any]] = None) -> SnapshotSearchers:
+        """Searchers of the current generation, opened again from its
+        segments for concurrent pages; see :class:`SnapshotSearchers`."""
+        weighting = weighting or BM25F
+        ix = self.ix
+        searcher = ix.searcher(weighting=weighting())
+        reader = searcher.reader()
+        segments = [leaf.segment() for leaf, _offset in reader.leaf_readers()
+                    if hasattr(leaf, "segment")]
+        generation = reader.generation()
+
+        def open_more():
+            # Whoosh readers hold file positions, so each page needs its own
+            return Searcher(
+                ix._reader(ix.storage, ix.schema, segments, generation),
+                weighting=weighting(),
+            )
+
+        return SnapshotSearchers(searcher, open_more, settings.SEARCH_SEARCHER_POOL_SIZE)
+
+    @staticmethod
+    def reader_generation(searcher) -> int:
+        # An empty index has no segments, and a reader without a generation
+        generation = searcher.reader().generation()
+        return -1 if generation is None else generation
+
+    def top_docs(
+        self,
+        searcher,
+        parsed,
+        filters: SearchFilters,
+        limit: int,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        after: Optional[tuple] = None,
+    ):
+        """Run ``parsed`` on ``searcher`` and return Whoosh ``Results`` for the
+        best ``limit`` hits, or None when the filters exclude everything.
+
+        With ``facets`` every match is also grouped by the facet fields, read
+        from their columns; see :meth:`facet_counts`. With ``sort`` the hits
+        are ranked by sort keys read from the columns as matches are collected
+        (see :meth:`sort_facet`), and each hit's ``score`` is its sort key.
+        ``after`` also ranks by sort key, relevance included, and keeps only
+        the hits whose key sorts after it; every match still counts in the total.
+        """
+        filter_q = self._filter_for(searcher, filters)
+        if filter_q is not None and not filter_q:
+            return None
+        if not facets and sort is None and after is None:
+            return searcher.search(parsed, filter=filter_q, limit=max(1, limit))
+        if sort is not None or after is not None:
+            collector = TopSortingCollector(
+                self.sort_facet(searcher.schema, sort, keyed=after is not None),
+                max(1, limit),
+                after=after,
+            )
+        else:
+            # Whoosh's own groupedby sorts every match; keep the top-N heap and
+            # only turn off block skipping and matcher replacement, which drop
+            # matches that cannot reach the top N but still count in facets
+            collector = TopCollector(max(1, limit), usequality=False, replace=0)
+        if facets:
+            collector = FacetCollector(collector, self._facet_types())
+        if filter_q is not None:
+            collector = FilterCollector(collector, allow=filter_q)
+        searcher.search_with_collector(parsed, collector)
+        return collector.results()
+
+    @staticmethod
+    def sort_facet(schema, sort: Optional[SearchSort], keyed: bool = False):
+        """Sort keys for ``sort``: the field, then relevance, then ``doc_id``;
+        or the recency rank, then ``doc_id``. ``keyed`` also ranks relevance
+        by key, and needs the ``doc_id`` tie-break."""
+        needed = ["doc_num"] if keyed else []
+        if sort is not None:
+            column = "doc_num" if sort.field == "doc_id" else sort.field
+            needed.append("created_at" if sort.recency else column)
+        for name in needed:
+            if name not in schema or getattr(schema[name], "column_type", None) is None:
+                raise ValueError(
+                    "This index lacks the columns to sort or page this search; rebuild "
+                    "it with python -m app.services.index_rebuild"
+                )
+        tiebreak = [FieldFacet("doc_num")] if "doc_num" in schema else []
+        if sort is None:
+            return MultiFacet([ScoreFacet()] + tiebreak)
+        if sort.recency:
+            return MultiFacet([RecencyFacet(sort)] + tiebreak)
+        return MultiFacet([FieldFacet(column, reverse=sort.descending), ScoreFacet()] + tiebreak)
+
+    @staticmethod
+    def hit_score(hit, sort: Optional[SearchSort], now: float) -> float:
+        """Relevance of ``hit``; keyed hits carry it inside their sort key."""
+        if sort is None:
+            return -hit.score[0] if isinstance(hit.score, tuple) else hit.score
+        if sort.recency:
+            return sort.recency_score(-hit.score[0], now)
+        return -hit.score[1]
+
+    @staticmethod
+    def _facet_types() -> dict:
+        return {
+            "file_type": FieldFacet("file_type", maptype=Count),
+            "folder_id": FieldFacet("folder_id", maptype=Count),
+            "tag_ids": FieldFacet("tag_ids", allow_overlap=True, maptype=Count),
+            "created_at": FieldFacet("created_at", maptype=Count),
+        }
+
+    @staticmethod
+    def facet_counts(results) -> Dict[str, Counter]:
+        """Raw facet counts of ``Results`` from :meth:`top_docs`."""
+        years: Counter = Counter()
+        for created_at, n in results.groups("created_at").items():
+            if created_at is not None:
+                years[created_at.year] += n
+        return {
+            "file_type": Counter(results.groups("file_type")),
+            "folder_id": Counter(results.groups("folder_id")),
+            "tag_ids": Counter(results.groups("tag_ids")),
+            "year": years,
+        }
+
+    @staticmethod
+    def content_terms(parsed) -> set:
+        return {text for fieldname, text in parsed.iter_all_terms() if fieldname == "content"}
+
+    def count(self, parsed, filters: SearchFilters) -> int:
+        with self.searchers.searcher() as searcher:
+            results = self.top_docs(searcher, parsed, filters, 1)
+            return len(results) if results is not None else 0
+
+    def iter_hits(self, parsed, filters: SearchFilters) -> Iterator[dict]:
+        searcher = self.ix.searcher(weighting=BM25F())
+        try:
+            yield from self.searcher_hits(searcher, parsed, filters)
+        finally:
+            searcher.close()
+
+    def searcher_hits(self, searcher, parsed, filters: SearchFilters) -> Iterator[dict]:
+        """Walk the matchers of each segment, reading metadata from columns."""
+        filter_q = self._filter_for(searcher, filters)
+        if filter_q is not None and not filter_q:
+            return
+        context = searcher.context()
+        for subsearcher, offset in searcher.leaf_searchers():
+            reader = subsearcher.reader()
+            columns = {
+                name: reader.column_reader(name)
+                for name in ("doc_num", "file_type", "folder_id", "created_at", "file_size")
+                if reader.has_column(name)
+            }
+            matcher = parsed.matcher(subsearcher, context)
+            while matcher.is_active():
+                docnum = matcher.id()
+                if filter_q is None or offset + docnum in filter_q:
+                    if "doc_num" in columns:
+                        doc_id = columns["doc_num"][docnum]
+                    else:
+                        # Indexes built before the doc_num column
+                        doc_id = reader.stored_fields(docnum)["doc_id"]
+                    yield export_hit(
+                        doc_id,
+                        *(
+                            columns[name][docnum] if name in columns else None
+                            for name in ("file_type", "folder_id", "created_at", "file_size")
+                        ),
+                        matcher.score(),
+                    )
+                matcher.next()
+
+    def _filter_for(self, searcher, filters: SearchFilters):
+        # Indexes built before folder paths existed can only match the folder
+        folder_field = "folder_id"
+        if filters.include_subfolders and "folder_path" in searcher.schema:
+            folder_field = "folder_path"
+        # Always a doc set: Whoosh reads an empty allow-set, or a query matching
+        # nothing, as no filter at all
+        return self._filter_docs(searcher, filters, folder_field)
+
+    def _filter_docs(
+        self, searcher, filters: SearchFilters, folder_field: str = "folder_id"
+    ) -> Optional[set]:
+        """Return the doc numbers allowed by the filters, or None if unfiltered.
+
+        Per-value doc sets for ``file_type``, the folder and ``tag_ids`` and
+        their combinations are cached per index generation, and older ones age
+        out of the LRU. Date
+        ranges vary per request and are intersected uncached.
+        """
+        facets = []
+        if filters.file_type:
+            facets.append(("file_type", (filters.file_type,)))
+        if filters.folder_id:
+            facets.append((folder_field, (str(filters.folder_id),)))
+        if filters.tag_ids:
+            facets.append(("tag_ids", tuple(sorted({str(t) for t in filters.tag_ids}))))
+
+        docs: Optional[set] = None
+        if facets:
+            # Keyed by generation rather than bound to one: cursor pages read
+            # older pinned generations alongside current searches
+            generation = searcher.reader().generation()
+            combo_key = (generation, tuple(facets))
+            docs = self._filter_cache.get(combo_key)
+            if docs is None:
+                for fieldname, values in facets:
+                    facet_docs = set()
+                    for value in values:
+                        facet_docs |= self._facet_docs(searcher, generation, fieldname, value)
+                    docs = facet_docs if docs is None else docs & facet_docs
+                self._filter_cache.put(combo_key, docs)
+
+        if filters.date_from or filters.date_to:
+            date_docs = set(
+                searcher.docs_for_query(
+                    DateRange("created_at", filters.date_from, filters.date_to)
+                )
+            )
+            docs = date_docs if docs is None else docs & date_docs
+
+        return docs
+
+    def _facet_docs(self, searcher, generation, fieldname: str, value: str) -> set:
+        key = (generation, ((fieldname, (value,)),))
+        docs = self._filter_cache.get(key)
+        if docs is None:
+            docs = set(searcher.docs_for_query(Term(fieldname, value)))
+            self._filter_cache.put(key, docs)
+        return docs
+
+    def hit_to_item(self, hit, query: str, terms: set, score: Optional[float] = None) -> dict:
+        content_field = hit.searcher.schema["content"]
+        if content_field.stored:
+            content = hit.get("content", "")
+        else:
+            content = self.text_store.get(int(hit["doc_id"])) or ""
+        highlighted = None
+        if terms and content_field.supports("characters"):
+            highlighted = self._highlighter.highlight(
+                hit.searcher.reader(), hit.docnum, content, terms
+            )
+        if highlighted is None:
+            # No stored offsets matched (or an index built without them)
+            if not isinstance(content, str):
+                content = content[: 10 * self._highlighter.context_chars]
+            highlighted = highlight_snippet(content, query)
+        return {
+            "doc_id": int(hit["doc_id"]),
+            "file_type": hit.get("file_type", ""),
+            "folder_id": int(hit["folder_id"]) if hit.get("folder_id") else None,
+            "score": hit.score if score is None else score,
+            "highlight": highlighted,
+        }
+
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        def prime_searcher() -> None:
+            with self.searchers.searcher() as searcher:
+                searcher.doc_count()
+
+        return [("index_open", lambda: self.ix), ("searcher", prime_searcher)]
+
+    def stats(self) -> dict:
+        return {
+            "filter_cache": self._filter_cache.stats(),
+            "searchers": self._searchers.stats() if self._searchers else None,
+            "text_store": self._text_store.stats() if self._text_store else None,
+        }
+
+    def close(self) -> None:
+        if self._searchers is not None:
+            self._searchers.close()
+            self._searchers = None
+        if self._text_store is not None:
+            self._text_store.close()
+            self._text_store = None
+
+
+def create_backend(
+    name: str, index_dir: Path, shards: int = 1, read_only: bool = False
+) -> SearchBackend:
+    """Instantiate the search backend selected by ``SEARCH_BACKEND``; a
+    ``read_only`` Whoosh backend leaves creating the index to the indexer."""
+    if shards > 1 and name != "whoosh":
+        raise ValueError(f"SEARCH_SHARDS > 1 needs the whoosh backend, not {name!r}")
+    if name == "whoosh":
+        if shards > 1:
+            from app.services.sharded_backend import ShardedBackend, shard_dir
+
+            return ShardedBackend(
+                [
+                    WhooshBackend(shard_dir(index_dir, shard), read_only)
+                    for shard in range(shards)
+                ]
+            )
+        return WhooshBackend(index_dir, read_only)
+    if name == "numpy":
+        from app.services.numpy_backend import NumpyBackend
+
+        return NumpyBackend(Path(index_dir) / NumpyBackend.SUBDIR)
+    if name == "sqlite":
+        from app.services.fts_backend import FtsBackend
+
+        return FtsBackend(settings.DATABASE_URL)
+    raise ValueError(
+        f"Unknown search backend {name!r}; expected 'whoosh', 'numpy' or 'sqlite'"
+    )
+
+
+class SearchService:
+    def __init__(
+        self,
+        index_dir: Optional[str] = None,
+        backend: Optional[str] = None,
+        shards: Optional[int] = None,
+        writer: Optional[str] = None,
+    ):
+        self.index_dir = Path(index_dir or settings.INDEX_DIR)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        writer = writer or settings.INDEX_WRITER
+        if writer not in ("local", "remote"):
+            raise ValueError(f"Unknown index writer {writer!r}; expected 'local' or 'remote'")
+        self.backend = create_backend(
+            backend or settings.SEARCH_BACKEND,
+            self.index_dir,
+            shards if shards is not None else settings.SEARCH_SHARDS,
+            read_only=writer == "remote",
+        )
+        self._lock = threading.Lock()
+        self._executor: Optional[SearchExecutor] = None
+        self._write_queue: Optional[IndexWriteQueue] = None
+        self._maintenance: Optional[IndexMaintenance] = None
+        self._warmup: Optional[dict] = None
+        # In remote mode another process owns every write; this one only reads
+        self._client: Optional[IndexClient] = (
+            IndexClient(settings.INDEX_SOCKET, settings.INDEX_CLIENT_TIMEOUT)
+            if writer == "remote"
+            else None
+        )
+        self._result_cache = LRUCache(
+            settings.SEARCH_RESULT_CACHE_SIZE,
+            ttl=settings.SEARCH_RESULT_CACHE_TTL,
+            sizer=_result_size,
+        )
+        self._suggester = TermSuggester(
+            settings.SEARCH_SUGGEST_CACHE_SIZE,
+            corrector=SpellCorrector(
+                settings.SEARCH_SPELL_MAX_DISTANCE, settings.SEARCH_SPELL_PREFIX_LENGTH
+            ),
+        )
+        self._suggest_lock = threading.Lock()
+        self._pins = SnapshotPins(settings.SEARCH_CURSOR_MAX_PINS, settings.SEARCH_CURSOR_TTL)
+        # Built offline by python -m app.services.embeddings; see hybrid in execute
+        self.embeddings = EmbeddingIndex(self.index_dir / LSA_DIR)
+
+    def _require_backend(self) -> None:
+        if not self.backend.available:
+            raise RuntimeError(f"Search backend is not available. {self.backend.missing}")
+
+    @property
+    def executor(self) -> SearchExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = SearchExecutor(
+                        max_workers=settings.SEARCH_MAX_CONCURRENCY,
+                        max_queue=settings.SEARCH_MAX_QUEUE,
+                    )
+        return self._executor
+
     def index_document(
         self,
         doc_id: int,
@@ -108,26 +829,184 @@ class SearchService:
         folder_id: Optional[int],
         tag_ids: List[int],
         created_at: datetime,
+        folder_path: Optional[List[int]] = None,
+        file_size: int = 0,
     ) -> None:
-        if not _SEARCH_BACKEND_AVAILABLE:
+        if not self.backend.available:
             return
-        writer = self.ix.writer()
-        writer.update_document(
+        fields = self.document_fields(
+            doc_id, content, file_type, folder_id, tag_ids, created_at, folder_path, file_size
+        )
+        self.submit(doc_id, fields)
+
+    @staticmethod
+    def document_fields(
+        doc_id: int,
+        content: str,
+        file_type: str,
+        folder_id: Optional[int],
+        tag_ids: List[int],
+        created_at: datetime,
+        folder_path: Optional[List[int]] = None,
+        file_size: int = 0,
+    ) -> dict:
+        """Map a document onto the index schema's fields.
+
+        ``folder_path`` lists the ids from the top-level folder down to
+        ``folder_id`` (see :meth:`FolderService.ancestor_paths`); without it
+        only the folder itself is indexed.
+        """
+        if folder_path is None:
+            folder_path = [folder_id] if folder_id else []
+        return dict(
             doc_id=str(doc_id),
             content=content or "",
             file_type=file_type,
             folder_id=str(folder_id) if folder_id else "",
+            folder_path=",".join(str(f) for f in folder_path),
             tag_ids=",".join(str(t) for t in tag_ids) if tag_ids else "",
             created_at=created_at,
+            file_size=int(file_size or 0),
+            doc_num=int(doc_id),
         )
-        writer.commit()
+
+    @property
+    def transactional(self) -> bool:
+        """True when services write the index inside their own DB transaction."""
+        return self.backend.available and self.backend.transactional
+
+    async def stage_document(self, session, doc_id: int, content: str) -> None:
+        """Index a document in ``session``'s transaction (transactional backends)."""
+        await self.backend.stage_document(session, doc_id, content)
+        await asyncio.to_thread(self._fold_in, {doc_id: {"content": content}})
+
+    async def stage_removal(self, session, doc_id: int) -> None:
+        await self.backend.stage_removal(session, doc_id)
 
     def remove_document(self, doc_id: int) -> None:
-        if not _SEARCH_BACKEND_AVAILABLE:
+        if not self.backend.available:
+            return
+        self.submit(doc_id, None)
+
+    def submit(self, doc_id: int, fields: Optional[dict]) -> None:
+        """Send the change to the indexer process in remote mode, queue it when
+        the write-behind writer runs, else commit it now; ``None`` deletes."""
+        if self._client is not None:
+            self._client.put(doc_id, fields)
+        elif self._write_queue is not None and self._write_queue.running:
+            self._write_queue.put(doc_id, fields)
+        else:
+            self.apply_batch({doc_id: fields})
+
+    def submit_many(self, batch: IndexBatch) -> None:
+        """Like :meth:`submit` for many documents: one request to the indexer
+        process, or one commit when applied directly."""
+        if not batch:
+            return
+        if self._client is not None:
+            self._client.put_many(batch)
+        elif self._write_queue is not None and self._write_queue.running:
+            for doc_id, fields in batch.items():
+                self._write_queue.put(doc_id, fields)
+        else:
+            self.apply_batch(batch)
+
+    async def asubmit_many(self, batch: IndexBatch) -> None:
+        """:meth:`submit_many` for request handlers: round trips to the indexer
+        and direct commits run in a worker thread, not on the event loop."""
+        if self._client is None and self._write_queue is not None and self._write_queue.running:
+            self.submit_many(batch)
+        else:
+            await asyncio.to_thread(self.submit_many, batch)
+
+    async def aindex_document(
+        self,
+        doc_id: int,
+        content: str,
+        file_type: str,
+        folder_id: Optional[int],
+        tag_ids: List[int],
+        created_at: datetime,
+        folder_path: Optional[List[int]] = None,
+        file_size: int = 0,
+    ) -> None:
+        if not self.backend.available:
+            return
+        fields = self.document_fields(
+            doc_id, content, file_type, folder_id, tag_ids, created_at, folder_path, file_size
+        )
+        await self.asubmit_many({doc_id: fields})
+
+    async def aremove_document(self, doc_id: int) -> None:
+        if not self.backend.available:
             return
-        writer = self.ix.writer()
-        writer.delete_by_term("doc_id", str(doc_id))
-        writer.commit()
+        await self.asubmit_many({doc_id: None})
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Apply updates (fields) and deletions (None) in a single commit."""
+        self._require_backend()
+        self.backend.apply_batch(batch)
+        self._fold_in(batch)
+        self._refresh_suggester()
+
+    def _fold_in(self, batch: IndexBatch) -> None:
+        """Give new documents embeddings, once the embedding job has run."""
+        try:
+            self.embeddings.fold_in(batch)
+        except Exception:
+            # The document is still found by BM25; the next build embeds it
+            logger.exception("Failed to fold documents into the embeddings")
+
+    def segment_stats(self) -> dict:
+        self._require_backend()
+        return self.backend.segment_stats()
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        self._require_backend()
+        self.backend.merge_segments(optimize)
+        self._refresh_suggester()
+
+    async def start_write_behind(self) -> None:
+        """Start the single writer task that batches index commits."""
+        if self._client is not None:
+            return
+        if self._write_queue is None:
+            self._write_queue = IndexWriteQueue(
+                self.apply_batch,
+                batch_size=settings.INDEX_BATCH_SIZE,
+                interval=settings.INDEX_COMMIT_INTERVAL,
+                max_attempts=settings.INDEX_MAX_ATTEMPTS,
+            )
+        self._write_queue.start()
+
+    async def flush(self) -> None:
+        """Wait until every queued index update has been committed."""
+        if self._client is not None:
+            await asyncio.to_thread(self._client.flush)
+        elif self._write_queue is not None:
+            await self._write_queue.flush()
+
+    async def stop_write_behind(self) -> None:
+        if self._write_queue is not None:
+            await self._write_queue.stop()
+
+    def start_maintenance(self) -> None:
+        """Start the background segment merge scheduler."""
+        if self._client is not None:
+            return
+        if self._maintenance is None:
+            self._maintenance = IndexMaintenance(
+                self,
+                interval=settings.INDEX_MAINTENANCE_INTERVAL,
+                max_segments=settings.INDEX_MERGE_MAX_SEGMENTS,
+                max_deleted_ratio=settings.INDEX_MERGE_MAX_DELETED_RATIO,
+                window=settings.INDEX_MAINTENANCE_WINDOW,
+            )
+        self._maintenance.start()
+
+    async def stop_maintenance(self) -> None:
+        if self._maintenance is not None:
+            await self._maintenance.stop()
 
     def search(
         self,
@@ -139,81 +1018,367 @@ class SearchService:
         date_to: Optional[datetime] = None,
         skip: int = 0,
         limit: int = 20,
+        include_subfolders: bool = True,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        hybrid: bool = False,
     ) -> Tuple[List[dict], int]:
+        result = self.execute(
+            query,
+            file_type=file_type,
+            folder_id=folder_id,
+            tag_ids=tag_ids,
+            date_from=date_from,
+            date_to=date_to,
+            skip=skip,
+            limit=limit,
+            include_subfolders=include_subfolders,
+            sort=sort,
+            cursor=cursor,
+            hybrid=hybrid,
+        )
+        return result.items, result.total
+
+    def execute(
+        self,
+        query: str,
+        file_type: Optional[str] = None,
+        folder_id: Optional[int] = None,
+        tag_ids: Optional[List[int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        skip: int = 0,
+        limit: int = 20,
+        exact_total: Optional[bool] = None,
+        facets: bool = False,
+        include_subfolders: bool = True,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        hybrid: bool = False,
+    ) -> SearchResult:
+        """Search and return one page of hits along with the match count, and
+        with ``facets``, hit counts per file type, folder, tag and year.
+
+        ``folder_id`` matches the folder's whole subtree unless
+        ``include_subfolders`` is False. ``sort`` is read by
+        :meth:`SearchSort.parse`; an unknown order raises ValueError.
+
+        ``cursor`` pages without ``skip``: pass ``"*"`` for the first page and
+        then each result's ``next_cursor`` (see :mod:`search_cursor`).
+
+        ``hybrid`` re-ranks the best ``SEARCH_HYBRID_CANDIDATES`` BM25 hits by
+        their embedding similarity to the query (see :mod:`embeddings`); until
+        embeddings are built it ranks by BM25 alone.
+        """
         self._require_backend()
-        with self.ix.searcher(weighting=BM25F()) as searcher:
-            parser = MultifieldParser(["content"], self.ix.schema)
-            q = parser.parse(query)
-
-            # Build filter query for Whoosh to apply during search
-            filter_parts = []
-            if file_type:
-                filter_parts.append(Term("file_type", file_type))
-            if folder_id:
-                filter_parts.append(Term("folder_id", str(folder_id)))
-
-            filter_q = And(filter_parts) if filter_parts else None
-
-            # Search with filter applied inside Whoosh (no artificial limit)
-            # Use limit=None to get all results for accurate total
-            results = searcher.search(q, filter=filter_q, limit=None)
-
-            # Post-filter for tag_ids and date range (not easily done in Whoosh filter)
-            filtered = []
-            for hit in results:
-                if tag_ids:
-                    hit_tags = set(hit.get("tag_ids", "").split(","))
-                    if not any(str(t) in hit_tags for t in tag_ids):
-                        continue
-                if date_from and hit.get("created_at") and hit["created_at"] < date_from:
-                    continue
-                if date_to and hit.get("created_at") and hit["created_at"] > date_to:
-                    continue
-                filtered.append(hit)
-
-            total = len(filtered)
-            paginated = filtered[skip : skip + limit]
-
-            items = []
-            for hit in paginated:
-                highlighted = self.highlight(hit.get("content", ""), query)
-                items.append(
-                    {
-                        "doc_id": int(hit["doc_id"]),
-                        "file_type": hit.get("file_type", ""),
-                        "folder_id": int(hit["folder_id"]) if hit.get("folder_id") else None,
-                        "score": hit.score,
-                        "highlight": highlighted,
-                    }
+        if exact_total is None:
+            exact_total = settings.SEARCH_EXACT_TOTAL
+
+        order = SearchSort.parse(sort, settings.SEARCH_RECENCY_HALF_LIFE_DAYS)
+        parsed = self.backend.parse(query)
+        filters = SearchFilters.build(
+            file_type, folder_id, tag_ids, date_from, date_to, include_subfolders
+        )
+
+        if hybrid and (order is not None or cursor is not None):
+            raise ValueError("Hybrid ranking cannot be combined with sort or cursor")
+        if cursor is not None:
+            if skip:
+                raise ValueError("skip cannot be combined with a cursor")
+            return self._page_after(
+                cursor, parsed, query, filters, limit, exact_total, facets, order
+            )
+
+        cache_key = None
+        if self._result_cache.maxsize:
+            # Keyed on the analyzed query so spacing/operator variants share entries.
+            # A commit racing this search only ever files the page under an
+            # older generation, which the next lookup discards.
+            generation = self.backend.generation()
+            # Hybrid pages also move with each embedding build and fold-in
+            ranking = self.embeddings.generation() if hybrid else None
+            cache_key = (
+                generation,
+                (repr(parsed), filters, skip, limit, exact_total, facets, order, ranking),
+            )
+            self._result_cache.bind_generation(generation)
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if hybrid and self.embeddings.ready:
+            result = self._hybrid_search(parsed, query, filters, skip, limit, exact_total, facets)
+        else:
+            result = self.backend.search(
+                parsed, query, filters, skip, limit, exact_total, facets=facets, sort=order
+            )
+        if skip == 0 and result.total <= settings.SEARCH_DID_YOU_MEAN_MAX_HITS:
+            result.did_you_mean = self.did_you_mean(query, filters, result.total)
+        if cache_key is not None:
+            self._result_cache.put(cache_key, result)
+        return result
+
+    def _hybrid_search(
+        self,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool,
+    ) -> SearchResult:
+        candidates = max(skip + limit, settings.SEARCH_HYBRID_CANDIDATES)
+        result = self.backend.search(parsed, query, filters, 0, candidates, exact_total, facets)
+        ranked = self.embeddings.rerank(query, result.items, settings.SEARCH_HYBRID_WEIGHT)
+        result.items = ranked[skip : skip + limit]
+        return result
+
+    def _page_after(
+        self,
+        cursor: str,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        limit: int,
+        exact_total: bool,
+        facets: bool,
+        order: Optional[SearchSort],
+    ) -> SearchResult:
+        """One page of a cursor walk, on the snapshot pinned by its first page.
+
+        Pages are not cached: each costs one bounded collection already.
+        """
+        digest = fingerprint(repr(parsed), filters, order)
+        if cursor == START:
+            after: tuple = ()
+        else:
+            position = decode_cursor(cursor)
+            if position.fingerprint != digest:
+                raise ValueError("The cursor belongs to a different search")
+            after = position.key
+
+        if cursor == START:
+            snapshot = self._pins.pin(self.backend.pin)
+        elif position.generation is not None:
+            snapshot = self._pins.acquire(position.generation)
+        else:
+            snapshot = None
+        try:
+            # One hit more than the page tells whether there is a next one
+            result = self.backend.search(
+                parsed, query, filters, 0, limit + 1, exact_total,
+                facets=facets, sort=order, snapshot=snapshot, after=after,
+            )
+        finally:
+            # An evicted snapshot stays open until its last page is served
+            self._pins.release(snapshot)
+        keys = result.keys or []
+        if len(result.items) > limit:
+            result.items = result.items[:limit]
+            generation = snapshot.generation if snapshot is not None else None
+            result.next_cursor = encode_cursor(Cursor(generation, digest, keys[limit - 1]))
+        result.keys = None
+        if cursor == START and result.total <= settings.SEARCH_DID_YOU_MEAN_MAX_HITS:
+            result.did_you_mean = self.did_you_mean(query, filters, result.total)
+        return result
+
+    def did_you_mean(self, query: str, filters: SearchFilters, total: int) -> Optional[str]:
+        """``query`` with misspelled words replaced by index terms, if that
+        finds more documents than the ``total`` the query itself found."""
+        if not self._suggester.corrector.enabled:
+            return None
+        self._sync_suggester()
+        corrected = correct_query(query, self._suggester.correct)
+        if corrected is None:
+            return None
+        if self.backend.count(self.backend.parse(corrected), filters) <= total:
+            return None
+        return corrected
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        """Most frequent index terms starting with ``prefix``, for search-as-you-type."""
+        self._require_backend()
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        # Catches up with commits made by other processes, or builds on first use
+        self._sync_suggester()
+        return [{"term": term, "df": df} for term, df in self._suggester.suggest(prefix, limit)]
+
+    async def asuggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        return await self.executor.run(self.suggest, prefix, limit)
+
+    def _sync_suggester(self) -> None:
+        # Serialized so a slow refresh cannot overwrite a newer one
+        with self._suggest_lock:
+            generation = self.backend.generation()
+            if generation != self._suggester.generation:
+                self._suggester.refresh(
+                    generation,
+                    self.backend.term_dictionaries(self._suggester.known_segments()),
                 )
 
-            return items, total
+    def _refresh_suggester(self) -> None:
+        """Fold a local commit into the suggestions once they are in use."""
+        if not self._suggester.built:
+            return
+        try:
+            self._sync_suggester()
+        except Exception:
+            # Suggestions catch up on the next request
+            logger.exception("Failed to refresh search suggestions")
 
-    def highlight(self, content: str, query: str, context_chars: int = 100) -> str:
-        if not content or not query:
-            return content[:200] if content else ""
-
-        if jieba is None:
-            return content[:200] + ("..." if len(content) > 200 else "")
-
-        # Simple highlight: find query terms and extract context
-        terms = list(jieba.cut_for_search(query))
-        content_lower = content.lower()
-
-        for term in terms:
-            term_lower = term.lower()
-            idx = content_lower.find(term_lower)
-            if idx != -1:
-                start = max(0, idx - context_chars)
-                end = min(len(content), idx + len(term) + context_chars)
-                snippet = content[start:end]
-                # Highlight the term
-                highlighted = snippet.replace(term, f"<mark>{term}</mark>")
-                prefix = "..." if start > 0 else ""
-                suffix = "..." if end < len(content) else ""
-                return f"{prefix}{highlighted}{suffix}"
+    async def asearch(
+        self,
+        query: str,
+        file_type: Optional[str] = None,
+        folder_id: Optional[int] = None,
+        tag_ids: Optional[List[int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        skip: int = 0,
+        limit: int = 20,
+        exact_total: Optional[bool] = None,
+        facets: bool = False,
+        include_subfolders: bool = True,
+        sort: Optional[str] = None,
+        cursor: Optional[str] = None,
+        hybrid: bool = False,
+    ) -> SearchResult:
+        """Run :meth:`execute` on the search executor without blocking the event loop."""
+        return await self.executor.run(
+            self.execute,
+            query,
+            file_type=file_type,
+            folder_id=folder_id,
+            tag_ids=tag_ids,
+            date_from=date_from,
+            date_to=date_to,
+            skip=skip,
+            limit=limit,
+            exact_total=exact_total,
+            facets=facets,
+            include_subfolders=include_subfolders,
+            sort=sort,
+            cursor=cursor,
+            hybrid=hybrid,
+        )
 
-        return content[:200] + ("..." if len(content) > 200 else "")
+    def export(
+        self,
+        query: str,
+        file_type: Optional[str] = None,
+        folder_id: Optional[int] = None,
+        tag_ids: Optional[List[int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        include_subfolders: bool = True,
+    ) -> Iterator[dict]:
+        """Every match of ``query`` with its metadata and score, unranked.
+
+        The query is parsed here, so errors surface before the first hit; the
+        returned generator holds an index snapshot until it is closed.
+        """
+        self._require_backend()
+        parsed = self.backend.parse(query)
+        filters = SearchFilters.build(
+            file_type, folder_id, tag_ids, date_from, date_to, include_subfolders
+        )
+        return self.backend.iter_hits(parsed, filters)
+
+    async def aexport(self, query: str, **filters: Any) -> AsyncIterator[List[dict]]:
+        """:meth:`export` in batches, each read on the search executor.
+
+        Taking one executor slot per batch rather than per export lets long
+        exports share the search concurrency limit with interactive searches.
+        """
+        hits = self.export(query, **filters)
+        size = max(1, settings.SEARCH_EXPORT_BATCH_SIZE)
+        # A cancelled batch may still be running on its thread
+        lock = threading.Lock()
+
+        def take() -> List[dict]:
+            with lock:
+                return list(islice(hits, size))
+
+        try:
+            while True:
+                batch = await self.executor.run(take)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            # Releases the snapshot even when the client went away mid-export
+            with lock:
+                hits.close()
+
+    def warm_up(self, queries: Optional[List[str]] = None) -> dict:
+        """Load the jieba dictionary, then open and prime the backend's index.
+
+        Returns the time spent in each phase in milliseconds so startup can
+        report it; the same numbers are kept in :meth:`stats`.
+        """
+        timings: dict = {}
+
+        def phase(name: str, started: float) -> float:
+            now = time.perf_counter()
+            timings[name] = round((now - started) * 1000, 1)
+            logger.info("Search warm-up: %s took %.1f ms", name, timings[name])
+            return now
+
+        started = time.perf_counter()
+        if jieba is not None:
+            if settings.JIEBA_CACHE_FILE:
+                jieba.dt.cache_file = settings.JIEBA_CACHE_FILE
+            jieba.initialize()
+            started = phase("jieba", started)
+
+        if self.backend.available:
+            for name, step in self.backend.warm_up_steps():
+                step()
+                started = phase(name, started)
+            # Term list for suggestions and its spelling deletion index
+            self._sync_suggester()
+            started = phase("vocabulary", started)
+            for query in queries or []:
+                self.execute(query, limit=1)
+            phase("queries", started)
+
+        self._warmup = timings
+        return timings
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "executor": self.executor.stats(),
+            "result_cache": self._result_cache.stats(),
+            "suggest": self._suggester.stats(),
+            "cursors": self._pins.stats(),
+            "embeddings": self.embeddings.stats(),
+            "index_writer": self._writer_stats(),
+            "maintenance": self._maintenance.stats() if self._maintenance else None,
+            "warmup": self._warmup,
+            **self.backend.stats(),
+        }
+
+    def _writer_stats(self) -> Optional[dict]:
+        if self._client is not None:
+            return self._client.stats()
+        return self._write_queue.stats() if self._write_queue else None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._client is not None:
+            self._client.close()
+        self._pins.close()
+        self.embeddings.close()
+        self.backend.close()
+
+    def highlight(self, content: str, query: str, context_chars: int = 100) -> str:
+        return highlight_snippet(content, query, context_chars)
 
 
 # Singleton instance
@@ -225,3 +1390,10 @@ def get_search_service() -> SearchService:
     if _search_service is None:
         _search_service = SearchService()
     return _search_service
+
+
+async def shutdown_search_service() -> None:
+    if _search_service is not None:
+        await _search_service.stop_maintenance()
+        await _search_service.stop_write_behind()
+        _search_service.close()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List
+
+
+class SearcherPool:
+    """Long-lived Whoosh searchers that are refreshed only when the index changes.
+
+    Whoosh segment readers keep stateful file handles, so a searcher is leased
+    to one query at a time. Idle searchers are kept open between requests and
+    brought up to date with ``Searcher.refresh()`` on checkout, which reuses
+    readers for unchanged segments and closes the rest. Leases are counted per
+    reader generation; a searcher returned after the pool is closed, or when
+    the pool is already full, is closed once its in-flight query finishes.
+    """
+
+    def __init__(self, ix: Any, weighting_factory: Callable[[], Any], max_idle: int = 4):
+        self.ix = ix
+        self._weighting_factory = weighting_factory
+        self.max_idle = max(1, max_idle)
+        self._lock = threading.Lock()
+        self._idle: List[Any] = []
+        self._leases: Counter = Counter()
+        self._closed = False
+        self.created = 0
+        self.refreshed = 0
+        self.reused = 0
+
+    @contextmanager
+    def searcher(self) -> Iterator[Any]:
+        searcher = self._checkout()
+        generation = searcher.reader().generation()
+        with self._lock:
+            self._leases[generation] += 1
+        try:
+            yield searcher
+        finally:
+            with self._lock:
+                self._leases[generation] -= 1
+                if not self._leases[generation]:
+                    del self._leases[generation]
+            self._checkin(searcher)
+
+    def _checkout(self) -> Any:
+        with self._lock:
+            searcher = self._idle.pop() if self._idle else None
+            if searcher is not None:
+                self.reused += 1
+
+        if searcher is None:
+            searcher = self.ix.searcher(weighting=self._weighting_factory())
+            with self._lock:
+                self.created += 1
+        elif not searcher.up_to_date():
+            searcher = searcher.refresh()
+            with self._lock:
+                self.refreshed += 1
+        return searcher
+
+    def _checkin(self, searcher: Any) -> None:
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(searcher)
+                return
+        searcher.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for searcher in idle:
+            searcher.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "in_use": sum(self._leases.values()),
+                "leases_by_generation": {str(gen): n for gen, n in self._leases.items()},
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "reused": self.reused,
+            }
+
+
+class SnapshotSearchers:
+    """Searchers over one pinned index generation, leased one query at a time.
+
+    The first searcher is opened when the generation is pinned and keeps its
+    segment files open. Concurrent queries get further searchers from
+    ``open_more``, which reopens the same segments, up to ``max_open``. Once
+    a merge has deleted those files no more can be opened, and queries wait
+    for a free searcher instead.
+    """
+
+    def __init__(self, first: Any, open_more: Callable[[], Any], max_open: int = 4):
+        self._open_more = open_more
+        self.max_open = max(1, max_open)
+        self._cond = threading.Condition()
+        self._idle: List[Any] = [first]
+        self._open = 1
+        self._can_open = True
+        self._closed = False
+
+    @contextmanager
+    def searcher(self) -> Iterator[Any]:
+        searcher = self._checkout()
+        try:
+            yield searcher
+        finally:
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(searcher)
+                    self._cond.notify()
+                    return
+            searcher.close()
+
+    def _checkout(self) -> Any:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The pinned index snapshot is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._can_open and self._open < self.max_open:
+                    self._open += 1
+                    break
+                self._cond.wait()
+        try:
+            return self._open_more()
+        except OSError:
+            with self._cond:
+                self._open -= 1
+                self._can_open = False
+            return self._checkout()
+
+    def close(self) -> None:
+        """Close the idle searchers; leased ones close when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for searcher in idle:
+            searcher.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"open": self._open, "idle": len(self._idle)}
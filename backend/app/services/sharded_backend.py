@@ -0,0 +1,290 @@
+"""Whoosh index split into shards that are searched in parallel.
+
+Each document lives in exactly one shard, chosen by :func:`shard_for`, so a
+commit only takes the owning shards' writer locks. A query runs on every
+shard at once on a thread pool. Scores stay comparable across shards because
+each shard's BM25F scorer takes idf and average field length from
+:class:`GlobalStats`, which sums document counts, document frequencies and
+field lengths over all shard readers, exactly as a single index would.
+"""
+
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from math import log
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from whoosh.scoring import BM25F, BM25FScorer, WeightScorer
+    from whoosh.searching import Searcher
+except ImportError:  # pragma: no cover
+    BM25F = None
+    Searcher = None
+
+from app.services.index_queue import IndexBatch
+from app.services.search_backend import (
+    PinnedSnapshot,
+    SearchFilters,
+    SearchResult,
+    SearchSort,
+    format_facets,
+)
+from app.services.suggest import TermDictionary
+
+
+def shard_for(doc_id: int, shards: int) -> int:
+    """Stable shard number of a document, the same in every process."""
+    return zlib.crc32(str(int(doc_id)).encode("ascii")) % shards
+
+
+def shard_dir(index_dir: Path, shard: int) -> Path:
+    return Path(index_dir) / f"shard_{shard:02d}"
+
+
+class GlobalStats:
+    """Collection statistics of all shards, for one query."""
+
+    def __init__(self, searchers: Sequence[Any]):
+        self.searchers = searchers
+        self.doc_count_all = sum(searcher.doc_count_all() for searcher in searchers)
+        self._idf: Dict[Tuple[str, str], float] = {}
+        self._avgfl: Dict[str, float] = {}
+
+    def idf(self, fieldname: str, text: str) -> float:
+        key = (fieldname, text)
+        if key not in self._idf:
+            df = sum(searcher.doc_frequency(fieldname, text) for searcher in self.searchers)
+            self._idf[key] = log(self.doc_count_all / (df + 1)) + 1
+        return self._idf[key]
+
+    def avg_field_length(self, fieldname: str) -> float:
+        if fieldname not in self._avgfl:
+            total = sum(searcher.field_length(fieldname) for searcher in self.searchers)
+            self._avgfl[fieldname] = total / (self.doc_count_all or 1)
+        return self._avgfl[fieldname]
+
+
+if BM25F is not None:
+
+    class GlobalBM25FScorer(BM25FScorer):
+        def __init__(self, searcher, fieldname, text, B, K1, stats: GlobalStats, qf=1):
+            self.idf = stats.idf(fieldname, text)
+            self.avgfl = stats.avg_field_length(fieldname) or 1
+            self.B = B
+            self.K1 = K1
+            self.qf = qf
+            self.setup(searcher, fieldname, text)
+
+    class GlobalBM25F(BM25F):
+        """BM25F that scores one shard with statistics from all of them."""
+
+        def __init__(self, stats: GlobalStats, **kwargs):
+            super().__init__(**kwargs)
+            self.stats = stats
+
+        def scorer(self, searcher, fieldname, text, qf=1):
+            if not searcher.schema[fieldname].scorable:
+                return WeightScorer.for_(searcher, fieldname, text)
+            B = self._field_B.get(fieldname, self.B)
+            return GlobalBM25FScorer(searcher, fieldname, text, B, self.K1, self.stats, qf=qf)
+
+
+class ShardedBackend:
+    """Fans every operation out to a list of :class:`WhooshBackend` shards."""
+
+    transactional = False
+
+    def __init__(self, shards: List[Any]):
+        self.shards = shards
+        self.name = shards[0].name
+        self.missing = shards[0].missing
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.shards[0].available
+
+    def _each(self, fn: Callable[..., Any], *items: Sequence[Any]) -> List[Any]:
+        """Run ``fn`` over the items in parallel and return results in order."""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=len(self.shards), thread_name_prefix="search-shard"
+                    )
+        return list(self._pool.map(fn, *items))
+
+    def apply_batch(self, batch: IndexBatch) -> None:
+        """Split the batch by owning shard; untouched shards are not locked."""
+        parts: Dict[int, IndexBatch] = {}
+        for doc_id, fields in batch.items():
+            parts.setdefault(shard_for(doc_id, len(self.shards)), {})[doc_id] = fields
+        self._each(lambda shard: self.shards[shard].apply_batch(parts[shard]), sorted(parts))
+
+    def generation(self) -> int:
+        # Shard generations only grow, so their sum moves on every commit
+        return sum(shard.generation() for shard in self.shards)
+
+    def segment_stats(self) -> dict:
+        """Totals over all shards; ``segments`` is the most in any one shard,
+        which is what merge thresholds are about."""
+        per_shard = self._each(lambda shard: shard.segment_stats(), self.shards)
+        docs = sum(stats["docs"] for stats in per_shard)
+        deleted = sum(stats["deleted"] for stats in per_shard)
+        return {
+            "generation": sum(stats["generation"] for stats in per_shard),
+            "segments": max(stats["segments"] for stats in per_shard),
+            "docs": docs,
+            "deleted": deleted,
+            "deleted_ratio": round(deleted / docs, 4) if docs else 0.0,
+            "shards": per_shard,
+        }
+
+    def merge_segments(self, optimize: bool = False) -> None:
+        self._each(lambda shard: shard.merge_segments(optimize), self.shards)
+
+    def term_dictionaries(self, known: set) -> List[TermDictionary]:
+        def read(i: int) -> List[TermDictionary]:
+            mine = {key for shard, key in known if shard == i}
+            return [((i, key), terms) for key, terms in self.shards[i].term_dictionaries(mine)]
+
+        return [entry for part in self._each(read, range(len(self.shards))) for entry in part]
+
+    def parse(self, query: str):
+        return self.shards[0].parse(query)
+
+    def search(
+        self,
+        parsed,
+        query: str,
+        filters: SearchFilters,
+        skip: int,
+        limit: int,
+        exact_total: bool,
+        facets: bool = False,
+        sort: Optional[SearchSort] = None,
+        snapshot: Optional[PinnedSnapshot] = None,
+        after: Optional[tuple] = None,
+    ) -> SearchResult:
+        """Take the top ``skip + limit`` of every shard and merge them.
+
+        Ties are broken by ``doc_id`` since shard doc numbers are not comparable;
+        facet counts are summed over the shards. Sort keys compare across
+        shards as they are, being column values, global scores and doc ids.
+        """
+        with ExitStack() as stack:
+            if snapshot is None:
+                pooled = [
+                    stack.enter_context(shard.searchers.searcher()) for shard in self.shards
+                ]
+            else:
+                pooled = [stack.enter_context(pool.searcher()) for pool in snapshot.handle]
+            weighting = GlobalBM25F(GlobalStats(pooled))
+            # Searchers over the pooled readers that score with the global
+            # weighting; constant-score queries such as prefixes fall back to
+            # the searcher's own weighting rather than the search context's
+            scoped = [
+                Searcher(searcher.reader(), weighting=weighting, closereader=False)
+                for searcher in pooled
+            ]
+
+            def run(shard, searcher):
+                return shard.top_docs(
+                    searcher, parsed, filters, skip + limit, facets, sort, after
+                )
+
+            per_shard = self._each(run, self.shards, scoped)
+
+            total, total_exact, candidates = 0, True, []
+            counts: Dict[str, Counter] = {}
+            for k, results in enumerate(per_shard):
+                if results is None:
+                    continue
+                if facets:
+                    for name, shard_counts in self.shards[k].facet_counts(results).items():
+                        counts.setdefault(name, Counter()).update(shard_counts)
+                if exact_total or filters.active or results.has_exact_length():
+                    total += len(results)
+                else:
+                    total += max(results.estimated_length(), results.scored_length())
+                    total_exact = False
+                candidates.extend((hit.score, int(hit["doc_id"]), k, hit) for hit in results)
+
+            if sort is None and after is None:
+                rank = lambda c: (-c[0], c[1])  # noqa: E731
+            else:
+                rank = lambda c: (c[0], c[1])  # noqa: E731
+            page = heapq.nsmallest(skip + limit, candidates, key=rank)[skip:]
+            terms = self.shards[0].content_terms(parsed)
+            now = time.time()
+            for k in {k for _score, _id, k, _hit in page}:
+                if not self.shards[k].stores_content:
+                    self.shards[k].text_store.refresh()
+            items = [
+                self.shards[k].hit_to_item(
+                    hit, query, terms, self.shards[k].hit_score(hit, sort, now)
+                )
+                for _score, _id, k, hit in page
+            ]
+        return SearchResult(
+            items=items,
+            total=total,
+            total_exact=total_exact,
+            facets=format_facets(counts) if facets else None,
+            keys=[score for score, _id, _k, _hit in page] if after is not None else None,
+        )
+
+    def iter_hits(self, parsed, filters: SearchFilters) -> Iterator[dict]:
+        """Each shard's matches in turn, scored with the global statistics."""
+        searchers = [shard.ix.searcher() for shard in self.shards]
+        try:
+            weighting = GlobalBM25F(GlobalStats(searchers))
+            for shard, searcher in zip(self.shards, searchers):
+                scoped = Searcher(searcher.reader(), weighting=weighting, closereader=False)
+                yield from shard.searcher_hits(scoped, parsed, filters)
+        finally:
+            for searcher in searchers:
+                searcher.close()
+
+    def pin(self) -> PinnedSnapshot:
+        pools = [shard.pin_searchers() for shard in self.shards]
+
+        def close() -> None:
+            for pool in pools:
+                pool.close()
+
+        generation = 0
+        for shard, pool in zip(self.shards, pools):
+            with pool.searcher() as searcher:
+                generation += shard.reader_generation(searcher)
+        return PinnedSnapshot(generation, pools, close)
+
+    def count(self, parsed, filters: SearchFilters) -> int:
+        return sum(self._each(lambda shard: shard.count(parsed, filters), self.shards))
+
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        steps = [shard.warm_up_steps() for shard in self.shards]
+
+        def step(i: int) -> Callable[[], Any]:
+            return lambda: self._each(lambda shard_steps: shard_steps[i][1](), steps)
+
+        return [(name, step(i)) for i, (name, _fn) in enumerate(steps[0])]
+
+    def stats(self) -> dict:
+        return {"shards": [shard.stats() for shard in self.shards]}
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
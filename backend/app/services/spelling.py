@@ -0,0 +1,159 @@
+"""Spelling corrections ("did you mean") against the index vocabulary.
+
+:class:`SpellCorrector` is a SymSpell-style deletion index. Each term is filed
+under every string that can be made from its first ``prefix_length``
+characters by deleting up to ``max_distance`` of them. A misspelled word
+finds its candidates by generating its own deletions and looking them up.
+That costs a few dictionary lookups however large the vocabulary is. The
+candidates are then checked with the real (optimal string alignment) edit
+distance. The closest term wins, and the more frequent one breaks ties.
+
+The index is updated from the vocabulary changes that
+:class:`~app.services.suggest.TermSuggester` computes on each commit.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+try:
+    import jieba
+except ImportError:  # pragma: no cover
+    jieba = None
+
+_WORD = re.compile(r'[^\s()"]+')
+_OPERATORS = {"AND", "OR", "NOT"}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or ``limit + 1`` once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class SpellCorrector:
+    """Deletion index over a vocabulary, updated incrementally."""
+
+    def __init__(self, max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max(0, max_distance)
+        self.prefix_length = max(1, prefix_length)
+        self._lock = threading.Lock()
+        # Buckets are replaced rather than mutated, so lookups need no lock
+        self._index: Dict[str, Tuple[str, ...]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_distance > 0
+
+    def _deletes(self, word: str, distance: int) -> Set[str]:
+        found = {word[: self.prefix_length]}
+        frontier = set(found)
+        for _ in range(distance):
+            frontier = {
+                item[:i] + item[i + 1 :] for item in frontier if len(item) > 1
+                for i in range(len(item))
+            }
+            found |= frontier
+        return found
+
+    def distance_for(self, word: str) -> int:
+        """Allowed edits for ``word``; short words have too many neighbours."""
+        if len(word) < 3:
+            return 0
+        return min(self.max_distance, 1 if len(word) < 5 else 2)
+
+    def update(self, added: Iterable[str], removed: Iterable[str]) -> None:
+        if not self.enabled:
+            return
+        # Collect each bucket's changes first and rebuild it once: growing a
+        # tuple per term is quadratic in a bucket shared by many terms
+        gone: Dict[str, Set[str]] = {}
+        new: Dict[str, List[str]] = {}
+        for term in removed:
+            for key in self._deletes(term, self.max_distance):
+                gone.setdefault(key, set()).add(term)
+        for term in added:
+            for key in self._deletes(term, self.max_distance):
+                new.setdefault(key, []).append(term)
+        with self._lock:
+            for key in gone.keys() | new.keys():
+                drop = gone.get(key, ())
+                bucket = tuple(t for t in self._index.get(key, ()) if t not in drop)
+                bucket += tuple(new.get(key, ()))
+                if bucket:
+                    self._index[key] = bucket
+                else:
+                    self._index.pop(key, None)
+
+    def lookup(self, word: str, df: Mapping[str, int]) -> Optional[str]:
+        """Closest term to ``word`` in ``df``, or None.
+
+        A word that is itself in the vocabulary, like a typo that made it into
+        a few documents, is only replaced by a term one edit away that is
+        found in more documents.
+        """
+        own = df.get(word, 0)
+        limit = min(self.distance_for(word), 1) if own else self.distance_for(word)
+        if not limit:
+            return None
+        best: Optional[Tuple[int, int, str]] = None
+        seen: Set[str] = set()
+        for key in self._deletes(word, limit):
+            for term in self._index.get(key, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                count = df.get(term, 0)
+                if count <= own or term == word:
+                    continue
+                distance = edit_distance(word, term, limit)
+                if distance <= limit:
+                    rank = (distance, -count, term)
+                    if best is None or rank < best:
+                        best = rank
+        return best[2] if best else None
+
+    def stats(self) -> dict:
+        return {"max_distance": self.max_distance, "deletes": len(self._index)}
+
+
+def correct_query(query: str, correct: Callable[[str], Optional[str]]) -> Optional[str]:
+    """Rewrite the words of ``query`` with ``correct``, keeping its operators,
+    parentheses, quotes and prefixes. Returns None when nothing changed.
+
+    Words are split the way jieba splits them so a typo inside a longer
+    Chinese run is corrected on its own.
+    """
+    changed = False
+
+    def fix(match: "re.Match[str]") -> str:
+        nonlocal changed
+        word = match.group(0)
+        if word in _OPERATORS or word.endswith("*"):
+            return word
+        pieces = jieba.lcut(word) if jieba is not None else [word]
+        fixed = []
+        for piece in pieces:
+            replacement = correct(piece) if piece.strip() else None
+            if replacement:
+                changed = True
+            fixed.append(replacement or piece)
+        return "".join(fixed)
+
+    corrected = _WORD.sub(fix, query)
+    return corrected if changed else None
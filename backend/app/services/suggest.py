@@ -0,0 +1,159 @@
+"""Prefix suggestions for search-as-you-type.
+
+:class:`TermSuggester` keeps the index's ``content`` term dictionary as one
+sorted list plus a document frequency per term. The terms that start with a
+prefix are then a contiguous slice found by binary search, and the most
+frequent of them are the suggestions. This works the same for Latin and
+Chinese prefixes, since jieba's search-mode words share prefixes with their
+longer compounds.
+
+Backends hand over their dictionary one immutable segment at a time (see
+``term_dictionaries`` on the backends). A refresh reads only the segments it
+has not seen and subtracts the ones that were merged away. It then merges the
+new terms into the sorted list in one linear pass, so a commit costs time in
+proportion to what changed, not to the size of the index.
+
+Like the BM25 statistics, frequencies include deleted documents until their
+segment is merged.
+"""
+
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from app.services.search_cache import LRUCache
+from app.services.spelling import SpellCorrector
+
+# (segment key, [(term, document frequency), ...] or None when already known)
+TermDictionary = Tuple[Hashable, Optional[List[Tuple[str, int]]]]
+
+_LAST_CHAR = chr(0x10FFFF)
+
+
+def _suggestible(term: str) -> bool:
+    # Punctuation and symbols are indexed as words of their own
+    return any(ch.isalnum() for ch in term)
+
+
+class TermSuggester:
+    """Most frequent index terms for a prefix, kept in step with commits."""
+
+    def __init__(self, cache_size: int = 1024, corrector: Optional[SpellCorrector] = None):
+        self.corrector = corrector
+        self._lock = threading.Lock()
+        self._parts: Dict[Hashable, Dict[str, int]] = {}
+        # (generation, sorted terms, document frequencies), swapped as a whole
+        self._snapshot: Tuple[Any, List[str], Dict[str, int]] = (None, [], {})
+        self._cache = LRUCache(cache_size)
+        self.refreshes = 0
+        self.segments_read = 0
+        self.last_refresh_ms: Optional[float] = None
+
+    @property
+    def generation(self) -> Any:
+        return self._snapshot[0]
+
+    @property
+    def built(self) -> bool:
+        return self._snapshot[0] is not None
+
+    def known_segments(self) -> set:
+        return set(self._parts)
+
+    def refresh(self, generation: Any, dictionaries: Sequence[TermDictionary]) -> None:
+        """Bring the term list up to ``generation``.
+
+        ``dictionaries`` lists every current segment. Segments whose key was
+        passed in an earlier refresh may come with ``None`` for their terms.
+        """
+        with self._lock:
+            if generation == self._snapshot[0]:
+                return
+            started = time.perf_counter()
+            _, old_terms, old_df = self._snapshot
+            df = dict(old_df)
+            parts: Dict[Hashable, Dict[str, int]] = {}
+            added: List[str] = []
+            for key, terms in dictionaries:
+                if key in self._parts:
+                    parts[key] = self._parts[key]
+                    continue
+                part = {term: n for term, n in terms or () if n > 0 and _suggestible(term)}
+                parts[key] = part
+                self.segments_read += 1
+                for term, n in part.items():
+                    if term in df:
+                        df[term] += n
+                    else:
+                        df[term] = n
+                        added.append(term)
+
+            removed: List[str] = []
+            for key, part in self._parts.items():
+                if key in parts:
+                    continue
+                for term, n in part.items():
+                    left = df[term] - n
+                    if left > 0:
+                        df[term] = left
+                    else:
+                        del df[term]
+                        removed.append(term)
+
+            terms = [term for term in old_terms if term in df] if removed else list(old_terms)
+            if added:
+                # Two sorted runs, which the sort merges in linear time
+                terms.extend(sorted(added))
+                terms.sort()
+
+            if self.corrector is not None:
+                self.corrector.update(added, removed)
+            self._parts = parts
+            self._snapshot = (generation, terms, df)
+            self._cache.bind_generation(generation)
+            self.refreshes += 1
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return up to ``limit`` ``(term, document frequency)`` pairs, most
+        frequent first; ties go to the shorter, then alphabetically first term."""
+        generation, terms, df = self._snapshot
+        if not prefix or limit <= 0:
+            return []
+        key = (generation, prefix, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        lo = bisect_left(terms, prefix)
+        hi = bisect_left(terms, prefix + _LAST_CHAR, lo)
+        rank = lambda term: (-df[term], len(term), term)  # noqa: E731
+        if hi - lo <= limit:
+            best = sorted(terms[lo:hi], key=rank)
+        else:
+            best = heapq.nsmallest(limit, terms[lo:hi], key=rank)
+        result = [(term, df[term]) for term in best]
+        self._cache.put(key, result)
+        return result
+
+    def correct(self, word: str) -> Optional[str]:
+        """The vocabulary term ``word`` was most likely meant to be, if any."""
+        if self.corrector is None:
+            return None
+        return self.corrector.lookup(word, self._snapshot[2])
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "terms": len(self._snapshot[1]),
+            "segments": len(self._parts),
+            "refreshes": self.refreshes,
+            "segments_read": self.segments_read,
+            "last_refresh_ms": self.last_refresh_ms,
+            "cache": self._cache.stats(),
+            "spelling": self.corrector.stats() if self.corrector else None,
+        }
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import logging
+from typing import List, Optional, Tuple
 
 from sqlalchemy import delete, func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -8,6 +9,7 @@ from sqlalchemy.orm import selectinload
 
 from app.models import Document, Tag
 from app.models.document import document_tags
+from app.services.folder_service import FolderService
 
 try:
     from app.services.search_service import get_search_service
@@ -17,11 +19,41 @@ except ModuleNotFoundError as exc:  # pragma: no cover
     else:
         raise
 
+logger = logging.getLogger(__name__)
+
+
+def _needs_reindex() -> bool:
+    # Transactional backends join document_tags at query time
+    return not get_search_service().transactional
+
 
 class TagService:
     def __init__(self, db: AsyncSession):
         self.db = db
 
+    async def _reindex(self, updates: List[Tuple[Document, List[int]]]) -> None:
+        """Send documents with their new tag ids to the index in one batch."""
+        search_service = get_search_service()
+        if not updates or not search_service.backend.available:
+            return
+        # Reindexed documents keep their folder's ancestors for subtree filters
+        paths = await FolderService(self.db).ancestor_paths()
+        await search_service.asubmit_many(
+            {
+                doc.id: search_service.document_fields(
+                    doc.id,
+                    doc.content_text or "",
+                    doc.file_type,
+                    doc.folder_id,
+                    tag_ids,
+                    doc.created_at,
+                    paths.get(doc.folder_id),
+                    doc.file_size,
+                )
+                for doc, tag_ids in updates
+            }
+        )
+
     async def create_tag(self, name: str, color: str = "#3B82F6") -> Tag:
         tag = Tag(name=name, color=color)
         self.db.add(tag)
@@ -69,22 +101,14 @@ class TagService:
         await self.db.commit()
 
         # Reindex documents that had this tag removed
-        if get_search_service is not None and affected_docs:
+        if get_search_service is not None and affected_docs and _needs_reindex():
             try:
-                search_service = get_search_service()
-                for doc in affected_docs:
-                    # Re-fetch tag_ids excluding the deleted tag
-                    remaining_tag_ids = [t.id for t in doc.tags if t.id != tag_id]
-                    search_service.index_document(
-                        doc_id=doc.id,
-                        content=doc.content_text or "",
-                        file_type=doc.file_type,
-                        folder_id=doc.folder_id,
-                        tag_ids=remaining_tag_ids,
-                        created_at=doc.created_at,
-                    )
+                # Tag ids excluding the deleted tag
+                await self._reindex(
+                    [(doc, [t.id for t in doc.tags if t.id != tag_id]) for doc in affected_docs]
+                )
             except Exception:
-                pass
+                logger.exception("Failed to reindex documents of deleted tag %s", tag_id)
 
         return True
 
@@ -144,20 +168,11 @@ class TagService:
         await self.db.commit()
 
         # Reindex document with new tag
-        if get_search_service is not None:
+        if get_search_service is not None and _needs_reindex():
             try:
-                search_service = get_search_service()
-                tag_ids = [t.id for t in doc.tags] + [tag_id]
-                search_service.index_document(
-                    doc_id=doc.id,
-                    content=doc.content_text or "",
-                    file_type=doc.file_type,
-                    folder_id=doc.folder_id,
-                    tag_ids=tag_ids,
-                    created_at=doc.created_at,
-                )
+                await self._reindex([(doc, [t.id for t in doc.tags] + [tag_id])])
             except Exception:
-                pass
+                logger.exception("Failed to reindex document %s", doc.id)
 
         return True
 
@@ -184,20 +199,11 @@ class TagService:
             return False
 
         # Reindex document with tag removed
-        if get_search_service is not None:
+        if get_search_service is not None and _needs_reindex():
             try:
-                search_service = get_search_service()
-                tag_ids = [t.id for t in doc.tags if t.id != tag_id]
-                search_service.index_document(
-                    doc_id=doc.id,
-                    content=doc.content_text or "",
-                    file_type=doc.file_type,
-                    folder_id=doc.folder_id,
-                    tag_ids=tag_ids,
-                    created_at=doc.created_at,
-                )
+                await self._reindex([(doc, [t.id for t in doc.tags if t.id != tag_id])])
             except Exception:
-                pass
+                logger.exception("Failed to reindex document %s", doc.id)
 
         return True
 
@@ -215,6 +221,7 @@ class TagService:
             if not tag:
                 raise ValueError(f"Tag {tag_id} not found")
 
+        updates: List[Tuple[Document, List[int]]] = []
         for doc_id in document_ids:
             doc_result = await self.db.execute(
                 select(Document)
@@ -242,24 +249,16 @@ class TagService:
                     insert(document_tags).values(document_id=doc_id, tag_id=tag_id)
                 )
                 added += 1
-
-            # Reindex document
-            if get_search_service is not None:
-                try:
-                    search_service = get_search_service()
-                    new_tag_ids = list(current_tag_ids | set(tag_ids))
-                    search_service.index_document(
-                        doc_id=doc.id,
-                        content=doc.content_text or "",
-                        file_type=doc.file_type,
-                        folder_id=doc.folder_id,
-                        tag_ids=new_tag_ids,
-                        created_at=doc.created_at,
-                    )
-                except Exception:
-                    pass
+            updates.append((doc, list(current_tag_ids | set(tag_ids))))
 
         await self.db.commit()
+
+        # Reindex the documents in one batch
+        if get_search_service is not None and _needs_reindex():
+            try:
+                await self._reindex(updates)
+            except Exception:
+                logger.exception("Failed to reindex %d tagged documents", len(updates))
         return {"added": added, "skipped": skipped}
 
     async def batch_remove_tags(
@@ -267,6 +266,7 @@ class TagService:
     ) -> dict:
         removed = 0
 
+        updates: List[Tuple[Document, List[int]]] = []
         for doc_id in document_ids:
             doc_result = await self.db.execute(
                 select(Document)
@@ -286,23 +286,18 @@ class TagService:
                 )
                 removed += result.rowcount
 
-            # Reindex document
-            if get_search_service is not None:
-                try:
-                    search_service = get_search_service()
-                    remaining_tag_ids = [
-                        t.id for t in doc.tags if t.id not in tag_ids
-                    ]
-                    search_service.index_document(
-                        doc_id=doc.id,
-                        content=doc.content_text or "",
-                        file_type=doc.file_type,
-                        folder_id=doc.folder_id,
-                        tag_ids=remaining_tag_ids,
-                        created_at=doc.created_at,
-                    )
-                except Exception:
-                    pass
+            # Read what is left from the association table, like batch_add_tags
+            remaining = await self.db.execute(
+                select(document_tags.c.tag_id).where(document_tags.c.document_id == doc_id)
+            )
+            updates.append((doc, [row.tag_id for row in remaining]))
 
         await self.db.commit()
+
+        # Reindex the documents in one batch
+        if get_search_service is not None and _needs_reindex():
+            try:
+                await self._reindex(updates)
+            except Exception:
+                logger.exception("Failed to reindex %d untagged documents", len(updates))
         return {"removed": removed}
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+class StoredText:
+    """Lazy view of one document's text that only decompresses the blocks it reads.
+
+    Supports ``len()`` and slicing, which is all the highlighter needs. Blocks
+    are kept once read, and :meth:`load` fetches several ranges in one query.
+    """
+
+    def __init__(self, store: "TextStore", doc_id: int, length: int, block_chars: int):
+        self._store = store
+        self.doc_id = doc_id
+        self._length = length
+        self._block_chars = block_chars
+        self._blocks: Dict[int, str] = {}
+
+    def load(self, ranges: Iterable[Tuple[int, int]]) -> None:
+        """Read every block the character ranges touch that is not held yet."""
+        size = self._block_chars
+        wanted = set()
+        for start, stop in ranges:
+            start, stop = max(0, start), min(stop, self._length)
+            if start < stop:
+                wanted.update(range(start // size, (stop - 1) // size + 1))
+        missing = wanted.difference(self._blocks)
+        if missing:
+            self._blocks.update(self._store.read_blocks(self.doc_id, missing))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __getitem__(self, key: Union[slice, int]) -> str:
+        if isinstance(key, int):
+            if key < 0:
+                key += self._length
+            key = slice(key, key + 1)
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("StoredText only supports contiguous slices")
+        if start >= stop:
+            return ""
+        self.load([(start, stop)])
+        first, last = start // self._block_chars, (stop - 1) // self._block_chars
+        text = "".join(self._blocks.get(block, "") for block in range(first, last + 1))
+        offset = first * self._block_chars
+        return text[start - offset : stop - offset]
+
+    def __str__(self) -> str:
+        return self[:]
+
+
+class TextStore:
+    """Compressed per-document text, randomly accessible by character offset.
+
+    Each document is split into fixed-size character blocks that are
+    zlib-compressed into a SQLite file kept inside the index directory, so a
+    snippet only decompresses the block or two around its match. Rebuilding or
+    swapping the index directory moves the store with it.
+    """
+
+    FILENAME = "texts.sqlite"
+
+    def __init__(self, path: Union[str, Path], block_chars: int = 8192, level: int = 6):
+        self.path = Path(path)
+        self.block_chars = block_chars
+        self.level = level
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._epoch = 0
+        self._conn()
+        self._inode_seen = self._inode()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread so concurrent searches read in parallel.
+        # A rebuild swaps the whole index directory; :meth:`refresh` notices
+        # and every thread reconnects on its next read.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.epoch != self._epoch:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+            conn = None
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            # Compressed blocks are a few KB each; small pages keep the
+            # partly-filled tail page of every overflow chain cheap.
+            conn.execute("PRAGMA page_size=1024")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS texts ("
+                    "doc_id INTEGER PRIMARY KEY, length INTEGER NOT NULL, "
+                    "block_chars INTEGER NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS blocks ("
+                    "doc_id INTEGER NOT NULL, block INTEGER NOT NULL, data BLOB NOT NULL, "
+                    "PRIMARY KEY (doc_id, block)) WITHOUT ROWID"
+                )
+            self._local.conn = conn
+            self._local.epoch = self._epoch
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def refresh(self) -> None:
+        """Reconnect on the next read if the file was replaced since the last
+        check; stats the file, so call it once per request, not per read."""
+        inode = self._inode()
+        if inode != self._inode_seen:
+            with self._lock:
+                if inode != self._inode_seen:
+                    self._inode_seen = inode
+                    self._epoch += 1
+
+    def _inode(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def put_many(self, items: Iterable[Tuple[int, str]]) -> None:
+        rows_texts = []
+        rows_blocks = []
+        doc_ids = []
+        for doc_id, text in items:
+            text = text or ""
+            doc_ids.append((doc_id,))
+            rows_texts.append((doc_id, len(text), self.block_chars))
+            for block, offset in enumerate(range(0, len(text), self.block_chars)):
+                chunk = text[offset : offset + self.block_chars].encode("utf-8")
+                rows_blocks.append((doc_id, block, zlib.compress(chunk, self.level)))
+        if not doc_ids:
+            return
+        with self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM blocks WHERE doc_id = ?", doc_ids)
+            conn.executemany(
+                "INSERT OR REPLACE INTO texts (doc_id, length, block_chars) VALUES (?, ?, ?)",
+                rows_texts,
+            )
+            conn.executemany(
+                "INSERT INTO blocks (doc_id, block, data) VALUES (?, ?, ?)", rows_blocks
+            )
+
+    def put(self, doc_id: int, text: str) -> None:
+        self.put_many([(doc_id, text)])
+
+    def delete_many(self, doc_ids: Iterable[int]) -> None:
+        rows = [(doc_id,) for doc_id in doc_ids]
+        if not rows:
+            return
+        with self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM blocks WHERE doc_id = ?", rows)
+            conn.executemany("DELETE FROM texts WHERE doc_id = ?", rows)
+
+    def get(self, doc_id: int) -> Optional[StoredText]:
+        row = (
+            self._conn()
+            .execute("SELECT length, block_chars FROM texts WHERE doc_id = ?", (doc_id,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return StoredText(self, doc_id, row[0], row[1])
+
+    def read(self, doc_id: int, start: int, stop: int, block_chars: Optional[int] = None) -> str:
+        block_chars = block_chars or self.block_chars
+        first, last = start // block_chars, (stop - 1) // block_chars
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT data FROM blocks WHERE doc_id = ? AND block BETWEEN ? AND ? ORDER BY block",
+                (doc_id, first, last),
+            )
+            .fetchall()
+        )
+        text = "".join(zlib.decompress(row[0]).decode("utf-8") for row in rows)
+        offset = first * block_chars
+        return text[start - offset : stop - offset]
+
+    def read_blocks(self, doc_id: int, blocks: Iterable[int]) -> Dict[int, str]:
+        """Decompressed text of the given blocks of one document, in one query."""
+        blocks = sorted(blocks)
+        placeholders = ", ".join("?" * len(blocks))
+        rows = self._conn().execute(
+            f"SELECT block, data FROM blocks WHERE doc_id = ? AND block IN ({placeholders})",
+            (doc_id, *blocks),
+        )
+        return {block: zlib.decompress(data).decode("utf-8") for block, data in rows}
+
+    def size_bytes(self) -> int:
+        """On-disk size of the store, including an uncheckpointed WAL."""
+        return sum(
+            path.stat().st_size
+            for path in (self.path, Path(f"{self.path}-wal"))
+            if path.exists()
+        )
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        docs, chars = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM texts"
+        ).fetchone()
+        compressed = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blocks"
+        ).fetchone()[0]
+        return {
+            "docs": docs,
+            "chars": chars,
+            "compressed_bytes": compressed,
+            "file_bytes": self.size_bytes(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
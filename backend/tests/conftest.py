@@ -3,7 +3,7 @@ import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.main import app
-from app.core.database import Base, async_engine, get_db
+from app.core.database import Base, async_engine, get_db, get_session_factory
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
@@ -28,6 +28,7 @@ async def test_db():
                 yield session
 
         app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_session_factory] = lambda: TestSessionLocal
         yield TestSessionLocal
     finally:
         async with engine.begin() as conn:
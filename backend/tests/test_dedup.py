@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import get_session_factory
+from app.main import app
+from app.models import Document, DocumentSignature, document_bands
+from app.services.dedup import (
+    DuplicateService,
+    MinHasher,
+    _mulmod,
+    sign_documents,
+    similarity,
+)
+from app.services.search_service import SearchService
+
+REPORT = (
+    "Quarterly operations report. Revenue grew eleven percent on strong demand in the "
+    "northern region, while logistics costs fell after the warehouse consolidation. "
+    "The board approved the hiring plan for the support team and asked for a review "
+    "of supplier contracts before the end of the fiscal year. 季度报告显示收入增长。"
+)
+REVISED = REPORT.replace("eleven", "twelve").replace("board", "Board")
+MEMO = (
+    "Holiday schedule memo. The office closes on the last Friday of December and "
+    "reopens on the second of January; on-call rotations are listed in the wiki."
+)
+
+
+def test_mulmod_matches_python_integers():
+    rng = np.random.default_rng(3)
+    x = rng.integers(0, 2**32, size=(50, 1), dtype=np.uint64)
+    a = rng.integers(1, 2**61 - 1, size=8, dtype=np.uint64)
+    expected = [[int(xi) * int(ai) % (2**61 - 1) for ai in a] for xi in x[:, 0]]
+    assert _mulmod(x, a).tolist() == expected
+
+
+def test_signatures_estimate_jaccard_similarity():
+    hasher = MinHasher(num_perm=256, bands=32, shingle_size=5)
+    report, revised, memo = (hasher.signature(text) for text in (REPORT, REVISED, MEMO))
+    assert similarity(report, revised) > 0.9
+    assert similarity(report, memo) < 0.1
+    # Case and whitespace are normalized away
+    assert np.array_equal(hasher.signature("  " + REPORT.upper().replace(" ", "\n ")), report)
+    assert hasher.signature(" \n") is None
+    assert hasher.buckets(report) == hasher.buckets(report.copy())
+    assert len(hasher.buckets(report)) == 32
+
+    with pytest.raises(ValueError):
+        MinHasher(num_perm=100, bands=16, shingle_size=5)
+
+
+@pytest.fixture
+def search(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="numpy")
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    yield service
+    service.close()
+
+
+async def _upload(client: AsyncClient, name: str, text: str) -> dict:
+    response = await client.post(
+        "/api/documents", files={"file": (name, text.encode(), "text/markdown")}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_renamed_reupload_is_reported(
+    client: AsyncClient, test_db, search, monkeypatch: pytest.MonkeyPatch
+):
+    original = await _upload(client, "q3-report.md", REPORT)
+    assert original["duplicates"] == []
+    await _upload(client, "memo.md", MEMO)
+
+    # Signing the upload already finds its matches; no second LSH lookup
+    with monkeypatch.context() as patch:
+        patch.setattr(DuplicateService, "find", None)
+        copy = await _upload(client, "Q3 report FINAL (2).md", REVISED)
+    assert [(d["id"], d["original_name"]) for d in copy["duplicates"]] == [
+        (original["id"], "q3-report.md")
+    ]
+    assert 0.8 <= copy["duplicates"][0]["similarity"] < 1
+
+    response = await client.get(f"/api/documents/{original['id']}/duplicates")
+    assert response.status_code == 200
+    assert [d["id"] for d in response.json()] == [copy["id"]]
+    response = await client.get("/api/documents/999/duplicates")
+    assert response.status_code == 404
+
+    # Deleting a copy drops it from the LSH index
+    assert (await client.delete(f"/api/documents/{copy['id']}")).status_code == 200
+    response = await client.get(f"/api/documents/{original['id']}/duplicates")
+    assert response.json() == []
+    async with test_db() as session:
+        ids = await session.scalars(select(document_bands.c.document_id).distinct())
+        assert sorted(ids) == sorted([original["id"], original["id"] + 1])
+
+
+@pytest.mark.asyncio
+async def test_search_collapses_duplicates(client: AsyncClient, test_db, search):
+    first = await _upload(client, "a.md", REPORT)
+    second = await _upload(client, "b.md", REVISED)
+    third = await _upload(client, "c.md", REPORT + " Appendix: supplier contracts list.")
+    memo = await _upload(client, "memo.md", MEMO + " See the supplier contracts report.")
+
+    params = {"q": "supplier contracts"}
+    response = await client.get("/api/search", params=params)
+    assert len(response.json()["items"]) == 4
+
+    response = await client.get("/api/search", params={**params, "collapse_duplicates": True})
+    body = response.json()
+    assert body["total"] == 4
+    items = {item["doc_id"]: item["duplicates"] for item in body["items"]}
+    assert items.pop(memo["id"]) is None
+    [(kept, folded)] = items.items()
+    assert sorted([kept, *folded]) == [first["id"], second["id"], third["id"]]
+
+
+@pytest.mark.asyncio
+async def test_only_collapsing_searches_open_a_session(
+    client: AsyncClient, test_db, search, monkeypatch: pytest.MonkeyPatch
+):
+    await _upload(client, "a.md", REPORT)
+    await _upload(client, "b.md", REVISED)
+
+    opened = []
+
+    def counting_factory():
+        opened.append(True)
+        return test_db()
+
+    monkeypatch.setitem(app.dependency_overrides, get_session_factory, lambda: counting_factory)
+    response = await client.get("/api/search", params={"q": "supplier"})
+    assert response.status_code == 200 and opened == []
+
+    params = {"q": "supplier", "collapse_duplicates": True}
+    response = await client.get("/api/search", params=params)
+    assert len(response.json()["items"]) == 1
+    assert opened == [True]
+
+
+@pytest.mark.asyncio
+async def test_unsigned_documents_are_not_collapsed(test_db):
+    async with test_db() as session:
+        service = DuplicateService(session)
+        items = [{"doc_id": 1}, {"doc_id": 2}]
+        assert await service.collapse(items) == items
+        assert await service.index_document(1, "") == []
+        assert await session.scalar(select(func.count()).select_from(DocumentSignature)) == 0
+
+
+@pytest.mark.asyncio
+async def test_backfill_signs_existing_documents(test_db):
+    async with test_db() as session:
+        for i, text in enumerate([REPORT, REVISED, MEMO, ""]):
+            session.add(
+                Document(
+                    filename=f"{i}",
+                    original_name=f"{i}.md",
+                    content_text=text,
+                    file_type="md",
+                    file_size=1,
+                )
+            )
+        await session.commit()
+
+    assert await sign_documents(test_db, chunk_size=2) == 4
+    assert await sign_documents(test_db) == 1  # the empty document stays unsigned
+    async with test_db() as session:
+        assert [m.document_id for m in await DuplicateService(session).find(1)] == [2]
+    assert await sign_documents(test_db, fresh=True) == 4
@@ -294,7 +294,7 @@ async def test_document_service_save_and_delete_document(
 
     async with test_db() as session:
         service = DocumentService(session)
-        document = await service.save_document("nested/orig.MD", b"Hi", "MD")
+        document, _ = await service.save_document("nested/orig.MD", b"Hi", "MD")
         assert document.id is not None
         assert document.original_name == "orig.MD"
         assert document.file_type == "md"
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.services.embeddings as embeddings_module
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import Base
+from app.services.document_service import DocumentService
+from app.services.embeddings import (
+    LSA_DIR,
+    EmbeddingIndex,
+    LsaBuilder,
+    SparseRows,
+    build_embeddings,
+    truncated_svd,
+)
+from app.services.search_service import SearchService
+
+CARS = [
+    "car automobile road driver",
+    "automobile vehicle road wheel",
+    "car vehicle driver wheel",
+    "engine car automobile wheel",
+    "vehicle road driver car",
+]
+WEB = [
+    "search engine index query",
+    "web search query page",
+    "engine index web crawler",
+    "search engine engine query ranking",
+    "web page crawler index",
+]
+
+
+@pytest.fixture
+def service(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="whoosh", shards=1)
+    for doc_id, text in enumerate(CARS + WEB, start=1):
+        service.index_document(doc_id, text, "md", None, [], datetime(2024, 1, 1))
+    yield service
+    service.close()
+
+
+def _build(service: SearchService, dims: int = 2) -> dict:
+    builder = LsaBuilder(dims=dims)
+    builder.add(enumerate(CARS + WEB, start=1))
+    return builder.finish(service.index_dir / LSA_DIR)
+
+
+def _ids(service: SearchService, query: str, **kwargs) -> list:
+    return [item["doc_id"] for item in service.search(query, **kwargs)[0]]
+
+
+def test_truncated_svd_matches_a_dense_svd():
+    rng = np.random.default_rng(1)
+    dense = rng.random((40, 30)) * (rng.random((40, 30)) < 0.3)
+    rows, cols = np.nonzero(dense)
+    basis, singular = truncated_svd(SparseRows(rows, cols, dense[rows, cols], dense.shape), 5)
+    _, expected, vt = np.linalg.svd(dense)
+    assert singular == pytest.approx(expected[:5], rel=1e-4)
+    # Singular vectors are unique up to sign
+    assert np.abs(np.sum(basis * vt[:5].T, axis=0)) == pytest.approx(np.ones(5), rel=1e-2)
+
+
+def test_hybrid_ranking_lifts_related_documents(service: SearchService):
+    # Until embeddings are built hybrid ranking is BM25 alone
+    assert _ids(service, "engine OR vehicle", hybrid=True) == _ids(service, "engine OR vehicle")
+
+    meta = _build(service)
+    assert meta["dims"] == 2 and meta["documents"] == 10
+    plain = _ids(service, "engine OR vehicle")
+    hybrid, total = service.search("engine OR vehicle", hybrid=True)
+    assert total == len(plain) == 7
+    ranked = [item["doc_id"] for item in hybrid]
+    assert sorted(ranked) == sorted(plain)
+    # Doc 4 mentions a car engine, never a vehicle, yet ranks with the car documents
+    assert ranked.index(4) < min(ranked.index(6), ranked.index(8))
+    assert plain.index(4) > plain.index(6)
+    assert all(0 <= item["score"] <= 1 for item in hybrid)
+    assert _ids(service, "engine OR vehicle", hybrid=True, skip=2, limit=2) == ranked[2:4]
+
+    with pytest.raises(ValueError):
+        service.search("engine", hybrid=True, sort="-created_at")
+
+
+def test_new_documents_are_folded_in(service: SearchService):
+    _build(service)
+    service.index_document(11, "automobile driver road", "md", None, [], datetime(2024, 1, 1))
+    assert service.embeddings.stats() == {
+        "dims": 2, "terms": 13, "rows": 11, "segment": 0, "documents": 11
+    }
+
+    # Another process sees the appended rows
+    other = EmbeddingIndex(service.index_dir / LSA_DIR)
+    model = other._current()
+    expected = other.embed(["automobile driver road"])[0]
+    assert model.vectors[model.rows[11]] == pytest.approx(expected)
+    assert float(other.embed(["automobile"])[0] @ other.embed(["car road"])[0]) > 0.9
+    assert float(other.embed(["automobile"])[0] @ other.embed(["web query"])[0]) < 0.5
+
+    # A reindexed document gets a new row that replaces the old one
+    service.index_document(11, "web crawler", "md", None, [], datetime(2024, 1, 1))
+    assert other.stats()["rows"] == 12 and other.stats()["documents"] == 11
+    model = other._current()
+    assert model.vectors[model.rows[11]] == pytest.approx(other.embed(["web crawler"])[0])
+
+
+@pytest_asyncio.fixture
+async def sessions(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'app.db'}"
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="numpy")
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    yield async_sessionmaker(engine, expire_on_commit=False), service
+    service.close()
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_build_embeddings_from_the_database(sessions):
+    factory, service = sessions
+    async with factory() as session:
+        documents = DocumentService(session)
+        for i, text in enumerate(CARS + WEB):
+            await documents.save_document(f"{i}.md", text.encode(), "md")
+
+    meta = await build_embeddings(factory, service.index_dir / LSA_DIR, dims=3, chunk_size=4)
+    assert meta["documents"] == 10 and meta["dims"] == 3
+
+    async with factory() as session:
+        await DocumentService(session).save_document("new.md", b"car wheel", "md")
+    assert service.embeddings.stats()["documents"] == 11
+    assert len(service.search("car OR wheel", hybrid=True)[0]) == 6
+
+
+@pytest.mark.asyncio
+async def test_search_api_hybrid(client: AsyncClient, service: SearchService, monkeypatch):
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    _build(service)
+
+    response = await client.get("/api/search", params={"q": "engine", "hybrid": "true"})
+    assert response.status_code == 200
+    assert {item["doc_id"] for item in response.json()["items"]} == {4, 6, 8, 9}
+
+    response = await client.get(
+        "/api/search", params={"q": "engine", "hybrid": "true", "sort": "doc_id"}
+    )
+    assert response.status_code == 400
+
+
+def test_extending_leaves_the_previous_model_intact(service: SearchService):
+    _build(service)
+    index = EmbeddingIndex(service.index_dir / LSA_DIR)
+    before = index._current()
+    service.index_document(11, "automobile driver road", "md", None, [], datetime(2024, 1, 1))
+    after = index._current()
+    assert after is not before and 11 in after.rows
+    # A re-rank still holding the old model never sees rows past its vectors
+    assert 11 not in before.rows
+    assert max(before.rows.values()) < len(before.vectors)
+
+
+def test_unchanged_text_is_not_folded_in_again(service: SearchService):
+    _build(service)
+    # A tag change reindexes the document with the same text
+    service.index_document(4, CARS[3], "md", None, [7], datetime(2024, 1, 1))
+    assert service.embeddings.stats()["rows"] == 10
+    service.index_document(4, "web query", "md", None, [7], datetime(2024, 1, 1))
+    assert service.embeddings.stats()["rows"] == 11
+
+
+def test_replaced_rows_are_compacted(service: SearchService, monkeypatch):
+    monkeypatch.setattr(embeddings_module, "_COMPACT_MIN_DEAD", 1)
+    _build(service)
+    reader = EmbeddingIndex(service.index_dir / LSA_DIR)
+    old = reader._current()
+    for round_ in range(12):
+        text = "web query" if round_ % 2 else "car road"
+        service.index_document(1, text, "md", None, [], datetime(2024, 1, 1))
+    stats = service.embeddings.stats()
+    assert stats["documents"] == 10 and stats["segment"] >= 1
+    assert stats["rows"] < 20
+    model = reader._current()
+    assert model.vectors[model.rows[1]] == pytest.approx(reader.embed(["web query"])[0])
+    # The old model still reads its unlinked segment
+    assert old.vectors[old.rows[2]] == pytest.approx(model.vectors[model.rows[2]])
+
+
+def test_uncommitted_rows_stay_invisible(service: SearchService):
+    _build(service)
+    path = service.index_dir / LSA_DIR
+    # An append that died before committing rows.json
+    with open(path / "doc_ids.0.i64", "ab") as f:
+        f.write(np.asarray([99], dtype=np.int64).tobytes())
+    reader = EmbeddingIndex(path)
+    assert 99 not in reader._current().rows
+    service.index_document(11, "automobile", "md", None, [], datetime(2024, 1, 1))
+    model = reader._current()
+    assert 99 not in model.rows and model.rows[11] == 10
+    assert (path / "doc_ids.0.i64").stat().st_size == 11 * 8
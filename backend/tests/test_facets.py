@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import random
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.services.search_backend import format_facets
+from app.services.search_service import SearchService
+
+WORDS = ["自然语言处理", "机器学习", "文档", "搜索", "hello", "world", "python", "数据"]
+
+
+def _corpus(count: int = 60):
+    rng = random.Random(3)
+    docs = []
+    for doc_id in range(1, count + 1):
+        docs.append(
+            dict(
+                doc_id=doc_id,
+                content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))),
+                file_type=rng.choice(["md", "pdf", "docx"]),
+                folder_id=rng.choice([None, 1, 2, 3]),
+                tag_ids=rng.sample([1, 2, 3, 4], rng.randint(0, 3)),
+                created_at=datetime(rng.choice([2022, 2023, 2024]), rng.randint(1, 12), 1),
+            )
+        )
+    return docs
+
+
+def _expected(service: SearchService, query: str, docs, **filters) -> dict:
+    matched = {item["doc_id"] for item in service.execute(query, limit=1000, **filters).items}
+    counts = {name: Counter() for name in ("file_type", "folder_id", "tag_ids", "year")}
+    for doc in docs:
+        if doc["doc_id"] not in matched:
+            continue
+        counts["file_type"][doc["file_type"]] += 1
+        counts["folder_id"][doc["folder_id"]] += 1
+        counts["tag_ids"].update(doc["tag_ids"])
+        counts["year"][doc["created_at"].year] += 1
+    return format_facets(counts)
+
+
+@pytest.mark.parametrize("backend, shards", [("whoosh", 1), ("whoosh", 3), ("numpy", 1)])
+@pytest.mark.parametrize(
+    "query, filters",
+    [
+        ("hello", {}),
+        ("机器学习 OR python", {"file_type": "md"}),
+        ("NOT 数据", {"tag_ids": [2, 3]}),
+        ("*", {"folder_id": 1, "date_from": datetime(2023, 1, 1)}),
+        ("不存在", {}),
+    ],
+)
+def test_facets_count_every_match(tmp_path: Path, backend, shards, query, filters):
+    docs = _corpus()
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend, shards=shards)
+    service.apply_batch({doc["doc_id"]: SearchService.document_fields(**doc) for doc in docs})
+
+    result = service.execute(query, limit=3, facets=True, **filters)
+    assert result.facets == _expected(service, query, docs, **filters)
+    assert len(result.items) == min(3, result.total)
+    assert service.execute(query, limit=3, **filters).facets is None
+    service.close()
+
+
+def test_format_facets_orders_by_count():
+    facets = format_facets({"file_type": {"md": 1, "pdf": 3, "": 2}, "folder_id": {None: 4}})
+    assert list(facets["file_type"].items()) == [("pdf", 3), ("md", 1)]
+    assert facets["folder_id"] == {} and facets["year"] == {}
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import Base
+from app.services.document_service import DocumentService
+from app.services.folder_service import FolderService
+from app.services.search_service import SearchService
+from app.services.tag_service import TagService
+
+
+@pytest_asyncio.fixture(params=["whoosh", "numpy", "sqlite"])
+async def env(request, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'app.db'}"
+    monkeypatch.setattr(settings, "DATABASE_URL", url)
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=request.param)
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    yield async_sessionmaker(engine, expire_on_commit=False), service
+    service.close()
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_folder_filter_covers_the_subtree(env):
+    sessions, search = env
+    async with sessions() as session:
+        folders = FolderService(session)
+        root = await folders.create_folder("root")
+        child = await folders.create_folder("child", parent_id=root.id)
+        grand = await folders.create_folder("grand", parent_id=child.id)
+
+        documents = DocumentService(session)
+        in_root, _ = await documents.save_document("a.md", b"report alpha", "md", root.id)
+        in_child, _ = await documents.save_document("b.md", b"report beta", "md", child.id)
+        in_grand, _ = await documents.save_document("c.md", b"report gamma", "md", grand.id)
+        await documents.save_document("d.md", b"report delta", "md")
+        tag = await TagService(session).create_tag("kept")
+        await TagService(session).add_tag_to_document(in_grand.id, tag.id)
+
+        def found(**filters) -> set:
+            items, _ = search.search("report", **filters)
+            return {item["doc_id"] for item in items}
+
+        assert found(folder_id=root.id) == {in_root.id, in_child.id, in_grand.id}
+        assert found(folder_id=child.id) == {in_child.id, in_grand.id}
+        assert found(folder_id=root.id, include_subfolders=False) == {in_root.id}
+        assert found(folder_id=grand.id, tag_ids=[tag.id]) == {in_grand.id}
+
+        # The grandchild moves up under root; the child's own documents to the top
+        await folders.delete_folder(child.id)
+        assert found(folder_id=root.id) == {in_root.id, in_grand.id}
+        assert found(folder_id=root.id, tag_ids=[tag.id]) == {in_grand.id}
+        assert found(folder_id=child.id) == set()
+
+        await documents.move_document(in_root.id, grand.id)
+        assert found(folder_id=grand.id) == {in_root.id, in_grand.id}
+        assert found(folder_id=root.id, include_subfolders=False) == set()
+
+        search.merge_segments(optimize=True)
+        assert found(folder_id=root.id) == {in_root.id, in_grand.id}
+
+
+def test_document_fields_default_to_the_folder_alone():
+    when = datetime(2024, 1, 1)
+    fields = SearchService.document_fields(1, "x", "md", 7, [], when)
+    assert fields["folder_path"] == "7"
+    assert SearchService.document_fields(1, "x", "md", 7, [], when, [2, 7])["folder_path"] == "2,7"
+    assert SearchService.document_fields(1, "x", "md", None, [], when)["folder_path"] == ""
+
+
+def test_segments_without_folder_paths_match_the_folder_itself(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="numpy")
+    service.index_document(1, "report", "md", 3, [], datetime(2024, 1, 1), [1, 3])
+    service.close()
+    for path in (tmp_path / "idx").rglob("path_*.npy"):
+        path.unlink()
+
+    reopened = SearchService(index_dir=str(tmp_path / "idx"), backend="numpy")
+    assert reopened.search("report", folder_id=3)[1] == 1
+    assert reopened.search("report", folder_id=1)[1] == 0
+    reopened.close()
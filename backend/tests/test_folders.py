@@ -815,10 +815,12 @@ async def test_document_service_save_and_delete_document(
         return "Parsed text", False
 
     class ExplodingSearchService:
-        def index_document(self, *args, **kwargs):
+        transactional = False
+
+        async def aindex_document(self, *args, **kwargs):
             raise RuntimeError("boom")
 
-        def remove_document(self, *args, **kwargs):
+        async def aremove_document(self, *args, **kwargs):
             raise RuntimeError("boom")
 
     monkeypatch.setattr(document_service_module.DocumentParser, "parse", dummy_parse)
@@ -828,7 +830,7 @@ async def test_document_service_save_and_delete_document(
 
     async with test_db() as session:
         service = DocumentService(session)
-        document = await service.save_document("nested/orig.MD", b"Hi", "MD")
+        document, _ = await service.save_document("nested/orig.MD", b"Hi", "MD")
         assert document.id is not None
         assert document.original_name == "orig.MD"
         assert document.file_type == "md"
@@ -876,13 +878,14 @@ def test_jieba_tokenizer_skips_blank_tokens(monkeypatch: pytest.MonkeyPatch):
 
     monkeypatch.setattr(
         search_service_module.jieba,
-        "cut_for_search",
-        lambda _text: [" ", "hello"],
+        "tokenize",
+        lambda _text, mode="default": [(" ", 0, 1), ("hello", 1, 6)],
     )
 
     tokenizer = search_service_module.JiebaTokenizer()
-    tokens = list(tokenizer("ignored"))
+    tokens = list(tokenizer("ignored", chars=True))
     assert [token.text for token in tokens] == ["hello"]
+    assert (tokens[0].startchar, tokens[0].endchar) == (1, 6)
 
 
 def test_search_service_backend_disabled(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
@@ -924,8 +927,8 @@ async def test_search_service_search_and_remove(search_service: SearchService):
         created_at=now - timedelta(days=2),
     )
 
-    search_service._ix = None
-    _ = search_service.ix
+    search_service.backend._ix = None
+    _ = search_service.backend.ix
 
     items, total = search_service.search(
         query="hello",
@@ -989,6 +992,9 @@ async def test_search_api_backend_error_returns_503(
         def search(self, *args, **kwargs):
             raise RuntimeError("boom")
 
+        async def asearch(self, *args, **kwargs):
+            return self.search(*args, **kwargs)
+
     monkeypatch.setattr(search_router, "get_search_service", lambda: ExplodingSearchService())
     response = await client.get("/api/search", params={"q": "hello"})
     assert response.status_code == 503
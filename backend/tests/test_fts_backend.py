@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import random
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import Base
+from app.models import Document
+from app.services.document_service import DocumentService
+from app.services.folder_service import FolderService
+from app.services.fts_backend import TABLE, compile_query, sqlite_path
+from app.services.query_parser import QueryParser
+from app.services.search_service import SearchService
+from app.services.tag_service import TagService
+
+WORDS = ["自然语言处理", "机器学习", "文档", "搜索", "hello", "world", "python", "pythonic", "数据"]
+
+
+@pytest_asyncio.fixture
+async def fts(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'app.db'}"
+    monkeypatch.setattr(settings, "DATABASE_URL", url)
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="sqlite")
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    yield async_sessionmaker(engine, expire_on_commit=False), service
+    service.close()
+    await engine.dispose()
+
+
+def test_compile_query_expresses_negation_as_exclusion():
+    parse = QueryParser().parse
+    assert compile_query(parse("hello world")) == ('("hello" AND "world")', None)
+    assert compile_query(parse("hello NOT world")) == ('"hello"', '"world"')
+    assert compile_query(parse("NOT world")) == (None, '"world"')
+    assert compile_query(parse("hello OR NOT world")) == (None, '("world" NOT "hello")')
+    assert compile_query(parse("pyth* OR *")) == (None, None)
+    assert compile_query(parse("pyth*")) == ('"pyth" *', None)
+
+
+def test_sqlite_path_requires_a_database_file():
+    assert sqlite_path("sqlite+aiosqlite:///./doc_search.db") == Path("doc_search.db")
+    assert sqlite_path("sqlite+aiosqlite:///:memory:") is None
+    assert sqlite_path("postgresql+asyncpg://db/app") is None
+
+
+@pytest.mark.asyncio
+async def test_index_follows_document_transactions(fts):
+    sessions, search = fts
+    async with sessions() as session:
+        documents = DocumentService(session)
+        doc, _ = await documents.save_document("notes.md", "机器学习 notes".encode(), "md")
+        assert search.search("机器学习")[1] == 1
+
+        tags = TagService(session)
+        tag = await tags.create_tag("ml")
+        assert search.search("notes", tag_ids=[tag.id])[1] == 0
+        await tags.add_tag_to_document(doc.id, tag.id)
+        items, total = search.search("机器学习 notes", tag_ids=[tag.id])
+        assert total == 1
+        assert items[0]["highlight"] == "<mark>机器学习</mark> <mark>notes</mark>"
+
+        folder = await FolderService(session).create_folder("papers")
+        await documents.move_document(doc.id, folder.id)
+        items, total = search.search("notes", folder_id=folder.id, file_type="md")
+        assert total == 1 and items[0]["folder_id"] == folder.id
+
+        await documents.delete_document(doc.id)
+        assert search.search("notes")[1] == 0
+        assert search.segment_stats()["docs"] == 0
+
+    async with sessions() as session:
+        # A rolled-back save leaves neither the document nor its index row
+        orphan = Document(
+            filename="x.md", original_name="x.md", content_text="机器学习", file_type="md",
+            file_size=1,
+        )
+        session.add(orphan)
+        await session.flush()
+        await search.stage_document(session, orphan.id, orphan.content_text)
+        await session.rollback()
+    assert search.search("机器学习")[1] == 0
+    assert search.segment_stats()["docs"] == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, filters",
+    [
+        ("自然语言", {}),
+        ("hello world", {}),
+        ("hello OR python", {}),
+        ("机器学习 NOT 数据", {}),
+        ("NOT hello", {}),
+        ("hello OR NOT world", {}),
+        ("pyth*", {"file_type": "md"}),
+        ("文档 OR (hello AND world)", {"date_from": datetime(2024, 1, 5)}),
+        ("*", {"date_to": datetime(2024, 1, 9)}),
+        ('"hello world"', {}),
+        ('"机器学习 文档" OR "数据 自然语言处理"', {}),
+        ("不存在", {}),
+    ],
+)
+async def test_fts_backend_matches_numpy_backend(fts, tmp_path: Path, query, filters):
+    sessions, search = fts
+    rng = random.Random(5)
+    batch = {}
+    async with sessions() as session:
+        for doc_id in range(1, 41):
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+            created_at = datetime(2024, 1, 1 + doc_id % 28)
+            file_type = rng.choice(["md", "pdf"])
+            session.add(
+                Document(
+                    id=doc_id, filename=f"{doc_id}.md", original_name=f"{doc_id}.md",
+                    content_text=text, file_type=file_type, file_size=len(text),
+                    created_at=created_at,
+                )
+            )
+            batch[doc_id] = SearchService.document_fields(
+                doc_id, text, file_type, None, [], created_at
+            )
+        await session.commit()
+    search.apply_batch(batch)
+    reference = SearchService(index_dir=str(tmp_path / "numpy"), backend="numpy")
+    reference.apply_batch(batch)
+
+    expected = reference.execute(query, limit=50, **filters)
+    actual = search.execute(query, limit=50, **filters)
+    assert actual.total == expected.total
+    assert {item["doc_id"] for item in actual.items} == {
+        item["doc_id"] for item in expected.items
+    }
+    scores = [item["score"] for item in actual.items]
+    assert scores == sorted(scores, reverse=True)
+    reference.close()
+
+
+@pytest.mark.asyncio
+async def test_snippets_are_cut_from_stored_token_offsets(fts, tmp_path: Path):
+    sessions, search = fts
+    async with sessions() as session:
+        documents = DocumentService(session)
+        await documents.save_document("a.md", "Hello world, 自然语言处理 hello".encode(), "md")
+        await documents.save_document("b.md", ("x " * 300 + "needle" + " y" * 300).encode(), "md")
+
+    items, _ = search.search('"hello world"')
+    assert items[0]["highlight"] == "<mark>Hello</mark> <mark>world</mark>, 自然语言处理 hello"
+    items, _ = search.search("语言")
+    assert items[0]["highlight"] == "Hello world, 自然<mark>语言</mark>处理 hello"
+    items, _ = search.search("needle")
+    snippet = items[0]["highlight"]
+    assert snippet.startswith("... x x") and snippet.endswith("y y ...")
+    assert "<mark>needle</mark>" in snippet and len(snippet) < 250
+
+    # A table from before the offsets column is re-segmented on startup
+    search.close()
+    conn = sqlite3.connect(str(sqlite_path(settings.DATABASE_URL)))
+    with conn:
+        conn.execute(f"DROP TABLE {TABLE}")
+        conn.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(tokens)")
+    conn.close()
+    upgraded = SearchService(index_dir=str(tmp_path / "idx"), backend="sqlite")
+    items, total = upgraded.search("语言")
+    assert total == 1 and items[0]["highlight"] == "Hello world, 自然<mark>语言</mark>处理 hello"
+    upgraded.close()
+
+
+@pytest.mark.asyncio
+async def test_suggestions_read_the_fts5_vocabulary(fts):
+    sessions, search = fts
+    async with sessions() as session:
+        documents = DocumentService(session)
+        await documents.save_document("a.md", "Python 自然语言".encode(), "md")
+        assert search.suggest("pyth") == [{"term": "python", "df": 1}]
+        await documents.save_document("b.md", "python pythonic".encode(), "md")
+        assert search.suggest("pyth") == [
+            {"term": "python", "df": 2},
+            {"term": "pythonic", "df": 1},
+        ]
+        assert search.suggest("自然")[0]["term"] == "自然"
+
+
+@pytest.mark.asyncio
+async def test_facets_are_grouped_in_sql(fts):
+    sessions, search = fts
+    async with sessions() as session:
+        documents = DocumentService(session)
+        first, _ = await documents.save_document("a.md", b"facet one", "md")
+        await documents.save_document("b.md", b"facet two", "md")
+        await documents.save_document("c.md", b"other", "md")
+        tags = TagService(session)
+        tag = await tags.create_tag("x")
+        await tags.add_tag_to_document(first.id, tag.id)
+        folder = await FolderService(session).create_folder("f")
+        await documents.move_document(first.id, folder.id)
+
+    result = search.execute("facet", limit=1, facets=True)
+    assert result.total == 2 and len(result.items) == 1
+    year = str(first.created_at.year)
+    assert result.facets == {
+        "file_type": {"md": 2},
+        "folder_id": {str(folder.id): 1},
+        "tag_ids": {str(tag.id): 1},
+        "year": {year: 2},
+    }
+    assert search.execute("nothing", facets=True).facets["file_type"] == {}
+
+
+@pytest.mark.asyncio
+async def test_sorts_are_ordered_in_sql(fts):
+    sessions, search = fts
+    async with sessions() as session:
+        documents = DocumentService(session)
+        small, _ = await documents.save_document("a.md", b"sort sort sort", "md")
+        large, _ = await documents.save_document("b.md", b"sort " + b"x" * 50, "md")
+        old, _ = await documents.save_document("c.md", b"sort sort", "md")
+        old.created_at = datetime(2020, 1, 1)
+        await session.commit()
+
+    def ids(**kwargs) -> list:
+        return [item["doc_id"] for item in search.search("sort", **kwargs)[0]]
+
+    assert ids(sort="-file_size") == [large.id, small.id, old.id]
+    assert ids(sort="created_at") == [old.id, small.id, large.id]
+    assert ids(sort="-doc_id", limit=2) == [old.id, large.id]
+    assert ids(sort="recency")[-1] == old.id
+    items, _ = search.search("sort", sort="recency")
+    assert items[-1]["score"] < 1e-6
@@ -1,5 +1,6 @@
 import pytest
 
+import app.main as main_module
 from app.core.config import settings
 from app.main import app, lifespan
 
@@ -25,3 +26,47 @@ async def test_lifespan_creates_upload_dir(tmp_path, monkeypatch):
 
     async with lifespan(app):
         assert upload_dir.is_dir()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_warms_up_search_before_serving(tmp_path, monkeypatch):
+    calls = []
+
+    class FakeSearchService:
+        def warm_up(self, queries):
+            calls.append(list(queries))
+            return {"jieba": 1.0}
+
+        async def start_write_behind(self):
+            calls.append("write_behind")
+
+        def start_maintenance(self):
+            calls.append("maintenance")
+
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "SEARCH_WARMUP", True)
+    monkeypatch.setattr(settings, "SEARCH_WARMUP_QUERIES", ["hello"])
+    monkeypatch.setattr(main_module, "get_search_service", lambda: FakeSearchService())
+
+    async def no_shutdown():
+        return None
+
+    monkeypatch.setattr(main_module, "shutdown_search_service", no_shutdown)
+
+    async with lifespan(app):
+        assert calls[0] == ["hello"]
+
+
+@pytest.mark.asyncio
+async def test_lifespan_survives_warm_up_failure(tmp_path, monkeypatch):
+    class BrokenSearchService:
+        def warm_up(self, queries):
+            raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "INDEX_WRITE_BEHIND", False)
+    monkeypatch.setattr(settings, "INDEX_MAINTENANCE_ENABLED", False)
+    monkeypatch.setattr(main_module, "get_search_service", lambda: BrokenSearchService())
+
+    async with lifespan(app):
+        assert (tmp_path / "uploads").is_dir()
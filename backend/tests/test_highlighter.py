@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from app.services.highlighter import OffsetHighlighter, densest_windows, merge_spans
+
+
+def test_merge_spans_joins_overlapping_sub_words():
+    # jieba search mode yields 自然, 语言 and 自然语言 for the same text
+    assert merge_spans([(5, 7), (3, 5), (3, 7), (10, 12)]) == [(3, 7), (10, 12)]
+
+
+def test_densest_windows_prefers_clusters():
+    spans = [(0, 2), (50, 52), (55, 57), (60, 62), (300, 302)]
+    windows = densest_windows(spans, width=20, max_windows=2)
+    assert windows == [[(0, 2)], [(50, 52), (55, 57), (60, 62)]]
+
+
+def test_render_marks_only_the_window_around_matches():
+    text = "a" * 500 + "hello" + "b" * 500
+    highlighter = OffsetHighlighter(context_chars=10, max_fragments=2)
+    snippet = highlighter.render(text, [(500, 505)])
+    assert snippet == "..." + "a" * 7 + "<mark>hello</mark>" + "b" * 7 + "..."
+
+
+def test_render_builds_separate_fragments():
+    text = "hello " + "x" * 200 + " world " + "y" * 200
+    highlighter = OffsetHighlighter(context_chars=5, max_fragments=2)
+    snippet = highlighter.render(text, [(0, 5), (207, 212)])
+    assert snippet.startswith("<mark>hello</mark>")
+    assert snippet.count("...") == 2
+    assert "<mark>world</mark>" in snippet
+    assert highlighter.render(text, []) is None
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.services.index_maintenance import IndexMaintenance, in_window, parse_window
+from app.services.search_service import SearchService
+
+
+@pytest.fixture
+def search_service(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "search_index"))
+    yield service
+    service.close()
+
+
+def _add_segment(service: SearchService, doc_id: int) -> None:
+    writer = service.backend.ix.writer()
+    writer.update_document(
+        **service.document_fields(
+            doc_id, f"segment doc{doc_id}", "md", None, [], datetime(2024, 1, 1)
+        )
+    )
+    writer.commit(merge=False)
+
+
+def test_parse_and_check_quiet_window():
+    assert parse_window("") is None
+    assert in_window(None, datetime(2024, 1, 1, 12, 0))
+
+    window = parse_window("01:00-05:30")
+    assert in_window(window, datetime(2024, 1, 1, 3, 0))
+    assert not in_window(window, datetime(2024, 1, 1, 5, 30))
+
+    overnight = parse_window("22:00-04:00")
+    assert in_window(overnight, datetime(2024, 1, 1, 23, 0))
+    assert in_window(overnight, datetime(2024, 1, 1, 1, 0))
+    assert not in_window(overnight, datetime(2024, 1, 1, 12, 0))
+
+    with pytest.raises(ValueError):
+        parse_window("nightly")
+
+
+def test_plan_prefers_optimize_for_deleted_documents():
+    maintenance = IndexMaintenance(service=None, max_segments=3, max_deleted_ratio=0.2)
+    assert maintenance.plan({"segments": 2, "deleted_ratio": 0.0}) is None
+    assert maintenance.plan({"segments": 4, "deleted_ratio": 0.0}) == "merge"
+    assert maintenance.plan({"segments": 2, "deleted_ratio": 0.5}) == "optimize"
+    assert maintenance.plan({"segments": 1, "deleted_ratio": 0.5}) == "optimize"
+    assert maintenance.plan({"segments": 1, "deleted_ratio": 0.1}) is None
+
+
+@pytest.mark.asyncio
+async def test_run_once_merges_fragmented_index(search_service: SearchService):
+    for doc_id in range(1, 6):
+        _add_segment(search_service, doc_id)
+    assert search_service.segment_stats()["segments"] == 5
+
+    maintenance = IndexMaintenance(search_service, max_segments=3)
+    report = await maintenance.run_once()
+
+    assert report["action"] == "merge"
+    assert report["before"]["segments"] == 5
+    assert report["after"]["segments"] < 5
+    assert maintenance.stats()["last_run"] is report
+    assert search_service.search("segment", limit=10)[1] == 5
+
+
+@pytest.mark.asyncio
+async def test_run_once_optimizes_away_deletions_in_window(search_service: SearchService):
+    for doc_id in range(1, 5):
+        _add_segment(search_service, doc_id)
+    search_service.remove_document(1)
+    search_service.remove_document(2)
+
+    outside = IndexMaintenance(
+        search_service, window="01:00-02:00", clock=lambda: datetime(2024, 1, 1, 12, 0)
+    )
+    assert await outside.run_once() is None
+
+    inside = IndexMaintenance(
+        search_service, window="01:00-02:00", clock=lambda: datetime(2024, 1, 1, 1, 30)
+    )
+    report = await inside.run_once()
+    assert report["action"] == "optimize"
+    assert report["after"] == {**report["after"], "segments": 1, "deleted": 0}
+    assert search_service.search("segment", limit=10)[1] == 2
+
+
+@pytest.mark.asyncio
+async def test_run_once_optimizes_a_single_segment_with_deletions(
+    search_service: SearchService,
+):
+    search_service.apply_batch(
+        {
+            doc_id: search_service.document_fields(
+                doc_id, "segment text", "md", None, [], datetime(2024, 1, 1)
+            )
+            for doc_id in range(1, 5)
+        }
+    )
+    search_service.remove_document(1)
+    search_service.remove_document(2)
+    assert search_service.segment_stats()["segments"] == 1
+
+    report = await IndexMaintenance(search_service).run_once(force=True)
+    assert report["action"] == "optimize"
+    assert report["after"] == {**report["after"], "segments": 1, "deleted": 0}
+    assert search_service.search("segment", limit=10)[1] == 2
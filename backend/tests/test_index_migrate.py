@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import app.services.index_migrate as index_migrate_module
+import app.services.search_service as search_service_module
+from app.services.index_migrate import MigrationReport, migrate_index
+from app.services.search_service import SearchService
+
+
+def _legacy_index(index_dir: Path) -> None:
+    index_dir.mkdir(parents=True)
+    search_service_module.index.create_in(
+        str(index_dir), search_service_module.build_schema(store_content=True)
+    )
+    service = SearchService(index_dir=str(index_dir))
+    for doc_id in range(1, 6):
+        service.index_document(
+            doc_id=doc_id,
+            content=f"迁移文档 doc{doc_id} " + "正文内容" * 500,
+            file_type="md",
+            folder_id=None,
+            tag_ids=[1] if doc_id == 2 else [],
+            created_at=datetime(2024, 1, doc_id),
+        )
+    service.remove_document(5)
+    assert service.backend.stores_content is True
+    service.close()
+
+
+def test_migrate_moves_content_into_text_store(tmp_path: Path):
+    index_dir = tmp_path / "search_index"
+    _legacy_index(index_dir)
+
+    report = migrate_index(str(index_dir), batch_size=2, optimize=True)
+
+    assert report.migrated == 4
+    assert report.index_bytes_after < report.index_bytes_before
+    assert report.text_store_bytes > 0
+    assert not index_dir.with_name("search_index.migrate").exists()
+
+    service = SearchService(index_dir=str(index_dir))
+    assert service.backend.stores_content is False
+    items, total = service.search("迁移文档", limit=10)
+    assert total == 4
+    assert "<mark>迁移文档</mark>" in items[0]["highlight"]
+    assert [item["doc_id"] for item in service.search("迁移文档", tag_ids=[1])[0]] == [2]
+    assert service.backend.text_store.stats()["docs"] == 4
+    service.close()
+
+    assert migrate_index(str(index_dir)) is None
+
+
+def test_migrate_cli_reports_sizes(monkeypatch: pytest.MonkeyPatch, capsys):
+    captured = {}
+
+    def fake_migrate(**kwargs):
+        captured.update(kwargs)
+        return MigrationReport(
+            migrated=3,
+            index_bytes_before=1000,
+            index_bytes_after=400,
+            text_store_bytes=300,
+            elapsed=1.0,
+        )
+
+    monkeypatch.setattr(index_migrate_module, "migrate_index", fake_migrate)
+    index_migrate_module.main(["--index-dir", "idx", "--optimize"])
+
+    assert captured == {"index_dir": "idx", "batch_size": 1000, "optimize": True, "swap": True}
+    out = capsys.readouterr().out
+    assert "1000 -> 400 bytes (60% smaller)" in out
+    assert "text store 300 bytes" in out
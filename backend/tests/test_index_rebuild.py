@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import insert
+
+import app.services.index_rebuild as index_rebuild_module
+from app.models import Document, Tag
+from app.models.document import document_tags
+from app.services.embeddings import LSA_DIR, build_embeddings
+from app.services.index_rebuild import STATE_FILE, IndexRebuilder
+from app.services.search_service import SearchService
+
+
+async def _seed_documents(session_factory, count: int) -> None:
+    async with session_factory() as session:
+        tag = Tag(name="finance")
+        session.add(tag)
+        for i in range(1, count + 1):
+            session.add(
+                Document(
+                    filename=f"{i}.md",
+                    original_name=f"{i}.md",
+                    content_text=f"rebuild doc{i}",
+                    file_type="md",
+                    file_size=10,
+                    folder_id=None,
+                    created_at=datetime(2024, 1, 1),
+                )
+            )
+        await session.commit()
+        await session.execute(insert(document_tags).values(document_id=2, tag_id=tag.id))
+        await session.commit()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("procs", [1, 2])
+async def test_rebuild_replaces_live_index(test_db, tmp_path: Path, procs: int):
+    await _seed_documents(test_db, 7)
+    index_dir = tmp_path / "search_index"
+
+    live = SearchService(index_dir=str(index_dir))
+    live.index_document(
+        doc_id=99,
+        content="stale rebuild entry",
+        file_type="md",
+        folder_id=None,
+        tag_ids=[],
+        created_at=datetime(2024, 1, 1),
+    )
+    assert live.search("rebuild")[1] == 1
+
+    rebuilder = IndexRebuilder(
+        session_factory=test_db,
+        index_dir=str(index_dir),
+        procs=procs,
+        chunk_size=3,
+        commit_every=3,
+    )
+    report = await rebuilder.run()
+
+    assert report.indexed == 7
+    assert report.swapped is True
+    assert report.docs_per_sec > 0
+    assert not rebuilder.build_dir.exists()
+    assert index_dir.is_symlink()
+    published = index_dir.resolve()
+
+    items, total = live.search("rebuild", limit=20)
+    assert total == 7
+    assert 99 not in {item["doc_id"] for item in items}
+    assert [item["doc_id"] for item in live.search("rebuild", tag_ids=[1])[0]] == [2]
+
+    # Later swaps replace the link in one step and drop the old version
+    await rebuilder.run()
+    assert index_dir.is_symlink() and index_dir.resolve() != published
+    assert not published.exists()
+    assert live.search("rebuild", limit=20)[1] == 7
+    live.close()
+
+
+@pytest.mark.asyncio
+async def test_journaled_ids_are_read_in_chunks(test_db, tmp_path: Path):
+    await _seed_documents(test_db, 7)
+    rebuilder = IndexRebuilder(
+        session_factory=test_db, index_dir=str(tmp_path / "search_index"), chunk_size=2
+    )
+    async with test_db() as session:
+        for doc_id in (3, 4):
+            await session.delete(await session.get(Document, doc_id))
+        await session.commit()
+
+    chunks = [
+        [fields["doc_id"] for fields in chunk]
+        async for chunk in rebuilder.iter_chunks(ids=[6, 1, 3, 40, 4, 2, 5])
+    ]
+    # The batch of deleted ids (3, 4) matches nothing and does not end the walk
+    assert chunks == [["1", "2"], ["5", "6"]]
+
+
+@pytest.mark.asyncio
+async def test_rebuild_keeps_the_embeddings(test_db, tmp_path: Path):
+    texts = [
+        "car automobile road driver",
+        "automobile vehicle road wheel",
+        "car vehicle driver wheel",
+        "engine car automobile wheel",
+        "vehicle road driver car",
+        "search engine index query",
+        "web search query page",
+        "engine index web crawler",
+        "search engine engine query ranking",
+        "web page crawler index",
+    ]
+    async with test_db() as session:
+        for i, text in enumerate(texts, start=1):
+            session.add(
+                Document(
+                    filename=f"{i}.md",
+                    original_name=f"{i}.md",
+                    content_text=text,
+                    file_type="md",
+                    file_size=10,
+                    created_at=datetime(2024, 1, 1),
+                )
+            )
+        await session.commit()
+    index_dir = tmp_path / "search_index"
+    await IndexRebuilder(session_factory=test_db, index_dir=str(index_dir), procs=1).run()
+    await build_embeddings(test_db, path=index_dir / LSA_DIR, dims=2)
+
+    def ranked(service: SearchService, **kwargs) -> list:
+        items = service.search("engine OR vehicle", **kwargs)[0]
+        return [(item["doc_id"], round(item["score"], 6)) for item in items]
+
+    live = SearchService(index_dir=str(index_dir))
+    hybrid = ranked(live, hybrid=True)
+    assert hybrid != ranked(live)
+
+    await IndexRebuilder(session_factory=test_db, index_dir=str(index_dir), procs=1).run()
+    assert (index_dir / LSA_DIR).is_dir()
+    reopened = SearchService(index_dir=str(index_dir))
+    assert reopened.embeddings.ready
+    assert ranked(reopened, hybrid=True) == hybrid
+    reopened.close()
+    live.close()
+
+
+@pytest.mark.asyncio
+async def test_rebuild_carries_over_writes_made_while_it_ran(
+    test_db, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    await _seed_documents(test_db, 6)
+    index_dir = tmp_path / "search_index"
+    live = SearchService(index_dir=str(index_dir))
+    rebuilder = IndexRebuilder(
+        session_factory=test_db, index_dir=str(index_dir), procs=1, chunk_size=2, commit_every=2
+    )
+
+    iter_chunks = IndexRebuilder.iter_chunks
+    edited = []
+
+    async def busy_app(self, *args, **kwargs):
+        async for chunk in iter_chunks(self, *args, **kwargs):
+            yield chunk
+            if edited:
+                continue
+            # The app edits and deletes documents the rebuild has already read
+            async with test_db() as session:
+                (await session.get(Document, 1)).content_text = "rebuild edited"
+                await session.delete(await session.get(Document, 3))
+                await session.commit()
+            created = datetime(2024, 1, 1)
+            live.index_document(1, "rebuild edited", "md", None, [], created)
+            live.remove_document(3)
+            edited.append(True)
+
+    monkeypatch.setattr(IndexRebuilder, "iter_chunks", busy_app)
+    await rebuilder.run()
+
+    assert [item["doc_id"] for item in live.search("edited")[0]] == [1]
+    items, total = live.search("rebuild", limit=20)
+    assert total == 5 and 3 not in {item["doc_id"] for item in items}
+    live.close()
+
+
+@pytest.mark.asyncio
+async def test_rebuild_resumes_after_interruption(
+    test_db, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    await _seed_documents(test_db, 6)
+    index_dir = tmp_path / "search_index"
+    rebuilder = IndexRebuilder(
+        session_factory=test_db, index_dir=str(index_dir), procs=1, chunk_size=2, commit_every=2
+    )
+
+    original_commit = IndexRebuilder._commit
+    commits = []
+
+    def interrupted_commit(self, ix, docs, replace):
+        if len(commits) == 2:
+            raise KeyboardInterrupt
+        commits.append([d["doc_id"] for d in docs])
+        original_commit(self, ix, docs, replace)
+
+    monkeypatch.setattr(IndexRebuilder, "_commit", interrupted_commit)
+    with pytest.raises(KeyboardInterrupt):
+        await rebuilder.run()
+    state = json.loads((rebuilder.build_dir / STATE_FILE).read_text())
+    assert state == {"last_id": 4, "indexed": 4}
+
+    monkeypatch.setattr(IndexRebuilder, "_commit", original_commit)
+    report = await rebuilder.run()
+    assert report.resumed_from == 4
+    assert report.indexed == 2
+
+    service = SearchService(index_dir=str(index_dir))
+    assert service.search("rebuild", limit=20)[1] == 6
+    service.close()
+
+
+def test_rebuild_cli_parses_arguments(monkeypatch: pytest.MonkeyPatch, capsys):
+    captured = {}
+
+    class FakeRebuilder:
+        def __init__(self, **kwargs):
+            captured["init"] = kwargs
+
+        async def run(self, **kwargs):
+            captured["run"] = kwargs
+            return index_rebuild_module.RebuildReport(
+                indexed=10, resumed_from=0, elapsed=2.0, swapped=True
+            )
+
+    monkeypatch.setattr(index_rebuild_module, "IndexRebuilder", FakeRebuilder)
+    index_rebuild_module.main(["--procs", "2", "--fresh", "--optimize"])
+
+    assert captured["init"] == {"procs": 2, "chunk_size": 500, "commit_every": 10000}
+    assert captured["run"] == {"fresh": True, "optimize": True, "swap": True}
+    assert "5.0 docs/sec" in capsys.readouterr().out
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import app.services.document_service as document_service_module
+from app.core.config import settings
+from app.services.document_service import DocumentService
+from app.services.index_server import IndexServer, IndexUnavailableError
+from app.services.search_service import SearchService
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path / "indexer.sock"
+    monkeypatch.setattr(settings, "INDEX_SOCKET", str(path))
+    return path
+
+
+@pytest.mark.asyncio
+async def test_workers_send_updates_to_the_indexer(tmp_path: Path, socket_path: Path):
+    index_dir = str(tmp_path / "search_index")
+    server = IndexServer(SearchService(index_dir=index_dir, writer="local"), str(socket_path))
+    await server.start()
+    workers = [SearchService(index_dir=index_dir, writer="remote") for _ in range(2)]
+    try:
+        await workers[0].start_write_behind()
+        workers[0].start_maintenance()
+        assert workers[0]._write_queue is None and workers[0]._maintenance is None
+
+        await asyncio.to_thread(
+            workers[0].index_document, 1, "shared update", "md", None, [], datetime(2024, 1, 1)
+        )
+        await asyncio.to_thread(
+            workers[1].index_document, 2, "shared second", "md", None, [], datetime(2024, 1, 2)
+        )
+        await workers[1].flush()
+
+        # Both read-only workers see the indexer's commits
+        for worker in workers:
+            assert worker.search("shared")[1] == 2
+        await asyncio.to_thread(workers[0].remove_document, 1)
+        await workers[0].flush()
+        assert workers[1].search("shared")[0][0]["doc_id"] == 2
+
+        stats = workers[0].stats()["index_writer"]
+        assert stats["mode"] == "remote" and stats["sent"] == 3
+        assert server.service.stats()["index_writer"]["committed_docs"] == 3
+    finally:
+        for worker in workers:
+            worker.close()
+        await server.stop()
+        server.service.close()
+    assert not socket_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_workers_wait_for_the_indexer_to_create_the_index(
+    tmp_path: Path, socket_path: Path
+):
+    index_dir = tmp_path / "search_index"
+    worker = SearchService(index_dir=str(index_dir), writer="remote", shards=2)
+    with pytest.raises(RuntimeError, match="does not exist yet"):
+        worker.search("anything")
+    assert not any(path.suffix == ".toc" for path in index_dir.rglob("*"))
+
+    server = IndexServer(
+        SearchService(index_dir=str(index_dir), writer="local", shards=2), str(socket_path)
+    )
+    await server.start()
+    try:
+        assert worker.search("anything") == ([], 0)
+    finally:
+        worker.close()
+        await server.stop()
+        server.service.close()
+
+
+def test_remote_writes_fail_loudly_without_an_indexer(tmp_path: Path, socket_path: Path):
+    worker = SearchService(index_dir=str(tmp_path / "search_index"), writer="remote")
+    with pytest.raises(IndexUnavailableError):
+        worker.remove_document(1)
+    assert worker.stats()["index_writer"]["failures"] == 1
+    worker.close()
+
+    with pytest.raises(ValueError):
+        SearchService(index_dir=str(tmp_path / "search_index"), writer="shared")
+
+
+@pytest.mark.asyncio
+async def test_document_service_logs_index_failures(
+    test_db,
+    tmp_path: Path,
+    socket_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    worker = SearchService(index_dir=str(tmp_path / "search_index"), writer="remote")
+    monkeypatch.setattr(document_service_module, "get_search_service", lambda: worker)
+
+    async with test_db() as session:
+        with caplog.at_level(logging.ERROR, logger=document_service_module.__name__):
+            document, _ = await DocumentService(session).save_document("a.md", b"text", "md")
+    assert document.id is not None
+    assert f"Failed to index document {document.id}" in caplog.text
+    assert "IndexUnavailableError" in caplog.text
+    worker.close()
+
+
+@pytest.mark.asyncio
+async def test_batches_are_one_request_and_never_block_the_loop(
+    tmp_path: Path, socket_path: Path
+):
+    index_dir = str(tmp_path / "search_index")
+    server = IndexServer(SearchService(index_dir=index_dir, writer="local"), str(socket_path))
+    await server.start()
+    worker = SearchService(index_dir=index_dir, writer="remote")
+    try:
+        fields = {
+            doc_id: worker.document_fields(doc_id, "batch", "md", None, [], datetime(2024, 1, 1))
+            for doc_id in range(1, 4)
+        }
+        await worker.asubmit_many(fields)
+        await worker.aremove_document(3)
+        await worker.flush()
+        assert worker.search("batch")[1] == 2
+        assert worker.stats()["index_writer"]["sent"] == 3
+    finally:
+        worker.close()
+        await server.stop()
+        server.service.close()
+
+    # An indexer that accepts but never answers stalls only the request
+    connections = []
+
+    async def stall(reader, writer):
+        connections.append(writer)
+        await reader.read()
+
+    stalled = await asyncio.start_unix_server(stall, path=str(socket_path))
+    worker = SearchService(index_dir=index_dir, writer="remote")
+    worker._client.timeout = 0.3
+    try:
+        update = asyncio.create_task(
+            worker.aindex_document(4, "late", "md", None, [], datetime(2024, 1, 1))
+        )
+        ticks = 0
+        while not update.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks > 10
+        with pytest.raises(IndexUnavailableError):
+            await update
+        # A timed-out update may still be in progress; it is not sent again
+        assert len(connections) == 1
+    finally:
+        worker.close()
+        stalled.close()
+        await stalled.wait_closed()
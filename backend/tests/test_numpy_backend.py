@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import json
+import random
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.core.config import settings
+from app.services.index_maintenance import IndexMaintenance
+from app.services.numpy_backend import NumpyBackend, Segment
+from app.services.query_parser import (
+    AndQ,
+    EveryQ,
+    NotQ,
+    OrQ,
+    PhraseQ,
+    PrefixQ,
+    QueryParser,
+    TermQ,
+)
+from app.services.search_service import SearchService
+
+WORDS = ["自然语言处理", "机器学习", "文档", "搜索", "hello", "world", "python", "pythonic", "数据"]
+
+
+def _corpus(count: int = 60) -> dict:
+    rng = random.Random(3)
+    batch = {}
+    for doc_id in range(1, count + 1):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))
+        batch[doc_id] = SearchService.document_fields(
+            doc_id,
+            text,
+            rng.choice(["md", "pdf"]),
+            rng.choice([None, 1, 2]),
+            rng.sample([1, 2, 3], rng.randint(0, 2)),
+            datetime(2024, 1, 1 + doc_id % 28),
+        )
+    return batch
+
+
+@pytest.fixture
+def numpy_service(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "search_index"), backend="numpy")
+    yield service
+    service.close()
+
+
+def _index(service: SearchService, doc_id: int, content: str, **fields) -> None:
+    service.index_document(
+        doc_id=doc_id,
+        content=content,
+        file_type=fields.get("file_type", "md"),
+        folder_id=fields.get("folder_id"),
+        tag_ids=fields.get("tag_ids", []),
+        created_at=fields.get("created_at", datetime(2024, 1, 1)),
+    )
+
+
+def test_query_parser_follows_whoosh_precedence():
+    parser = QueryParser()
+    assert parser.parse("a AND b OR c") == OrQ((AndQ((TermQ("a"), TermQ("b"))), TermQ("c")))
+    assert parser.parse("a OR b c") == AndQ((OrQ((TermQ("a"), TermQ("b"))), TermQ("c")))
+    assert parser.parse("hello NOT world") == AndQ((TermQ("hello"), NotQ(TermQ("world"))))
+    assert parser.parse("自然语言 语言") == AndQ(
+        (TermQ("自然"), TermQ("语言"), TermQ("自然语言"))
+    )
+    assert parser.parse("hel* OR") == AndQ((PrefixQ("hel"), TermQ("OR")))
+    assert parser.parse("*") == EveryQ()
+    assert parser.parse('"hello 自然语言"') == PhraseQ(
+        ("hello", "自然", "语言", "自然语言"), ("hello", "自然语言")
+    )
+    assert parser.parse('"自然语言"') == parser.parse("自然语言")
+
+
+@pytest.mark.parametrize(
+    "query, filters",
+    [
+        ("自然语言", {}),
+        ("hello world", {}),
+        ("hello OR python", {}),
+        ("机器学习 NOT 数据", {}),
+        ("pyth*", {}),
+        ("文档 OR (hello AND world)", {}),
+        ("hello", {"file_type": "md", "tag_ids": [1]}),
+        ("hello", {"folder_id": 1, "date_from": datetime(2024, 1, 5)}),
+        ('"hello world"', {}),
+        ('"机器学习 文档" OR "数据 自然语言处理"', {}),
+        ("不存在", {}),
+    ],
+)
+def test_numpy_backend_matches_whoosh(tmp_path: Path, query: str, filters: dict):
+    batch = _corpus()
+    whoosh = SearchService(index_dir=str(tmp_path / "whoosh"), backend="whoosh")
+    numpy = SearchService(index_dir=str(tmp_path / "numpy"), backend="numpy")
+    for service in (whoosh, numpy):
+        service.apply_batch(batch)
+
+    expected = whoosh.execute(query, limit=10, **filters)
+    actual = numpy.execute(query, limit=10, **filters)
+
+    assert actual.total == expected.total
+    assert [item["doc_id"] for item in actual.items] == [item["doc_id"] for item in expected.items]
+    for got, want in zip(actual.items, expected.items):
+        assert got["score"] == pytest.approx(want["score"])
+        assert got["highlight"] == want["highlight"]
+        assert (got["file_type"], got["folder_id"]) == (want["file_type"], want["folder_id"])
+    whoosh.close()
+    numpy.close()
+
+
+def test_numpy_backend_updates_and_removes(numpy_service: SearchService):
+    _index(numpy_service, 1, "first version", tag_ids=[1])
+    _index(numpy_service, 2, "other version")
+    _index(numpy_service, 1, "second edition", tag_ids=[2])
+
+    assert numpy_service.search("version")[1] == 1
+    items, total = numpy_service.search("edition", tag_ids=[2])
+    assert total == 1
+    assert items[0]["highlight"] == "second <mark>edition</mark>"
+
+    numpy_service.remove_document(2)
+    assert numpy_service.search("version")[1] == 0
+    assert numpy_service.backend.text_store.get(2) is None
+    stats = numpy_service.segment_stats()
+    assert stats["segments"] == 3
+    assert stats["deleted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_numpy_backend_merges_and_persists(tmp_path: Path, numpy_service: SearchService):
+    for doc_id in range(1, 6):
+        _index(numpy_service, doc_id, f"merge doc{doc_id}", folder_id=doc_id % 2 or None)
+    numpy_service.remove_document(3)
+    before = [item["doc_id"] for item in numpy_service.search("merge", limit=10)[0]]
+
+    maintenance = IndexMaintenance(numpy_service, max_segments=2, max_deleted_ratio=0.5)
+    report = await maintenance.run_once(force=True)
+    assert report["action"] == "merge"
+    assert numpy_service.segment_stats()["segments"] == 2
+
+    numpy_service.merge_segments(optimize=True)
+    stats = numpy_service.segment_stats()
+    assert (stats["segments"], stats["docs"], stats["deleted"]) == (1, 4, 0)
+    merged = numpy_service.search("merge", limit=10)
+    assert [item["doc_id"] for item in merged[0]] == before
+    assert numpy_service.search("merge", folder_id=1)[1] == 2
+
+    reopened = SearchService(index_dir=str(tmp_path / "search_index"), backend="numpy")
+    assert reopened.search("merge", limit=10) == merged
+    reopened.close()
+
+
+def test_superseded_files_outlive_the_grace_period(
+    tmp_path: Path, numpy_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    index_dir = tmp_path / "search_index" / NumpyBackend.SUBDIR
+    for doc_id in range(1, 4):
+        _index(numpy_service, doc_id, f"grace doc{doc_id}")
+    numpy_service.remove_document(2)
+    stale = json.loads((index_dir / "manifest.json").read_text())
+
+    numpy_service.merge_segments(optimize=True)
+    # A worker that read the old manifest just before the merge can still open it
+    for entry in stale["segments"]:
+        Segment(index_dir / entry["name"])
+        assert entry["deleted"] is None or (index_dir / entry["deleted"]).exists()
+    retired = json.loads((index_dir / "manifest.json").read_text())["retired"]
+    assert {entry["name"] for entry in stale["segments"]} <= set(retired)
+
+    monkeypatch.setattr(settings, "INDEX_FILE_GRACE", 0.0)
+    _index(numpy_service, 4, "grace doc4")
+    assert json.loads((index_dir / "manifest.json").read_text())["retired"] == {}
+    assert not any((index_dir / name).exists() for name in retired)
+    assert numpy_service.search("grace")[1] == 3
+
+
+def test_numpy_backend_sees_commits_from_another_process(
+    tmp_path: Path, numpy_service: SearchService
+):
+    reader = SearchService(index_dir=str(tmp_path / "search_index"), backend="numpy")
+    assert reader.search("shared")[1] == 0
+
+    _index(numpy_service, 1, "shared text")
+    assert reader.search("shared")[1] == 1
+    reader.close()
+
+
+def test_search_backend_is_selected_by_settings(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "numpy")
+    service = SearchService(index_dir=str(tmp_path / "idx"))
+    assert service.backend.name == "numpy"
+    assert service.stats()["backend"] == "numpy"
+    service.close()
+
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "lucene")
+    with pytest.raises(ValueError):
+        SearchService(index_dir=str(tmp_path / "idx"))
+
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import asyncio
 import io
+import threading
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -19,6 +21,7 @@ from app.core.database import get_db
 from app.main import app, lifespan
 from app.services.document_service import DocumentService
 from app.services.parser import DocumentParser
+from app.services.search_executor import SearchExecutor, SearchQueueFullError
 from app.services.search_service import SearchService
 
 
@@ -155,10 +158,11 @@ def index_dir(tmp_path: Path) -> Path:
 
 
 @pytest.fixture
-def search_service(index_dir: Path, monkeypatch: pytest.MonkeyPatch) -> SearchService:
+def search_service(index_dir: Path, monkeypatch: pytest.MonkeyPatch):
     service = SearchService(index_dir=str(index_dir))
     monkeypatch.setattr(search_service_module, "_search_service", service)
-    return service
+    yield service
+    service.close()
 
 
 @pytest.fixture
@@ -242,6 +246,42 @@ def test_highlight(search_service: SearchService):
     assert "<mark>hello</mark>" in highlighted
 
 
+def test_search_highlights_from_stored_offsets(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    content = "开头" + "无关内容" * 100 + "我喜欢自然语言处理" + "其他文字" * 100 + "自然语言"
+    _index_document(search_service, doc_id=1, content=content)
+
+    def fail_highlight(*_args, **_kwargs):
+        raise AssertionError("offset highlighter should not fall back")
+
+    monkeypatch.setattr(search_service_module, "highlight_snippet", fail_highlight)
+    items, _ = search_service.search("自然语言")
+    highlighted = items[0]["highlight"]
+
+    assert "<mark>自然语言</mark>" in highlighted
+    assert highlighted.startswith("...")
+    assert highlighted.count("<mark>") == 2
+    assert len(highlighted) < len(content)
+
+
+def test_content_lives_in_text_store_not_index(search_service: SearchService):
+    content = "索引之外的正文 " * 200 + "目标词"
+    _index_document(search_service, doc_id=1, content=content)
+
+    assert search_service.backend.stores_content is False
+    with search_service.backend.ix.searcher() as searcher:
+        assert "content" not in searcher.stored_fields(0)
+    assert str(search_service.backend.text_store.get(1)) == content
+
+    items, _ = search_service.search("目标词")
+    assert "<mark>目标词</mark>" in items[0]["highlight"]
+
+    search_service.remove_document(1)
+    assert search_service.backend.text_store.get(1) is None
+    assert search_service.stats()["text_store"]["docs"] == 0
+
+
 def test_filter_by_type(search_service: SearchService):
     _index_document(
         search_service,
@@ -282,6 +322,335 @@ def test_filter_by_folder(search_service: SearchService):
     assert items[0]["folder_id"] == 1
 
 
+def test_filter_by_tags_and_date_range(search_service: SearchService):
+    now = datetime(2024, 6, 15, 12, 0, 0)
+    _index_document(search_service, doc_id=1, content="hello", tag_ids=[1], created_at=now)
+    _index_document(search_service, doc_id=2, content="hello", tag_ids=[2, 3], created_at=now)
+    _index_document(
+        search_service,
+        doc_id=3,
+        content="hello",
+        tag_ids=[3],
+        created_at=now - timedelta(days=10),
+    )
+    _index_document(search_service, doc_id=4, content="hello", tag_ids=[4], created_at=now)
+
+    items, total = search_service.search("hello", tag_ids=[1, 3])
+    assert total == 3
+    assert sorted(item["doc_id"] for item in items) == [1, 2, 3]
+
+    items, total = search_service.search(
+        "hello", date_from=now - timedelta(days=1), date_to=now
+    )
+    assert total == 3
+    assert sorted(item["doc_id"] for item in items) == [1, 2, 4]
+
+    items, total = search_service.search(
+        "hello", tag_ids=[3], date_to=now - timedelta(days=1), limit=1
+    )
+    assert total == 1
+    assert [item["doc_id"] for item in items] == [3]
+
+
+def test_filter_cache_reuses_doc_sets_until_commit(search_service: SearchService):
+    _index_document(search_service, doc_id=1, content="hello", file_type="md", tag_ids=[1])
+    _index_document(search_service, doc_id=2, content="hello", file_type="pdf", tag_ids=[1])
+
+    items, total = search_service.search("hello", file_type="pdf", tag_ids=[1])
+    assert [item["doc_id"] for item in items] == [2]
+    misses = search_service.stats()["filter_cache"]["misses"]
+
+    items, total = search_service.search("hello", file_type="pdf", tag_ids=[1], limit=5)
+    assert [item["doc_id"] for item in items] == [2]
+    stats = search_service.stats()["filter_cache"]
+    assert stats["misses"] == misses
+    assert stats["hits"] >= 1
+    assert stats["bytes"] > 0
+
+    _index_document(search_service, doc_id=3, content="hello", file_type="pdf", tag_ids=[1])
+    items, total = search_service.search("hello", file_type="pdf", tag_ids=[1])
+    assert total == 2
+    assert search_service.stats()["filter_cache"]["misses"] > misses
+
+
+def test_cursor_pages_on_older_generations_keep_the_filter_cache(
+    search_service: SearchService,
+):
+    for doc_id in range(1, 5):
+        _index_document(search_service, doc_id=doc_id, content="hello", file_type="pdf")
+    first = search_service.execute("hello", file_type="pdf", limit=2, cursor="*")
+    _index_document(search_service, doc_id=5, content="hello", file_type="pdf")
+    assert search_service.search("hello", file_type="pdf")[1] == 5
+
+    # The next page reads the pinned generation, then current searches still hit
+    rest = search_service.execute("hello", file_type="pdf", limit=2, cursor=first.next_cursor)
+    assert len(first.items + rest.items) == 4
+    misses = search_service.stats()["filter_cache"]["misses"]
+    assert search_service.search("hello", file_type="pdf", limit=3)[1] == 5
+    stats = search_service.stats()["filter_cache"]
+    assert stats["misses"] == misses and stats["invalidations"] == 0
+
+
+def test_filter_matching_nothing_returns_no_hits(search_service: SearchService):
+    _index_document(search_service, doc_id=1, content="hello", file_type="md")
+
+    items, total = search_service.search("hello", file_type="xlsx")
+    assert items == []
+    assert total == 0
+
+
+@pytest.mark.parametrize("exact_total", [True, False])
+def test_filter_matching_nothing_without_filter_cache(
+    index_dir: Path, monkeypatch: pytest.MonkeyPatch, exact_total: bool
+):
+    monkeypatch.setattr(settings, "SEARCH_FILTER_CACHE_SIZE", 0)
+    service = SearchService(index_dir=str(index_dir))
+    for doc_id in range(1, 60):
+        _index_document(service, doc_id=doc_id, content="hello world", file_type="md")
+
+    result = service.execute("hello", file_type="doc", exact_total=exact_total)
+    assert (result.items, result.total) == ([], 0)
+    assert service.execute("hello", file_type="md", exact_total=exact_total).total == 59
+    service.close()
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"tag_ids": [99]},
+        {"folder_id": 99},
+        {"date_from": datetime(2100, 1, 1)},
+        {"date_to": datetime(2000, 1, 1)},
+        {"file_type": "md", "tag_ids": [1], "date_from": datetime(2100, 1, 1)},
+    ],
+)
+def test_tag_folder_and_date_filters_matching_nothing_without_filter_cache(
+    index_dir: Path, monkeypatch: pytest.MonkeyPatch, filters: dict
+):
+    monkeypatch.setattr(settings, "SEARCH_FILTER_CACHE_SIZE", 0)
+    service = SearchService(index_dir=str(index_dir))
+    for doc_id in range(1, 60):
+        _index_document(
+            service, doc_id=doc_id, content="hello world", folder_id=1, tag_ids=[1]
+        )
+
+    for exact_total in (True, False):
+        result = service.execute("hello", exact_total=exact_total, **filters)
+        assert (result.items, result.total) == ([], 0)
+    service.close()
+
+
+def test_result_cache_serves_repeated_queries(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    _index_document(search_service, doc_id=1, content="project alpha")
+
+    first = search_service.execute("alpha")
+    assert search_service.stats()["result_cache"]["misses"] == 1
+
+    def fail_searcher(*_args, **_kwargs):
+        raise AssertionError("cached query must not open a searcher")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(search_service.backend.searchers, "searcher", fail_searcher)
+        assert search_service.execute("  alpha ") is first
+    assert search_service.stats()["result_cache"]["hits"] == 1
+
+    _index_document(search_service, doc_id=2, content="alpha beta")
+    items, total = search_service.search("alpha")
+    assert total == 2
+    assert search_service.stats()["result_cache"]["invalidations"] == 1
+
+
+def test_result_cache_separates_filters_and_pages(search_service: SearchService):
+    for doc_id in range(1, 6):
+        _index_document(
+            search_service, doc_id=doc_id, content="paged", file_type="pdf" if doc_id % 2 else "md"
+        )
+
+    _, total_all = search_service.search("paged")
+    _, total_pdf = search_service.search("paged", file_type="pdf")
+    page_one, _ = search_service.search("paged", limit=2)
+    page_two, _ = search_service.search("paged", skip=2, limit=2)
+
+    assert total_all == 5
+    assert total_pdf == 3
+    assert {item["doc_id"] for item in page_one}.isdisjoint(
+        item["doc_id"] for item in page_two
+    )
+    assert search_service.stats()["result_cache"]["hits"] == 0
+
+
+def test_searcher_pool_reuses_and_refreshes_searchers(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    # Spelling corrections read the vocabulary through the pool as well
+    monkeypatch.setattr(settings, "SEARCH_DID_YOU_MEAN_MAX_HITS", -1)
+    _index_document(search_service, doc_id=1, content="pooled")
+
+    for limit in (1, 2, 3):
+        items, total = search_service.search("pooled", limit=limit)
+        assert total == 1
+
+    stats = search_service.stats()["searchers"]
+    assert stats["created"] == 1
+    assert stats["reused"] == 2
+    assert stats["refreshed"] == 0
+    assert stats["in_use"] == 0
+
+    _index_document(search_service, doc_id=2, content="pooled again")
+    items, total = search_service.search("pooled")
+    assert total == 2
+    assert search_service.stats()["searchers"]["refreshed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_asearch_leases_separate_searchers(search_service: SearchService):
+    for doc_id in range(1, 11):
+        _index_document(search_service, doc_id=doc_id, content=f"shared term{doc_id}")
+
+    results = await asyncio.gather(
+        *(search_service.asearch("shared", skip=i, limit=1) for i in range(8))
+    )
+    assert all(result.total == 10 for result in results)
+
+    stats = search_service.stats()["searchers"]
+    assert stats["in_use"] == 0
+    assert stats["idle"] <= settings.SEARCH_SEARCHER_POOL_SIZE
+
+
+@pytest.mark.asyncio
+async def test_write_behind_coalesces_updates_into_one_commit(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "INDEX_COMMIT_INTERVAL", 30.0)
+    await search_service.start_write_behind()
+    try:
+        _index_document(search_service, doc_id=1, content="draft")
+        _index_document(search_service, doc_id=1, content="final version")
+        _index_document(search_service, doc_id=2, content="final copy")
+        _index_document(search_service, doc_id=3, content="final gone")
+        search_service.remove_document(3)
+
+        assert search_service.search("final") == ([], 0)
+
+        await search_service.flush()
+        items, total = search_service.search("final")
+        assert sorted(item["doc_id"] for item in items) == [1, 2]
+        assert search_service.search("draft")[1] == 0
+
+        stats = search_service.stats()["index_writer"]
+        assert stats["commits"] == 1
+        assert stats["committed_docs"] == 3
+        assert stats["coalesced"] == 2
+        assert stats["pending"] == 0
+    finally:
+        await search_service.stop_write_behind()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_commits_when_batch_is_full(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "INDEX_COMMIT_INTERVAL", 30.0)
+    monkeypatch.setattr(settings, "INDEX_BATCH_SIZE", 2)
+    await search_service.start_write_behind()
+    try:
+        _index_document(search_service, doc_id=1, content="batch one")
+        _index_document(search_service, doc_id=2, content="batch two")
+        for _ in range(50):
+            if search_service.stats()["index_writer"]["commits"]:
+                break
+            await asyncio.sleep(0.01)
+        assert search_service.search("batch")[1] == 2
+    finally:
+        await search_service.stop_write_behind()
+
+    # Without a running writer task updates are committed immediately
+    _index_document(search_service, doc_id=3, content="batch three")
+    assert search_service.search("batch", limit=5)[1] == 3
+
+
+@pytest.mark.asyncio
+async def test_write_behind_retries_failed_commits(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "INDEX_COMMIT_INTERVAL", 0.01)
+    apply_batch = search_service.apply_batch
+    calls = []
+
+    def flaky_apply(batch):
+        calls.append(dict(batch))
+        if len(calls) == 1:
+            raise RuntimeError("LockError")
+        apply_batch(batch)
+
+    monkeypatch.setattr(search_service, "apply_batch", flaky_apply)
+    await search_service.start_write_behind()
+    try:
+        _index_document(search_service, doc_id=1, content="retry me")
+        # The failed batch is committed again document by document
+        await search_service.flush()
+        assert search_service.search("retry")[1] == 1
+        assert search_service.stats()["index_writer"]["failures"] == 1
+    finally:
+        await search_service.stop_write_behind()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_drops_a_document_that_always_fails(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "INDEX_COMMIT_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "INDEX_MAX_ATTEMPTS", 2)
+    apply_batch = search_service.apply_batch
+
+    def reject_doc_2(batch):
+        if 2 in batch:
+            raise ValueError("analyzer error")
+        apply_batch(batch)
+
+    monkeypatch.setattr(search_service, "apply_batch", reject_doc_2)
+    await search_service.start_write_behind()
+    try:
+        for doc_id in (1, 2, 3):
+            _index_document(search_service, doc_id=doc_id, content="poison batch")
+        with pytest.raises(ValueError):
+            await search_service.flush()
+        # The others are committed at once; the bad one no longer blocks anyone
+        assert search_service.search("poison")[1] == 2
+        _index_document(search_service, doc_id=4, content="poison later")
+        for _ in range(5):
+            try:
+                await search_service.flush()
+                break
+            except ValueError:
+                pass
+
+        stats = search_service.stats()["index_writer"]
+        assert search_service.search("poison")[1] == 3
+        assert (stats["pending"], stats["dropped"]) == (0, 1)
+    finally:
+        await search_service.stop_write_behind()
+
+
+def test_warm_up_reports_phase_timings(
+    search_service: SearchService, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    cache_file = tmp_path / "jieba.cache"
+    monkeypatch.setattr(settings, "JIEBA_CACHE_FILE", str(cache_file))
+    monkeypatch.setattr(search_service_module.jieba.dt, "cache_file", None)
+    _index_document(search_service, doc_id=1, content="warm document")
+
+    timings = search_service.warm_up(["warm"])
+
+    assert set(timings) == {"jieba", "index_open", "searcher", "vocabulary", "queries"}
+    assert all(value >= 0 for value in timings.values())
+    assert search_service_module.jieba.dt.cache_file == str(cache_file)
+    assert search_service.stats()["warmup"] == timings
+    assert search_service.stats()["searchers"]["idle"] >= 1
+
+
 def test_pagination(search_service: SearchService):
     for doc_id in range(1, 26):
         _index_document(
@@ -301,6 +670,32 @@ def test_pagination(search_service: SearchService):
     ]
 
 
+def test_search_scores_only_top_k(search_service: SearchService):
+    for doc_id in range(1, 31):
+        _index_document(search_service, doc_id=doc_id, content=("topk " * doc_id).strip())
+
+    all_items, _ = search_service.search("topk", limit=100)
+    expected = [item["doc_id"] for item in all_items[5:10]]
+
+    exact = search_service.execute("topk", skip=5, limit=5)
+    assert exact.total == 30
+    assert exact.total_exact is True
+    assert [item["doc_id"] for item in exact.items] == expected
+
+    estimated = search_service.execute("topk", skip=5, limit=5, exact_total=False)
+    assert estimated.total >= 30
+    assert [item["doc_id"] for item in estimated.items] == expected
+
+
+def test_search_page_past_end_returns_total(search_service: SearchService):
+    for doc_id in range(1, 4):
+        _index_document(search_service, doc_id=doc_id, content="few hits")
+
+    result = search_service.execute("few", skip=10, limit=5)
+    assert result.items == []
+    assert result.total == 3
+
+
 @pytest.mark.asyncio
 async def test_search_endpoint(
     client: AsyncClient,
@@ -319,8 +714,13 @@ async def test_search_endpoint(
     assert response.status_code == 200
 
     payload = response.json()
-    assert set(payload) == {"items", "total", "took_ms"}
+    assert set(payload) == {
+        "items", "total", "total_exact", "did_you_mean", "facets", "next_cursor", "took_ms"
+    }
     assert payload["total"] == 1
+    assert payload["total_exact"] is True
+    assert payload["did_you_mean"] is None
+    assert payload["facets"] is None
     assert isinstance(payload["took_ms"], int)
     assert payload["took_ms"] >= 0
 
@@ -374,6 +774,60 @@ async def test_search_with_filters(client: AsyncClient, search_service: SearchSe
     assert [item["doc_id"] for item in payload["items"]] == [1]
 
 
+@pytest.mark.asyncio
+async def test_search_facets(client: AsyncClient, search_service: SearchService):
+    documents = [
+        (1, "hello", "md", 1, [1, 2], 2024),
+        (2, "hello", "pdf", 1, [2], 2023),
+        (3, "hello", "md", None, [], 2024),
+        (4, "other", "txt", 2, [3], 2022),
+    ]
+    for doc_id, content, file_type, folder_id, tag_ids, year in documents:
+        _index_document(
+            search_service,
+            doc_id=doc_id,
+            content=content,
+            file_type=file_type,
+            folder_id=folder_id,
+            tag_ids=tag_ids,
+            created_at=datetime(year, 3, 1),
+        )
+
+    response = await client.get(
+        "/api/search", params={"q": "hello", "facets": "true", "limit": 1}
+    )
+    assert response.status_code == 200
+    payload = response.json()
+    assert len(payload["items"]) == 1
+    assert payload["facets"] == {
+        "file_type": {"md": 2, "pdf": 1},
+        "folder_id": {"1": 2},
+        "tag_ids": {"2": 2, "1": 1},
+        "year": {"2024": 2, "2023": 1},
+    }
+
+    # Facets are counted within the filters
+    response = await client.get(
+        "/api/search", params={"q": "hello", "facets": "true", "tag_ids": "2"}
+    )
+    assert response.json()["facets"]["file_type"] == {"md": 1, "pdf": 1}
+
+
+@pytest.mark.asyncio
+async def test_suggest_endpoint(client: AsyncClient, search_service: SearchService):
+    _index_document(search_service, doc_id=1, content="hello help")
+    _index_document(search_service, doc_id=2, content="hello world")
+
+    response = await client.get("/api/search/suggest", params={"prefix": "hel", "limit": 5})
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["items"] == [{"term": "hello", "df": 2}, {"term": "help", "df": 1}]
+    assert payload["took_ms"] >= 0
+
+    response = await client.get("/api/search/suggest", params={"prefix": ""})
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_search_empty_query(client: AsyncClient):
     response = await client.get("/api/search", params={"q": ""})
@@ -435,11 +889,70 @@ async def test_search_runtime_error_returns_503(
     def boom(*_args, **_kwargs):
         raise RuntimeError("backend down")
 
-    monkeypatch.setattr(search_service, "search", boom)
+    monkeypatch.setattr(search_service, "execute", boom)
     response = await client.get("/api/search", params={"q": "hello"})
     assert response.status_code == 503
 
 
+@pytest.mark.asyncio
+async def test_asearch_matches_sync_search(search_service: SearchService):
+    _index_document(search_service, doc_id=1, content="hello async")
+    _index_document(search_service, doc_id=2, content="hello world")
+
+    result = await search_service.asearch("hello", limit=1)
+    assert (result.items, result.total) == search_service.search("hello", limit=1)
+
+    stats = search_service.stats()["executor"]
+    assert stats["completed"] == 1
+    assert stats["queued"] == 0
+    assert stats["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_search_executor_rejects_when_queue_full():
+    executor = SearchExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        blocker = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        waiting = asyncio.ensure_future(executor.run(lambda: "done"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SearchQueueFullError):
+            await executor.run(lambda: "rejected")
+
+        stats = executor.stats()
+        assert stats["running"] == 1
+        assert stats["queued"] == 1
+        assert stats["rejected"] == 1
+
+        release.set()
+        assert await blocker is True
+        assert await waiting == "done"
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_search_queue_full_returns_503(
+    client: AsyncClient, search_service: SearchService, monkeypatch: pytest.MonkeyPatch
+):
+    async def full(*_args, **_kwargs):
+        raise SearchQueueFullError("Search queue is full, try again later")
+
+    monkeypatch.setattr(search_service, "asearch", full)
+    response = await client.get("/api/search", params={"q": "hello"})
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_search_stats_endpoint(client: AsyncClient, search_service: SearchService):
+    response = await client.get("/api/search/stats")
+    assert response.status_code == 200
+    assert response.json()["executor"]["max_workers"] == settings.SEARCH_MAX_CONCURRENCY
+
+
 @pytest.mark.asyncio
 async def test_upload_missing_filename_returns_400(
     client: AsyncClient, search_service: SearchService
@@ -759,7 +1272,7 @@ async def test_document_service_delete_document_removes_file(
 ):
     async with test_db() as session:
         service = DocumentService(session)
-        document = await service.save_document("del.md", b"Delete me", "md")
+        document, _ = await service.save_document("del.md", b"Delete me", "md")
 
         stored_path = Path(settings.UPLOAD_DIR) / document.filename
         assert stored_path.exists() is True
@@ -776,17 +1289,19 @@ async def test_document_service_swallow_search_index_errors(
     monkeypatch: pytest.MonkeyPatch,
 ):
     class ExplodingSearchService:
-        def index_document(self, *args, **kwargs):
+        transactional = False
+
+        async def aindex_document(self, *args, **kwargs):
             raise RuntimeError("boom")
 
-        def remove_document(self, *args, **kwargs):
+        async def aremove_document(self, *args, **kwargs):
             raise RuntimeError("boom")
 
     monkeypatch.setattr(document_service_module, "get_search_service", lambda: ExplodingSearchService())
 
     async with test_db() as session:
         service = DocumentService(session)
-        document = await service.save_document("boom.md", b"Hello", "md")
+        document, _ = await service.save_document("boom.md", b"Hello", "md")
         assert document.id is not None
         assert await service.delete_document(document.id) is True
 
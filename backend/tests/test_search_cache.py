@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import pytest
+
+import app.services.search_cache as search_cache_module
+from app.services.search_cache import LRUCache, docset_size
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.75
+
+
+def test_lru_cache_bind_generation_drops_entries():
+    cache = LRUCache(maxsize=4)
+    cache.bind_generation(1)
+    cache.put((1, "x"), {1, 2})
+    cache.bind_generation(1)
+    assert cache.get((1, "x")) == {1, 2}
+
+    cache.bind_generation(2)
+    assert len(cache) == 0
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_lru_cache_ttl_expires(monkeypatch: pytest.MonkeyPatch):
+    now = [100.0]
+    monkeypatch.setattr(search_cache_module.time, "monotonic", lambda: now[0])
+
+    cache = LRUCache(maxsize=4, ttl=5)
+    cache.put("k", "v")
+    now[0] += 4
+    assert cache.get("k") == "v"
+    now[0] += 2
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_disabled_and_sized():
+    disabled = LRUCache(maxsize=0)
+    disabled.put("k", "v")
+    assert disabled.get("k") is None
+
+    cache = LRUCache(maxsize=2, sizer=docset_size)
+    cache.put("docs", {1, 2, 3})
+    assert cache.stats()["bytes"] == docset_size({1, 2, 3})
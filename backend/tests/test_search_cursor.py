@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import create_engine
+
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import Base
+from app.services.search_cursor import (
+    Cursor,
+    CursorExpiredError,
+    SnapshotPins,
+    decode_cursor,
+    encode_cursor,
+)
+from app.services.search_service import SearchService
+
+NOW = datetime.utcnow().replace(microsecond=0)
+
+
+@pytest.fixture(params=[("whoosh", 1), ("whoosh", 3), ("numpy", 1), ("sqlite", 1)])
+def service(request, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    backend, shards = request.param
+    if backend == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend, shards=shards)
+    yield service
+    service.close()
+
+
+def _index(service: SearchService, doc_id: int, content: str, age_days: float, size: int):
+    created = NOW - timedelta(days=age_days)
+    if service.backend.name == "sqlite":
+        with service.backend._conn() as conn:
+            conn.execute(
+                "INSERT INTO documents (id, filename, original_name, content_text, file_type, "
+                "file_size, created_at, updated_at) VALUES (?, 'f', 'f', ?, 'md', ?, ?, ?)",
+                (doc_id, content, size, str(created), str(created)),
+            )
+    service.index_document(doc_id, content, "md", None, [], created, file_size=size)
+
+
+def _walk(service: SearchService, query: str, limit: int, **kwargs) -> list:
+    ids, cursor = [], "*"
+    while cursor:
+        result = service.execute(query, limit=limit, cursor=cursor, **kwargs)
+        assert len(result.items) <= limit
+        ids += [item["doc_id"] for item in result.items]
+        cursor = result.next_cursor
+    return ids
+
+
+def _populate(service: SearchService, count: int = 23) -> None:
+    for doc_id in range(1, count + 1):
+        _index(service, doc_id, "report " * (doc_id % 4 + 1) + "memo", doc_id % 7, doc_id % 3)
+
+
+@pytest.mark.parametrize("sort", [None, "-created_at", "file_size", "recency"])
+def test_walking_the_cursor_visits_every_hit_in_order(service: SearchService, sort):
+    _populate(service)
+    everything = service.search("report", limit=100, sort=sort)[0]
+    ids = _walk(service, "report", 4, sort=sort)
+    assert len(ids) == len(set(ids)) == 23
+    if sort is None:
+        # Equal scores are ranked by doc_id when paging by key
+        scores = {item["doc_id"]: item["score"] for item in everything}
+        expected = sorted(scores, key=lambda d: (-round(scores[d], 6), d))
+        assert [round(scores[d], 6) for d in ids] == [round(scores[d], 6) for d in expected]
+    else:
+        assert ids == [item["doc_id"] for item in everything]
+
+
+def test_cursor_pages_ignore_documents_indexed_mid_walk(service: SearchService):
+    _populate(service, 12)
+    first = service.execute("report", limit=5, cursor="*", sort="-created_at")
+    assert first.total == 12
+
+    _index(service, 100, "report report report report", age_days=0, size=1)
+    if service.backend.name == "sqlite":
+        # Nothing is pinned: new documents ranked before the cursor are skipped
+        ids = _walk_from(service, first.next_cursor, sort="-created_at")
+        assert 100 not in ids
+        return
+    second = service.execute("report", limit=5, cursor=first.next_cursor, sort="-created_at")
+    assert second.total == 12
+    ids = [item["doc_id"] for item in first.items] + _walk_from(
+        service, first.next_cursor, sort="-created_at"
+    )
+    assert sorted(ids) == list(range(1, 13))
+    assert service.execute("report", limit=5, cursor="*").total == 13
+
+
+def _walk_from(service: SearchService, cursor: str, **kwargs) -> list:
+    ids = []
+    while cursor:
+        result = service.execute("report", limit=5, cursor=cursor, **kwargs)
+        ids += [item["doc_id"] for item in result.items]
+        cursor = result.next_cursor
+    return ids
+
+
+def test_cursors_are_tied_to_their_search(service: SearchService):
+    _populate(service, 6)
+    cursor = service.execute("report", limit=2, cursor="*").next_cursor
+    with pytest.raises(ValueError):
+        service.execute("memo", limit=2, cursor=cursor)
+    with pytest.raises(ValueError):
+        service.execute("report", limit=2, cursor=cursor, sort="doc_id")
+    with pytest.raises(ValueError):
+        service.execute("report", limit=2, cursor="not a cursor")
+    with pytest.raises(ValueError):
+        service.execute("report", skip=2, limit=2, cursor="*")
+
+
+def test_cursor_encoding_round_trips():
+    cursor = Cursor(17, "abc", (-1.25, 2**63 + 5, float("inf")))
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(Cursor(1, "abc", ("x",))))
+
+
+def test_pins_expire_and_are_shared():
+    closed = []
+
+    def opener(generation):
+        from app.services.search_backend import PinnedSnapshot
+
+        return lambda: PinnedSnapshot(generation, None, lambda: closed.append(generation))
+
+    pins = SnapshotPins(max_pins=2, ttl=60)
+    first = pins.pin(opener(1))
+    assert pins.pin(opener(1)) is first and closed == [1]
+    pins.release(first)
+    pins.release(first)
+    pins.release(pins.pin(opener(2)))
+    pins.release(pins.pin(opener(3)))
+    assert closed == [1, 1]
+    with pytest.raises(CursorExpiredError):
+        pins.acquire(1)
+    pins.release(pins.acquire(3))
+
+    pins.ttl = 0
+    with pytest.raises(CursorExpiredError):
+        pins.acquire(3)
+    pins.close()
+    assert sorted(closed) == [1, 1, 2, 3]
+
+
+def test_evicted_snapshots_stay_open_until_released():
+    from app.services.search_backend import PinnedSnapshot
+
+    closed = []
+    pins = SnapshotPins(max_pins=1, ttl=60)
+    leased = pins.pin(lambda: PinnedSnapshot(1, None, lambda: closed.append(1)))
+    again = pins.acquire(1)
+    pins.release(pins.pin(lambda: PinnedSnapshot(2, None, lambda: closed.append(2))))
+    with pytest.raises(CursorExpiredError):
+        pins.acquire(1)
+    # Evicted while two pages still read it
+    pins.release(leased)
+    assert closed == []
+    pins.release(again)
+    assert closed == [1]
+    pins.close()
+    assert closed == [1, 2]
+
+
+def test_pages_of_one_generation_search_concurrently(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="whoosh")
+    _index(service, 1, "alpha", 1, 10)
+    pool = service.backend.pin_searchers()
+    with pool.searcher() as first, pool.searcher() as second:
+        assert first is not second
+        assert first.reader().generation() == second.reader().generation()
+    assert pool.stats()["open"] == 2
+    with pool.searcher() as again:
+        assert again in (first, second)
+    pool.close()
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_search_api_cursor(client: AsyncClient, tmp_path: Path, monkeypatch):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="whoosh", shards=1)
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    for doc_id in range(1, 6):
+        _index(service, doc_id, "report", age_days=doc_id, size=1)
+
+    params = {"q": "report", "sort": "-created_at", "limit": 2}
+    response = await client.get("/api/search", params={**params, "cursor": "*"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["doc_id"] for item in body["items"]] == [1, 2]
+    assert body["total"] == 5
+
+    response = await client.get("/api/search", params={**params, "cursor": body["next_cursor"]})
+    assert [item["doc_id"] for item in response.json()["items"]] == [3, 4]
+
+    response = await client.get("/api/search", params={**params, "cursor": "bogus"})
+    assert response.status_code == 400
+    response = await client.get("/api/search", params={**params, "cursor": "*", "skip": 2})
+    assert response.status_code == 400
+
+    service._pins.close()
+    response = await client.get("/api/search", params={**params, "cursor": body["next_cursor"]})
+    assert response.status_code == 410
+    service.close()
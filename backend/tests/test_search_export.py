@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import create_engine
+
+import app.services.search_service as search_service_module
+from app.core.config import settings
+from app.core.database import Base
+from app.services.search_service import SearchService
+
+NOW = datetime(2024, 5, 1, 12, 30)
+
+
+@pytest.fixture(params=[("whoosh", 1), ("whoosh", 3), ("numpy", 1), ("sqlite", 1)])
+def service(request, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    backend, shards = request.param
+    if backend == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend, shards=shards)
+    yield service
+    service.close()
+
+
+def _index(service: SearchService, doc_id: int, content: str, file_type: str, folder_id=None):
+    created = NOW - timedelta(days=doc_id)
+    if service.backend.name == "sqlite":
+        with service.backend._conn() as conn:
+            conn.execute(
+                "INSERT INTO documents (id, filename, original_name, content_text, file_type, "
+                "file_size, folder_id, created_at, updated_at) "
+                "VALUES (?, 'f', 'f', ?, ?, ?, NULL, ?, ?)",
+                (doc_id, content, file_type, doc_id * 10, str(created), str(created)),
+            )
+    service.index_document(
+        doc_id, content, file_type, folder_id, [], created, file_size=doc_id * 10
+    )
+
+
+def test_export_yields_every_match_with_metadata(service: SearchService):
+    for doc_id in range(1, 31):
+        words = "report " * (doc_id % 3 + 1) if doc_id % 5 else "memo"
+        _index(service, doc_id, words, "md" if doc_id % 2 else "pdf")
+    service.remove_document(4)
+    if service.backend.name == "sqlite":
+        with service.backend._conn() as conn:
+            conn.execute("DELETE FROM documents WHERE id = 4")
+
+    hits = list(service.export("report"))
+    ranked, total = service.search("report", limit=100)
+    assert len(hits) == total == 23
+    scores = {item["doc_id"]: item["score"] for item in ranked}
+    assert {hit["doc_id"]: hit["score"] for hit in hits} == pytest.approx(scores)
+
+    hit = next(hit for hit in hits if hit["doc_id"] == 7)
+    assert hit == {
+        "doc_id": 7,
+        "file_type": "md",
+        "folder_id": None,
+        "created_at": (NOW - timedelta(days=7)).isoformat(),
+        "file_size": 70,
+        "score": pytest.approx(scores[7]),
+    }
+    assert {hit["doc_id"] for hit in service.export("report", file_type="pdf")} == {
+        doc_id for doc_id in scores if doc_id % 2 == 0
+    }
+    assert list(service.export("nothing")) == []
+
+
+@pytest.mark.asyncio
+async def test_abandoned_exports_release_their_snapshot(tmp_path: Path, monkeypatch):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="whoosh", shards=1)
+    monkeypatch.setattr(settings, "SEARCH_EXPORT_BATCH_SIZE", 2)
+    closed = []
+
+    def export(query, **filters):
+        try:
+            yield from ({"doc_id": doc_id} for doc_id in range(10))
+        finally:
+            closed.append(query)
+
+    monkeypatch.setattr(service, "export", export)
+    batches = service.aexport("report")
+    assert await anext(batches) == [{"doc_id": 0}, {"doc_id": 1}]
+    await batches.aclose()
+    assert closed == ["report"]
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_export_api_streams_ndjson(client: AsyncClient, tmp_path: Path, monkeypatch):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="whoosh", shards=1)
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    monkeypatch.setattr(settings, "SEARCH_EXPORT_BATCH_SIZE", 3)
+    for doc_id in range(1, 11):
+        _index(service, doc_id, "report" if doc_id != 10 else "memo", "md", folder_id=2)
+
+    response = await client.get(
+        "/api/search/export", params={"q": "report", "folder_id": 2, "type": "md"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["doc_id"] for line in lines) == list(range(1, 10))
+    assert all(line["folder_id"] == 2 and line["score"] > 0 for line in lines)
+
+    response = await client.get("/api/search/export", params={"q": "missing"})
+    assert response.status_code == 200
+    assert response.text == ""
+
+    response = await client.get("/api/search/export", params={"q": "report", "tag_ids": "x"})
+    assert response.status_code == 400
+    service.close()
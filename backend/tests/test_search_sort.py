@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient
+
+import app.services.search_service as search_service_module
+from app.services.search_backend import SearchSort
+from app.services.search_service import SearchService
+
+NOW = datetime.utcnow().replace(microsecond=0)
+
+
+@pytest.fixture(params=[("whoosh", 1), ("whoosh", 3), ("numpy", 1)])
+def service(request, tmp_path: Path):
+    backend, shards = request.param
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend, shards=shards)
+    yield service
+    service.close()
+
+
+def _index(service: SearchService, doc_id: int, content: str, age_days: float, size: int):
+    service.index_document(
+        doc_id, content, "md", None, [], NOW - timedelta(days=age_days), file_size=size
+    )
+
+
+def _ids(service: SearchService, query: str, **kwargs) -> list:
+    return [item["doc_id"] for item in service.search(query, **kwargs)[0]]
+
+
+def test_sort_parsing():
+    assert SearchSort.parse(None) is None
+    assert SearchSort.parse("relevance") is None
+    assert SearchSort.parse("-created_at") == SearchSort("created_at", True)
+    assert SearchSort.parse("doc_id") == SearchSort("doc_id", False)
+    assert SearchSort.parse("recency", half_life=7).half_life == 7
+    with pytest.raises(ValueError):
+        SearchSort.parse("content")
+    with pytest.raises(ValueError):
+        SearchSort.parse("recency", half_life=0)
+
+
+def test_results_sort_by_columns(service: SearchService):
+    _index(service, 1, "report", age_days=30, size=300)
+    _index(service, 2, "report report report", age_days=1, size=100)
+    _index(service, 3, "report draft", age_days=10, size=200)
+    _index(service, 4, "report report", age_days=10, size=200)
+    _index(service, 5, "unrelated", age_days=0, size=999)
+
+    assert _ids(service, "report", sort="-created_at") == [2, 4, 3, 1]
+    assert _ids(service, "report", sort="created_at") == [1, 4, 3, 2]
+    # Equal sizes go to the more relevant document first
+    assert _ids(service, "report", sort="-file_size") == [1, 4, 3, 2]
+    assert _ids(service, "report", sort="doc_id") == [1, 2, 3, 4]
+    assert _ids(service, "report", sort="-doc_id", skip=1, limit=2) == [3, 2]
+    assert _ids(service, "report", sort="-created_at", file_type="md", limit=1) == [2]
+
+    items, _ = service.search("report", sort="doc_id")
+    relevance = {item["doc_id"]: item["score"] for item in service.search("report")[0]}
+    assert {item["doc_id"]: item["score"] for item in items} == pytest.approx(relevance)
+
+    with pytest.raises(ValueError):
+        service.search("report", sort="size")
+
+
+def test_sorted_top_k_matches_a_full_sort(service: SearchService):
+    for doc_id in range(1, 61):
+        _index(service, doc_id, "report", age_days=(doc_id * 7) % 61, size=doc_id % 5)
+    expected = sorted(range(1, 61), key=lambda d: ((d * 7) % 61, d))
+    assert _ids(service, "report", sort="-created_at", limit=100) == expected
+    assert _ids(service, "report", sort="-created_at", skip=10, limit=5) == expected[10:15]
+    by_size = _ids(service, "report", sort="-file_size", limit=7)
+    assert by_size == sorted(range(1, 61), key=lambda d: (-(d % 5), d))[:7]
+
+
+def test_recency_trades_relevance_for_age(service: SearchService, monkeypatch):
+    _index(service, 1, "report report report report", age_days=60, size=1)
+    _index(service, 2, "report and some other words", age_days=0, size=1)
+
+    assert _ids(service, "report") == [1, 2]
+    monkeypatch.setattr(search_service_module.settings, "SEARCH_RECENCY_HALF_LIFE_DAYS", 10.0)
+    items, _ = service.search("report", sort="recency")
+    assert [item["doc_id"] for item in items] == [2, 1]
+
+    relevance = {item["doc_id"]: item["score"] for item in service.search("report")[0]}
+    decayed = {item["doc_id"]: item["score"] for item in items}
+    assert decayed[2] == pytest.approx(relevance[2], rel=1e-3)
+    assert decayed[1] == pytest.approx(relevance[1] / 64, rel=1e-3)
+
+    monkeypatch.setattr(search_service_module.settings, "SEARCH_RECENCY_HALF_LIFE_DAYS", 3650.0)
+    assert _ids(service, "report", sort="recency") == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_search_api_sort(client: AsyncClient, tmp_path: Path, monkeypatch):
+    service = SearchService(index_dir=str(tmp_path / "idx"))
+    monkeypatch.setattr(search_service_module, "_search_service", service)
+    _index(service, 1, "report", age_days=5, size=10)
+    _index(service, 2, "report", age_days=1, size=20)
+
+    response = await client.get("/api/search", params={"q": "report", "sort": "-created_at"})
+    assert response.status_code == 200
+    assert [item["doc_id"] for item in response.json()["items"]] == [2, 1]
+
+    response = await client.get("/api/search", params={"q": "report", "sort": "name"})
+    assert response.status_code == 400
+    service.close()
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import random
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.core.config import settings
+from app.models import Document
+from app.services.index_rebuild import IndexRebuilder
+from app.services.search_service import SearchService
+from app.services.sharded_backend import shard_dir, shard_for
+
+WORDS = ["自然语言处理", "机器学习", "文档", "搜索", "hello", "world", "python", "pythonic", "数据"]
+
+
+def _corpus(count: int = 80) -> dict:
+    rng = random.Random(11)
+    batch = {}
+    for doc_id in range(1, count + 1):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))
+        batch[doc_id] = SearchService.document_fields(
+            doc_id,
+            text,
+            rng.choice(["md", "pdf"]),
+            rng.choice([None, 1, 2]),
+            rng.sample([1, 2, 3], rng.randint(0, 2)),
+            datetime(2024, 1, 1 + doc_id % 28),
+        )
+    return batch
+
+
+@pytest.fixture
+def sharded(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "sharded"), backend="whoosh", shards=3)
+    yield service
+    service.close()
+
+
+def test_shard_for_is_stable_and_spreads_documents():
+    counts = Counter(shard_for(doc_id, 4) for doc_id in range(1, 4001))
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 800
+    assert shard_for(12345, 4) == shard_for(12345, 4)
+
+
+@pytest.mark.parametrize(
+    "query, filters",
+    [
+        ("自然语言", {}),
+        ("hello OR python", {}),
+        ("机器学习 NOT 数据", {}),
+        ("pyth*", {}),
+        ("hello", {"file_type": "md", "tag_ids": [1]}),
+        ("文档", {"folder_id": 1, "date_from": datetime(2024, 1, 5)}),
+    ],
+)
+def test_sharded_scores_match_a_single_index(tmp_path: Path, sharded, query, filters):
+    batch = _corpus()
+    single = SearchService(index_dir=str(tmp_path / "single"), backend="whoosh", shards=1)
+    single.apply_batch(batch)
+    sharded.apply_batch(batch)
+
+    expected = single.execute(query, limit=10, **filters)
+    actual = sharded.execute(query, limit=10, **filters)
+    assert actual.total == expected.total
+    assert [item["doc_id"] for item in actual.items] == [item["doc_id"] for item in expected.items]
+    for got, want in zip(actual.items, expected.items):
+        assert got["score"] == pytest.approx(want["score"])
+        assert got["highlight"] == want["highlight"]
+
+    second_page = sharded.execute(query, skip=5, limit=5, **filters)
+    assert second_page.items == actual.items[5:]
+    single.close()
+
+
+def test_writes_only_touch_the_owning_shard(tmp_path: Path, sharded):
+    sharded.apply_batch(_corpus(20))
+    generations = [shard.generation() for shard in sharded.backend.shards]
+
+    sharded.index_document(7, "updated text", "md", None, [], datetime(2024, 1, 1))
+    owner = shard_for(7, 3)
+    after = [shard.generation() for shard in sharded.backend.shards]
+    assert [i for i in range(3) if after[i] != generations[i]] == [owner]
+    assert sharded.search("updated")[0][0]["doc_id"] == 7
+    assert shard_dir(tmp_path / "sharded", owner).is_dir()
+
+    sharded.remove_document(7)
+    assert sharded.search("updated")[1] == 0
+    stats = sharded.segment_stats()
+    assert stats["docs"] == sum(shard["docs"] for shard in stats["shards"])
+    sharded.merge_segments(optimize=True)
+    assert sharded.segment_stats()["segments"] == 1
+
+
+def test_shards_require_the_whoosh_backend(tmp_path: Path):
+    with pytest.raises(ValueError):
+        SearchService(index_dir=str(tmp_path / "idx"), backend="numpy", shards=2)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_fills_each_shard(test_db, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    async with test_db() as session:
+        for i in range(1, 13):
+            session.add(
+                Document(
+                    filename=f"{i}.md", original_name=f"{i}.md", content_text=f"shard doc{i}",
+                    file_type="md", file_size=10, created_at=datetime(2024, 1, 1),
+                )
+            )
+        await session.commit()
+
+    index_dir = tmp_path / "search_index"
+    monkeypatch.setattr(settings, "INDEX_DIR", str(index_dir))
+    for shard in range(3):
+        rebuilder = IndexRebuilder(session_factory=test_db, procs=1, chunk_size=5, shard=(shard, 3))
+        assert rebuilder.index_dir == shard_dir(index_dir, shard)
+        await rebuilder.run()
+
+    service = SearchService(index_dir=str(index_dir), backend="whoosh", shards=3)
+    items, total = service.search("shard", limit=20)
+    assert total == 12
+    assert sorted(item["doc_id"] for item in items) == list(range(1, 13))
+    for shard, backend in enumerate(service.backend.shards):
+        docs = backend.segment_stats()["docs"]
+        assert docs == sum(1 for i in range(1, 13) if shard_for(i, 3) == shard)
+    service.close()
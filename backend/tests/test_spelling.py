@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.core.config import settings
+from app.services.search_service import SearchService
+from app.services.spelling import SpellCorrector, correct_query, edit_distance
+
+
+def test_edit_distance_counts_transpositions_and_stops_at_the_limit():
+    assert edit_distance("python", "python", 2) == 0
+    assert edit_distance("pyhton", "python", 2) == 1
+    assert edit_distance("pythn", "python", 2) == 1
+    assert edit_distance("pthn", "python", 2) == 2
+    assert edit_distance("java", "python", 2) == 3
+
+
+def test_corrector_follows_vocabulary_changes():
+    corrector = SpellCorrector(max_distance=2, prefix_length=7)
+    df = {"python": 5, "pythonic": 1, "elasticsearch": 2, "机器学习": 3}
+    corrector.update(df, [])
+
+    assert corrector.lookup("pyhton", df) == "python"
+    assert corrector.lookup("python", df) is None  # already the most frequent
+    assert corrector.lookup("pythonic", df) is None  # a real word, two edits from "python"
+    assert corrector.lookup("elastcsearch", df) == "elasticsearch"
+    assert corrector.lookup("机器学系", df) == "机器学习"
+    assert corrector.lookup("py", df) is None  # too short to guess
+    assert corrector.lookup("qwerty", df) is None
+
+    del df["python"]
+    corrector.update([], ["python"])
+    assert corrector.lookup("pyhton", df) is None
+    assert corrector.lookup("pythonc", df) == "pythonic"
+    assert SpellCorrector(max_distance=0).lookup("pyhton", df) is None
+
+
+def test_corrector_updates_shared_buckets_in_one_pass():
+    corrector = SpellCorrector(max_distance=1, prefix_length=7)
+    # Every term shares its 7-character prefix bucket
+    words = [f"abcdefg{i:05d}" for i in range(20000)]
+    corrector.update(words, [])
+    assert len(corrector._index["abcdefg"]) == 20000
+    assert isinstance(corrector._index["abcdefg"], tuple)
+
+    # Removing and re-adding a term in one update keeps it
+    corrector.update(["abcdefg00001"], words[:10000])
+    assert sorted(corrector._index["abcdefg"]) == ["abcdefg00001"] + words[10000:]
+
+
+def test_correct_query_keeps_the_query_syntax():
+    fixes = {"pyhton": "python", "wrold": "world"}.get
+    assert correct_query('pyhton AND (hello OR wrold) NOT "x" pyth*', fixes) == (
+        'python AND (hello OR world) NOT "x" pyth*'
+    )
+    assert correct_query("hello world", fixes) is None
+
+
+@pytest.mark.parametrize("backend", ["whoosh", "numpy"])
+def test_low_hit_searches_suggest_a_correction(tmp_path: Path, backend):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend)
+    when = datetime(2024, 1, 1)
+    for doc_id in range(1, 4):
+        service.index_document(doc_id, "elasticsearch python 教程", "md", None, [], when)
+    service.index_document(4, "pyhton typo", "md", None, [], when)
+
+    result = service.execute("elastcsearch")
+    assert result.total == 0
+    assert result.did_you_mean == "elasticsearch"
+    # The typo made it into a document, but the correction matches more
+    assert service.execute("pyhton").did_you_mean == "python"
+    assert service.execute("pyhton 教程").did_you_mean == "python 教程"
+    assert service.execute("typo").did_you_mean is None
+    assert service.execute("python").did_you_mean is None
+    # The correction must find something within the same filters
+    assert service.execute("elastcsearch", file_type="pdf").did_you_mean is None
+
+    service.index_document(5, "elastcsearch", "md", None, [], when)
+    assert service.execute("elastcsearch").did_you_mean == "elasticsearch"
+    service.close()
+
+
+def test_corrections_can_be_disabled(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "SEARCH_SPELL_MAX_DISTANCE", 0)
+    service = SearchService(index_dir=str(tmp_path / "idx"))
+    service.index_document(1, "elasticsearch", "md", None, [], datetime(2024, 1, 1))
+    assert service.execute("elastcsearch").did_you_mean is None
+    service.close()
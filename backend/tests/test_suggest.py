@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from app.services.search_service import SearchService
+from app.services.suggest import TermSuggester
+
+
+def test_suggester_merges_segments_incrementally():
+    suggester = TermSuggester()
+    suggester.refresh(1, [("a", [("python", 3), ("pythonic", 1), ("，", 5)])])
+    assert suggester.suggest("py") == [("python", 3), ("pythonic", 1)]
+    assert suggester.suggest("，") == []
+
+    suggester.refresh(2, [("a", None), ("b", [("pyramid", 2), ("python", 1)])])
+    assert suggester.suggest("py") == [("python", 4), ("pyramid", 2), ("pythonic", 1)]
+    assert suggester.segments_read == 2
+
+    # "a" and "b" merged into "c"; "pythonic" only lived in deleted documents
+    suggester.refresh(3, [("c", [("pyramid", 2), ("python", 4)])])
+    assert suggester.suggest("py", limit=1) == [("python", 4)]
+    assert suggester.suggest("py") == [("python", 4), ("pyramid", 2)]
+    assert suggester.stats()["terms"] == 2
+
+    suggester.refresh(3, [])  # same generation: nothing to do
+    assert suggester.refreshes == 3
+
+
+@pytest.mark.parametrize("backend, shards", [("whoosh", 1), ("whoosh", 3), ("numpy", 1)])
+def test_suggestions_follow_commits(tmp_path: Path, backend, shards):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend=backend, shards=shards)
+    when = datetime(2024, 1, 1)
+    service.index_document(1, "自然语言处理 python", "md", None, [], when)
+    service.index_document(2, "自然语言 pythonic", "md", None, [], when)
+
+    terms = [item["term"] for item in service.suggest("自然")]
+    assert terms[:2] == ["自然", "自然语言"]
+    assert service.suggest("语")[0] == {"term": "语言", "df": 2}
+    assert service.suggest("pyth") == [
+        {"term": "python", "df": 1},
+        {"term": "pythonic", "df": 1},
+    ]
+
+    service.index_document(3, "python 文档", "md", None, [], when)
+    assert service.suggest("pyth")[0] == {"term": "python", "df": 2}
+    assert service.stats()["suggest"]["generation"] == service.backend.generation()
+
+    service.merge_segments(optimize=True)
+    assert service.suggest("pyth")[0] == {"term": "python", "df": 2}
+    assert service.suggest("   ") == []
+    service.close()
+
+
+def test_suggest_answers_within_milliseconds(tmp_path: Path):
+    service = SearchService(index_dir=str(tmp_path / "idx"), backend="numpy")
+    words = [f"term{i:05d}" for i in range(20000)]
+    batch = {
+        doc_id: SearchService.document_fields(
+            doc_id, " ".join(words[doc_id::200]), "md", None, [], datetime(2024, 1, 1)
+        )
+        for doc_id in range(200)
+    }
+    service.apply_batch(batch)
+    service.suggest("t")  # builds the term list
+
+    for prefix in ["t", "term1", "term19", "x"]:
+        started = time.perf_counter()
+        service.suggest(prefix)
+        assert (time.perf_counter() - started) * 1000 < 50
+    assert len(service.suggest("term1", limit=20)) == 20
+    service.close()
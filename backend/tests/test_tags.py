@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+from types import SimpleNamespace
+
 import pytest
 from httpx import ASGITransport, AsyncClient
 
 from app.main import app
 from app.models import Document, Tag
 from app.models.document import document_tags
+from app.services.search_service import SearchService
 from app.services.tag_service import TagService
 from sqlalchemy import insert, select
 from tests.conftest import test_db  # noqa: F401
@@ -420,12 +423,60 @@ async def test_batch_remove_tags_skips_missing_documents(test_db):
         assert result["removed"] == 0
 
 
+class _RecordingSearchService:
+    transactional = False
+    backend = SimpleNamespace(available=True)
+    document_fields = staticmethod(SearchService.document_fields)
+
+    def __init__(self):
+        self.batches = []
+
+    async def asubmit_many(self, batch):
+        self.batches.append(batch)
+
+
+@pytest.mark.asyncio
+async def test_batch_tag_changes_are_indexed_in_one_batch(test_db, monkeypatch):
+    import app.services.tag_service as tag_service_module
+
+    search = _RecordingSearchService()
+    monkeypatch.setattr(tag_service_module, "get_search_service", lambda: search)
+
+    async with test_db() as session:
+        service = TagService(session)
+        first = await service.create_tag("OneBatchFirst")
+        second = await service.create_tag("OneBatchSecond")
+        docs = [
+            Document(filename=f"onebatch{i}.md", original_name=f"onebatch{i}.md",
+                     file_type="md", file_size=1)
+            for i in range(3)
+        ]
+        session.add_all(docs)
+        await session.commit()
+        ids = [doc.id for doc in docs]
+
+        await service.batch_add_tags(ids, [first.id, second.id])
+        assert len(search.batches) == 1
+        assert set(search.batches[0]) == set(ids)
+        assert {fields["tag_ids"] for fields in search.batches[0].values()} == {
+            ",".join(str(t) for t in sorted([first.id, second.id]))
+        }
+
+        await service.batch_remove_tags(ids, [first.id])
+        assert len(search.batches) == 2
+        assert {fields["tag_ids"] for fields in search.batches[1].values()} == {str(second.id)}
+
+        await service.delete_tag(second.id)
+        assert len(search.batches) == 3
+        assert {fields["tag_ids"] for fields in search.batches[2].values()} == {""}
+
+
 @pytest.mark.asyncio
 async def test_batch_add_tags_ignores_reindex_errors(test_db, monkeypatch):
     import app.services.tag_service as tag_service_module
 
-    class _FailingSearchService:
-        def index_document(self, **_kwargs):
+    class _FailingSearchService(_RecordingSearchService):
+        async def asubmit_many(self, batch):
             raise RuntimeError("boom")
 
     monkeypatch.setattr(
@@ -457,8 +508,8 @@ async def test_batch_add_tags_ignores_reindex_errors(test_db, monkeypatch):
 async def test_batch_remove_tags_ignores_reindex_errors(test_db, monkeypatch):
     import app.services.tag_service as tag_service_module
 
-    class _FailingSearchService:
-        def index_document(self, **_kwargs):
+    class _FailingSearchService(_RecordingSearchService):
+        async def asubmit_many(self, batch):
             raise RuntimeError("boom")
 
     monkeypatch.setattr(
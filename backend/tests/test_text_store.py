@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from app.services.highlighter import OffsetHighlighter
+from app.services.text_store import TextStore
+
+
+def test_text_store_reads_slices_across_blocks(tmp_path: Path):
+    store = TextStore(tmp_path / TextStore.FILENAME, block_chars=8)
+    text = "零一二三四五六七八九" * 5
+    store.put(1, text)
+
+    stored = store.get(1)
+    assert len(stored) == len(text)
+    assert stored[6:19] == text[6:19]
+    assert stored[-3:] == text[-3:]
+    assert stored[0] == text[0]
+    assert str(stored) == text
+    assert store.get(2) is None
+    with pytest.raises(ValueError):
+        stored[::2]
+    store.close()
+
+
+def test_highlighting_stored_text_reads_its_blocks_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    store = TextStore(tmp_path / TextStore.FILENAME, block_chars=16)
+    text = "alpha " + "filler " * 40 + "omega " + "filler " * 40 + "alpha omega"
+    store.put(1, text)
+    reads = []
+    read_blocks = store.read_blocks
+
+    def counted(doc_id, blocks):
+        reads.append(blocks)
+        return read_blocks(doc_id, blocks)
+
+    monkeypatch.setattr(store, "read_blocks", counted)
+
+    stored = store.get(1)
+    spans = [(0, 5), (286, 291), (len(text) - 11, len(text))]
+    highlighter = OffsetHighlighter(context_chars=10, max_fragments=3)
+    assert highlighter.render(stored, spans) == highlighter.render(text, spans)
+    assert len(reads) == 1
+    store.close()
+
+
+def test_text_store_replaces_and_deletes(tmp_path: Path):
+    store = TextStore(tmp_path / TextStore.FILENAME, block_chars=4)
+    store.put_many([(1, "a" * 20), (2, "second")])
+    store.put(1, "short")
+    store.put(3, "")
+
+    assert str(store.get(1)) == "short"
+    assert not store.get(3)
+    store.delete_many([2])
+    assert store.get(2) is None
+
+    stats = store.stats()
+    assert stats["docs"] == 2
+    assert stats["chars"] == 5
+    assert 0 < stats["compressed_bytes"] <= stats["file_bytes"]
+    store.close()
+
+
+def test_text_store_compresses_repetitive_text(tmp_path: Path):
+    store = TextStore(tmp_path / TextStore.FILENAME)
+    store.put(1, "重复的内容 " * 5000)
+    stats = store.stats()
+    assert stats["compressed_bytes"] * 10 < len(("重复的内容 " * 5000).encode("utf-8"))
+    store.close()
+
+
+def test_text_store_threads_use_their_own_connections(tmp_path: Path):
+    store = TextStore(tmp_path / TextStore.FILENAME)
+    store.put(1, "shared text")
+    results = []
+
+    def read() -> None:
+        results.append(store.get(1)[0:6])
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["shared"] * 4
+    assert len(store._connections) == 5
+    store.close()
+
+
+def test_text_store_reconnects_after_directory_swap(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    live_dir, build_dir = tmp_path / "index", tmp_path / "index.rebuild"
+    store = TextStore(live_dir / TextStore.FILENAME)
+    store.put(1, "old text")
+
+    replacement = TextStore(build_dir / TextStore.FILENAME)
+    replacement.put(1, "new text")
+    replacement.close()
+    os.rename(live_dir, tmp_path / "index.old")
+    os.rename(build_dir, live_dir)
+
+    # Reads reuse the connection without touching the file system
+    stats = []
+    stat = os.stat
+
+    def counted(*args, **kwargs):
+        stats.append(args)
+        return stat(*args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", counted)
+    assert str(store.get(1)) == "old text"
+    assert stats == []
+    store.refresh()
+    assert str(store.get(1)) == "new text"
+    store.close()
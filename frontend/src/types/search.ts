@@ -17,6 +17,7 @@ export type SearchResultItem = {
 export type SearchResponse = {
   items: SearchResultItem[];
   total: number;
+  total_exact?: boolean;
   took_ms: number;
 };
 